@@ -1,5 +1,6 @@
 import memobase_server.env
 import os
+import asyncio
 
 # Done setting up env
 from contextlib import asynccontextmanager
@@ -15,6 +16,9 @@ from memobase_server.env import LOG
 from memobase_server.llms.embeddings import check_embedding_sanity
 from memobase_server.llms import llm_sanity_check
 from memobase_server.api_layer.docs import API_X_CODE_DOCS
+from memobase_server.auth.token import listen_project_auth_invalidation
+from memobase_server.telemetry.capture_key import INT_KEY_AGGREGATOR
+from memobase_server.controllers.billing import run_billing_reconciler
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
 
@@ -23,8 +27,18 @@ async def lifespan(app: FastAPI):
     init_redis_pool()
     await check_embedding_sanity()
     await llm_sanity_check()
+    auth_listener = asyncio.create_task(listen_project_auth_invalidation())
+    flushers = [
+        asyncio.create_task(INT_KEY_AGGREGATOR.run()),
+        asyncio.create_task(run_billing_reconciler()),
+    ]
     LOG.info(f"Start Memobase Server {memobase_server.__version__} 🖼️")
     yield
+    auth_listener.cancel()
+    # Cancelled flushers write their pending counts once more
+    for task in flushers:
+        task.cancel()
+    await asyncio.gather(*flushers, return_exceptions=True)
     await close_connection()
 
 
@@ -278,12 +292,9 @@ router.post(
 )(api_layer.roleplay.infer_proactive_topics)
 
 
-@app.middleware("http")
-async def global_wrapper_middleware(request, call_next):
-    return await api_layer.middleware.global_wrapper_middleware(request, call_next)
-
-
 app.include_router(router)
+# The last added middleware runs first: auth, then the access log
+app.add_middleware(api_layer.middleware.GlobalWrapperMiddleware)
 app.add_middleware(api_layer.middleware.AuthMiddleware)
 
 FastAPIInstrumentor.instrument_app(app)
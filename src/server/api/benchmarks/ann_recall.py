@@ -0,0 +1,156 @@
+"""
+Compare exact and ANN (hnsw/ivfflat) cosine search on pgvector.
+
+Loads random vectors into a scratch table, spread over `--users` users like
+`user_event_gists`, then runs the same per-user top-k query with and without
+the index and reports recall@k and latency.
+
+    python benchmarks/ann_recall.py --rows 200000 --users 200 --index hnsw
+"""
+
+import os
+import time
+import argparse
+import dotenv
+import numpy as np
+from sqlalchemy import create_engine, text
+from pgvector.psycopg2 import register_vector
+
+dotenv.load_dotenv()
+
+TABLE = "bench_ann_recall"
+
+
+def percentile(values: list[float], p: float) -> float:
+    return float(np.percentile(np.array(values), p))
+
+
+def setup_table(conn, args, rng: np.random.Generator):
+    conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    conn.execute(
+        text(
+            f"CREATE TABLE {TABLE} (id bigserial PRIMARY KEY, user_id int NOT NULL, "
+            f"embedding vector({args.dim}))"
+        )
+    )
+    cursor = conn.connection.cursor()
+    for start in range(0, args.rows, args.batch):
+        size = min(args.batch, args.rows - start)
+        vectors = rng.standard_normal((size, args.dim)).astype(np.float32)
+        users = rng.integers(0, args.users, size)
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (user_id, embedding) VALUES (%s, %s)",
+            [(int(u), v) for u, v in zip(users, vectors)],
+        )
+    conn.execute(text(f"CREATE INDEX ON {TABLE} (user_id)"))
+
+    build_start = time.perf_counter()
+    if args.index == "hnsw":
+        conn.execute(
+            text(
+                f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+            )
+        )
+    else:
+        conn.execute(
+            text(
+                f"CREATE INDEX ON {TABLE} USING ivfflat (embedding vector_cosine_ops) "
+                f"WITH (lists = {args.lists})"
+            )
+        )
+    conn.execute(text(f"ANALYZE {TABLE}"))
+    print(f"Index build ({args.index}): {time.perf_counter() - build_start:.2f}s")
+
+
+def search(conn, settings: list[str], query: np.ndarray, user_id: int, topk: int):
+    with conn.begin():
+        for s in settings:
+            conn.execute(text(s))
+        start = time.perf_counter()
+        rows = conn.execute(
+            text(
+                f"SELECT id FROM {TABLE} WHERE user_id = :user_id "
+                f"ORDER BY embedding <=> :query LIMIT :topk"
+            ),
+            {"user_id": user_id, "query": query, "topk": topk},
+        ).all()
+        cost = time.perf_counter() - start
+    return [r.id for r in rows], cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument("--index", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--lists", type=int, default=100)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10, 20])
+    parser.add_argument("--no-iterative-scan", action="store_true")
+    parser.add_argument("--keep-table", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        register_vector(conn.connection.dbapi_connection)
+        setup_table(conn, args, rng)
+
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    query_users = rng.integers(0, args.users, args.queries)
+
+    if args.index == "hnsw":
+        knob = "hnsw.ef_search"
+        values = args.ef_search
+        iterative = "SET LOCAL hnsw.iterative_scan = strict_order"
+    else:
+        knob = "ivfflat.probes"
+        values = args.probes
+        iterative = "SET LOCAL ivfflat.iterative_scan = relaxed_order"
+
+    with engine.connect() as conn:
+        register_vector(conn.connection.dbapi_connection)
+
+        exact_ids, exact_costs = [], []
+        for q, u in zip(queries, query_users):
+            ids, cost = search(
+                conn, ["SET LOCAL enable_indexscan = off"], q, int(u), args.topk
+            )
+            exact_ids.append(set(ids))
+            exact_costs.append(cost)
+        print(
+            f"exact      p50 {percentile(exact_costs, 50) * 1000:.2f}ms "
+            f"p95 {percentile(exact_costs, 95) * 1000:.2f}ms"
+        )
+
+        for value in values:
+            settings = [f"SET LOCAL {knob} = {value}"]
+            if not args.no_iterative_scan:
+                settings.append(iterative)
+            recalls, costs = [], []
+            for q, u, truth in zip(queries, query_users, exact_ids):
+                ids, cost = search(conn, settings, q, int(u), args.topk)
+                recalls.append(len(truth & set(ids)) / max(len(truth), 1))
+                costs.append(cost)
+            print(
+                f"{knob}={value:<4} recall@{args.topk} {np.mean(recalls):.3f} "
+                f"p50 {percentile(costs, 50) * 1000:.2f}ms "
+                f"p95 {percentile(costs, 95) * 1000:.2f}ms"
+            )
+
+        if not args.keep_table:
+            with conn.begin():
+                conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
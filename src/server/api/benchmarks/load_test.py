@@ -0,0 +1,175 @@
+"""
+Open-loop load test of the write and read paths of a running server:
+`/blobs/insert`, `/users/buffer` flush (waiting for the processing) and
+`/users/context`, each driven at its own target QPS.
+
+Start the server with the fake providers so it needs no model endpoint and the
+numbers only move with Memobase itself, against a local Postgres/Redis:
+
+    # config.yaml
+    llm_style: "fake"
+    embedding_provider: "fake"
+    fake_llm_latency_ms: 800
+
+    uvicorn api:app --port 8019 --workers 1
+    python benchmarks/load_test.py --url http://localhost:8019 --token $ACCESS_TOKEN
+
+Requests are sent on schedule whether or not the previous ones returned, so a
+slow server shows up as latency instead of as a lower request rate. Use
+`--json` to keep the report and `--max-p99-ms`/`--max-error-rate` to fail CI
+runs on regressions.
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+CHATS = [
+    "I just moved to Berlin for a new backend job, still looking for a gym.",
+    "My sister is visiting next week, we want to try some spicy noodles.",
+    "Started training for a half marathon, my knee hurts a bit after long runs.",
+    "Watched a science fiction movie last night, the ending was great.",
+    "I'm learning German in the evenings, it's slow but fun.",
+]
+
+
+def chat_blob() -> dict:
+    return {
+        "blob_type": "chat",
+        "blob_data": {
+            "messages": [
+                {"role": "user", "content": random.choice(CHATS)},
+                {"role": "assistant", "content": "That sounds nice, tell me more!"},
+            ]
+        },
+    }
+
+
+def endpoints(user_ids: list[str]) -> dict:
+    # name -> function sending one request
+    def pick():
+        return random.choice(user_ids)
+
+    return {
+        "insert": lambda client: client.post(
+            f"/api/v1/blobs/insert/{pick()}", json=chat_blob()
+        ),
+        "flush": lambda client: client.post(
+            f"/api/v1/users/buffer/{pick()}/chat", params={"wait_process": True}
+        ),
+        "context": lambda client: client.get(f"/api/v1/users/context/{pick()}"),
+    }
+
+
+async def run_endpoint(
+    client: httpx.AsyncClient, send, qps: float, duration: float
+) -> dict:
+    latencies: list[float] = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            response = await send(client)
+            ok = response.status_code == 200 and response.json()["errno"] == 0
+        except (httpx.HTTPError, ValueError, KeyError):
+            # ValueError/KeyError: not our JSON, e.g. a proxy's 502 page
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors += 1
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(qps * duration)):
+        delay = start + i / qps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one()))
+    await asyncio.gather(*tasks)
+    cost = time.perf_counter() - start
+
+    if not latencies:
+        return {"requests": 0, "errors": 0, "throughput": 0}
+    values = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": (len(latencies) - errors) / cost,
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+async def main(args: argparse.Namespace) -> int:
+    qps = {"insert": args.insert_qps, "flush": args.flush_qps, "context": args.context_qps}
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        limits=httpx.Limits(max_connections=args.max_connections),
+        timeout=args.timeout,
+    ) as client:
+        user_ids = []
+        for _ in range(args.users):
+            response = await client.post("/api/v1/users", json={})
+            user_ids.append(response.json()["data"]["id"])
+        # Every user has something to flush and some context to return
+        for user_id in user_ids:
+            await client.post(f"/api/v1/blobs/insert/{user_id}", json=chat_blob())
+
+        calls = endpoints(user_ids)
+        results = await asyncio.gather(
+            *[
+                run_endpoint(client, calls[name], qps[name], args.duration)
+                for name in calls
+                if qps[name] > 0
+            ]
+        )
+        report = dict(zip([name for name in calls if qps[name] > 0], results))
+
+        for user_id in user_ids:
+            await client.delete(f"/api/v1/users/{user_id}")
+
+    failed = []
+    for name, r in report.items():
+        if not r["requests"]:
+            continue
+        print(
+            f"{name:<8} {r['throughput']:>8.1f} req/s  p50 {r['p50']:.1f}ms  "
+            f"p95 {r['p95']:.1f}ms  p99 {r['p99']:.1f}ms  "
+            f"errors {r['errors']}/{r['requests']}"
+        )
+        if args.max_p99_ms is not None and r["p99"] > args.max_p99_ms:
+            failed.append(f"{name} p99 {r['p99']:.1f}ms > {args.max_p99_ms}ms")
+        if r["errors"] / r["requests"] > args.max_error_rate:
+            failed.append(f"{name} error rate {r['errors'] / r['requests']:.2%}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    for reason in failed:
+        print(f"FAILED: {reason}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8019")
+    parser.add_argument("--token", default="secret")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--insert-qps", type=float, default=20)
+    parser.add_argument("--flush-qps", type=float, default=2)
+    parser.add_argument("--context-qps", type=float, default=20)
+    parser.add_argument("--max-connections", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", default=None, help="Write the report to this file")
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    sys.exit(asyncio.run(main(parser.parse_args())))
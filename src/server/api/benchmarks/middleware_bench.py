@@ -0,0 +1,82 @@
+"""
+Requests/sec through the middleware stack on `/api/v1/healthcheck` and
+`/api/v1/users/profile/{user_id}` of a running server.
+
+Run it once against a server started from the commit before the pure ASGI
+middleware and once against the current one, with the same worker count:
+
+    uvicorn api:app --port 8019 --workers 1
+    python benchmarks/middleware_bench.py --url http://localhost:8019 --token $ACCESS_TOKEN
+"""
+
+import time
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+
+async def run_path(
+    client: httpx.AsyncClient, path: str, concurrency: int, duration: float
+) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or response.json()["errno"] != 0:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    cost = time.perf_counter() - start
+    values = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / cost,
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+async def main(args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        limits=limits,
+        timeout=30,
+    ) as client:
+        user_id = args.user_id
+        if user_id is None:
+            response = await client.post("/api/v1/users", json={})
+            user_id = response.json()["data"]["id"]
+        paths = ["/api/v1/healthcheck", f"/api/v1/users/profile/{user_id}"]
+
+        for path in paths:
+            # Warm up connections, auth caches and the profile cache
+            await run_path(client, path, args.concurrency, 1)
+            r = await run_path(client, path, args.concurrency, args.duration)
+            print(
+                f"{path:<60} {r['rps']:>9.1f} req/s  p50 {r['p50']:.2f}ms  "
+                f"p99 {r['p99']:.2f}ms  errors {r['errors']}/{r['requests']}"
+            )
+
+        if args.user_id is None:
+            await client.delete(f"/api/v1/users/{user_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8019")
+    parser.add_argument("--token", default="secret")
+    parser.add_argument("--user-id", default=None, help="Default to a new user")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""
+Latency and quality of the two profile filter methods, `llm` and `embedding`,
+on the Locomo questions, through `GET /api/v1/users/profile/{user_id}?chats_str=...`.
+
+Ingest the Locomo conversations first with the benchmark in
+`docs/experiments/locomo-benchmark` (`make run-memobase-add`), against a server
+started with `enable_profile_embedding: true`, then:
+
+    python benchmarks/profile_ranking.py --url http://localhost:8019 --token $ACCESS_TOKEN \
+        --dataset ../../../docs/experiments/locomo-benchmark/dataset/locomo10.json
+
+Quality has no labels to compare against, so two proxies are reported:
+- answer recall: share of questions whose answer tokens are mostly found in the
+  picked profiles of either speaker
+- agreement: mean Jaccard overlap of the embedding picks with the LLM picks
+"""
+
+import re
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+METHODS = ["llm", "embedding"]
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+def string_to_uuid(s: str, salt="memobase_client") -> str:
+    # Same user ids as docs/experiments/locomo-benchmark
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, s + salt))
+
+
+def answer_found(answer: str, contents: list[str], min_ratio: float = 0.5) -> bool:
+    answer_tokens = set(TOKEN_REGEX.findall(str(answer).lower()))
+    if not answer_tokens:
+        return False
+    found = set(TOKEN_REGEX.findall(" ".join(contents).lower()))
+    return len(answer_tokens & found) / len(answer_tokens) >= min_ratio
+
+
+async def pick_profiles(
+    client: httpx.AsyncClient, user_id: str, question: str, method: str, topk: int
+) -> tuple[float, list[dict]]:
+    start = time.perf_counter()
+    response = await client.get(
+        f"/api/v1/users/profile/{user_id}",
+        params={
+            "chats_str": json.dumps([{"role": "user", "content": question}]),
+            "profile_filter_method": method,
+            "topk": topk,
+        },
+    )
+    cost = time.perf_counter() - start
+    d = response.json()
+    if d["errno"] != 0:
+        raise RuntimeError(d["errmsg"])
+    return cost * 1000, d["data"]["profiles"]
+
+
+async def main(args: argparse.Namespace):
+    with open(args.dataset) as f:
+        dataset = json.load(f)
+    results = {m: {"latency": [], "found": []} for m in METHODS}
+    agreement = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_question(speaker_ids: list[str], qa: dict):
+        async with semaphore:
+            picked = {}
+            for method in METHODS:
+                contents, ids = [], set()
+                for user_id in speaker_ids:
+                    latency, profiles = await pick_profiles(
+                        client, user_id, qa["question"], method, args.topk
+                    )
+                    results[method]["latency"].append(latency)
+                    contents.extend(p["content"] for p in profiles)
+                    ids.update(p["id"] for p in profiles)
+                results[method]["found"].append(answer_found(qa["answer"], contents))
+                picked[method] = ids
+            union = picked["llm"] | picked["embedding"]
+            if union:
+                agreement.append(len(picked["llm"] & picked["embedding"]) / len(union))
+
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=120,
+    ) as client:
+        tasks = []
+        for idx, item in enumerate(dataset[: args.max_conversations]):
+            conversation = item["conversation"]
+            speaker_ids = [
+                string_to_uuid(f"{conversation[s]}_{idx}")
+                for s in ("speaker_a", "speaker_b")
+            ]
+            for qa in item["qa"][: args.max_questions]:
+                if "answer" not in qa:
+                    # Adversarial questions have no answer
+                    continue
+                tasks.append(run_question(speaker_ids, qa))
+        await asyncio.gather(*tasks)
+
+    for method in METHODS:
+        latency = np.array(results[method]["latency"])
+        print(
+            f"{method:<10} p50 {np.percentile(latency, 50):8.1f}ms  "
+            f"p95 {np.percentile(latency, 95):8.1f}ms  "
+            f"answer recall {np.mean(results[method]['found']):.2%}  "
+            f"({len(results[method]['found'])} questions)"
+        )
+    print(f"agreement of the picks (Jaccard): {np.mean(agreement):.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8019")
+    parser.add_argument("--token", default="secret")
+    parser.add_argument(
+        "--dataset",
+        default="../../../docs/experiments/locomo-benchmark/dataset/locomo10.json",
+    )
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-conversations", type=int, default=None)
+    parser.add_argument("--max-questions", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -40,32 +40,21 @@ async def insert_blob(
         ).to_response(res.IdResponse)
 
     try:
-        insert_result = await controllers.blob.insert_blob(
+        # blob, buffer row and buffer size check share one transaction
+        p = await controllers.buffer.insert_blob_and_detect_buffer(
             user_id, project_id, blob_data
         )
-        if not insert_result.ok():
-            return insert_result.to_response(res.BaseResponse)
-        bid = insert_result.data().id
-
-        pb = await controllers.buffer.insert_blob_to_buffer(
-            user_id, project_id, bid, blob_data.to_blob()
-        )
-        if not pb.ok():
-            return pb.to_response(res.BaseResponse)
-
-        process_ids = await controllers.buffer.detect_buffer_full_or_not(
-            user_id, project_id, blob_data.blob_type
-        )
-        if not process_ids.ok():
-            return process_ids.to_response(res.BaseResponse)
+        if not p.ok():
+            return p.to_response(res.BaseResponse)
+        blob_id_data, process_ids = p.data()
 
         final_results = []
         # need to process buffer
-        if process_ids.data() is not None and len(process_ids.data().ids):
+        if len(process_ids.ids):
             if wait_process:
                 # sync
                 p = await controllers.buffer.flush_buffer_by_ids(
-                    user_id, project_id, blob_data.blob_type, process_ids.data().ids
+                    user_id, project_id, blob_data.blob_type, process_ids.ids
                 )
                 if not p.ok():
                     return p.to_response(res.BaseResponse)
@@ -78,7 +67,7 @@ async def insert_blob(
                     user_id,
                     project_id,
                     blob_data.blob_type,
-                    process_ids.data().ids,
+                    process_ids.ids,
                 )
     except Exception as e:
         TRACE_LOG.error(
@@ -94,7 +83,7 @@ async def insert_blob(
         project_id=project_id,
     )
     return res.BlobInsertResponse(
-        data={**insert_result.data().model_dump(), "chat_results": final_results}
+        data={**blob_id_data.model_dump(), "chat_results": final_results}
     )
 
 
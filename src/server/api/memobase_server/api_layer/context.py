@@ -1,4 +1,5 @@
 import json
+from typing import Literal
 
 from ..controllers import full as controllers
 
@@ -7,6 +8,7 @@ from ..models.utils import Promise
 from ..models import response as res
 from fastapi import Request
 from fastapi import Path, Query
+from fastapi.responses import StreamingResponse
 
 
 async def get_user_context(
@@ -91,6 +93,31 @@ Unless the user has relevant queries, do not actively mention those memories in
         False,
         description="If set to `True`, Memobase will fill the token window with the rest events.",
     ),
+    stream: bool = Query(
+        False,
+        description="""If set to `True`, the context is returned as server-sent events (`text/event-stream`):
+- `profile`: the profile section, sent as soon as it's ready
+- `event`: the event section
+- `context`: the whole context, same as the non-streaming `data.context`
+- `error`: sent instead of the rest if something fails
+
+Each event's data is a JSON response whose `data` has `section`, `content`, `token_size` and `skipped_stages`.
+""",
+    ),
+    timeout_ms: int = Query(
+        None,
+        description="""Time budget of the request in milliseconds, shared by its LLM, embedding and database calls.
+When it runs out, the LLM profile filtering and the event search are cut off and fall back to the latest profiles and events, instead of blocking the response.
+The cut off stages are listed in `skipped_stages`.
+""",
+    ),
+    profile_filter_method: Literal["llm", "embedding"] = Query(
+        None,
+        description="""How profiles are picked with `chats_str` when `full_profile_and_only_search_event` is `False`, default is the project's `profile_filter_method`.
+- `llm`: an LLM picks the related profiles
+- `embedding`: profiles are ranked by embedding similarity to the chats, much faster. Requires `enable_profile_embedding`.
+""",
+    ),
 ) -> res.UserContextDataResponse:
     project_id = request.state.memobase_project_id
     topic_limits_json = topic_limits_json or "{}"
@@ -102,7 +129,7 @@ Unless the user has relevant queries, do not actively mention those memories in
         return Promise.reject(CODE.BAD_REQUEST, f"Invalid JSON: {e}").to_response(
             res.UserContextDataResponse
         )
-    p = await controllers.context.get_user_context(
+    context_args = (
         user_id,
         project_id,
         max_token_size,
@@ -115,8 +142,28 @@ Unless the user has relevant queries, do not actively mention those memories in
         chats,
         event_similarity_threshold,
         time_range_in_days,
+    )
+    context_kwargs = dict(
         customize_context_prompt=customize_context_prompt,
         full_profile_and_only_search_event=full_profile_and_only_search_event,
         fill_window_with_events=fill_window_with_events,
+        timeout_ms=timeout_ms,
+        profile_filter_method=profile_filter_method,
     )
+    if stream:
+        return StreamingResponse(
+            stream_context_events(context_args, context_kwargs),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    p = await controllers.context.get_user_context(*context_args, **context_kwargs)
     return p.to_response(res.UserContextDataResponse)
+
+
+async def stream_context_events(context_args: tuple, context_kwargs: dict):
+    async for p in controllers.context.stream_user_context(
+        *context_args, **context_kwargs
+    ):
+        event = p.data().section if p.ok() else "error"
+        data = p.to_response(res.UserContextStreamChunkResponse).model_dump_json()
+        yield f"event: {event}\ndata: {data}\n\n"
@@ -3,8 +3,8 @@ import time
 import uuid
 import structlog
 import traceback
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request
+from starlette.datastructures import URL, Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from fastapi.responses import JSONResponse
 from uvicorn.protocols.utils import get_path_with_query_string
 from ..env import ProjectStatus, LOG
@@ -39,68 +39,113 @@ PATH_MAPPINGS = [
 ]
 
 
-async def global_wrapper_middleware(request: Request, call_next):
-    req_id = request.headers.get("X-Request-ID")
-    if req_id is None:
-        req_id = str(uuid.uuid4())
-    project_id = getattr(request.state, "memobase_project_id", None)
-    structlog.contextvars.clear_contextvars()
-    structlog.contextvars.bind_contextvars(
-        request_id=req_id, project_id=project_id, memobase_version=__version__
-    )
+class GlobalWrapperMiddleware:
+    """Binds the request id to the logs, writes the access log and the
+    X-Process-Time header.
 
-    url = get_path_with_query_string(request.scope)
-    client_host = request.client.host
-    client_port = request.client.port
-    http_method = request.method
-    http_version = request.scope["http_version"]
+    Pure ASGI, the response body is passed through untouched.
+    """
 
-    start_time = time.perf_counter_ns()
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        req_id = Headers(scope=scope).get("X-Request-ID")
+        if req_id is None:
+            req_id = str(uuid.uuid4())
+        project_id = scope.get("state", {}).get("memobase_project_id")
+        structlog.contextvars.clear_contextvars()
+        structlog.contextvars.bind_contextvars(
+            request_id=req_id, project_id=project_id, memobase_version=__version__
+        )
+
+        start_time = time.perf_counter_ns()
+        status_code = 500
+        response_started = False
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "X-Process-Time",
+                    str((time.perf_counter_ns() - start_time) / 10**9),
+                )
+            await send(message)
 
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
         errmsg = None
         traceback_str = None
-    except Exception as e:
-        status_code = 500
-        errmsg = f"Sorry, we have encountered an unknown error: \n{e}\nPlease report this issue to https://github.com/memodb-io/memobase/issues"
-        traceback_str = traceback.format_exc().replace("\n", "<br>")
-        response = JSONResponse(
-            content={
-                "data": None,
-                "errno": 500,
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            status_code = 500
+            errmsg = f"Sorry, we have encountered an unknown error: \n{e}\nPlease report this issue to https://github.com/memodb-io/memobase/issues"
+            traceback_str = traceback.format_exc().replace("\n", "<br>")
+            if response_started:
+                # Too late to send an error body
+                self.log_access(scope, status_code, start_time, errmsg, traceback_str)
+                raise
+            response = JSONResponse(
+                content={
+                    "data": None,
+                    "errno": 500,
+                    "errmsg": errmsg,
+                },
+            )
+            await response(scope, receive, send_wrapper)
+            # The error body goes out as 200, log the real status
+            status_code = 500
+        self.log_access(scope, status_code, start_time, errmsg, traceback_str)
+
+    def log_access(
+        self,
+        scope: Scope,
+        status_code: int,
+        start_time: int,
+        errmsg: str | None,
+        traceback_str: str | None,
+    ):
+        process_time = time.perf_counter_ns() - start_time
+        url = get_path_with_query_string(scope)
+        client_host, client_port = scope.get("client") or (None, None)
+        http_method = scope["method"]
+        http_version = scope["http_version"]
+
+        if status_code != 200:
+            _log_f = LOG.error
+        else:
+            _log_f = LOG.info
+        _log_f(
+            f"""{client_host}:{client_port} - "{http_method} {url} HTTP/{http_version}" {status_code}""",
+            extra={
+                "http": {
+                    "url": str(URL(scope=scope)),
+                    "status_code": status_code,
+                    "method": http_method,
+                    "version": http_version,
+                },
+                "network": {"client": {"ip": client_host, "port": client_port}},
+                "duration": process_time / 10**9,  # convert to s
+                "type": "access",
                 "errmsg": errmsg,
+                "__internal_traceback": traceback_str,
             },
         )
-    process_time = time.perf_counter_ns() - start_time
-
-    if status_code != 200:
-        _log_f = LOG.error
-    else:
-        _log_f = LOG.info
-    _log_f(
-        f"""{client_host}:{client_port} - "{http_method} {url} HTTP/{http_version}" {status_code}""",
-        extra={
-            "http": {
-                "url": str(request.url),
-                "status_code": status_code,
-                "method": http_method,
-                "version": http_version,
-            },
-            "network": {"client": {"ip": client_host, "port": client_port}},
-            "duration": process_time / 10**9,  # convert to s
-            "type": "access",
-            "errmsg": errmsg,
-            "__internal_traceback": traceback_str,
-        },
-    )
-    response.headers["X-Process-Time"] = str(process_time / 10**9)
 
-    return response
 
+class AuthMiddleware:
+    """Pure ASGI auth, sets `request.state.memobase_project_id` through
+    `scope["state"]` and records the request metrics."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-class AuthMiddleware(BaseHTTPMiddleware):
     def normalize_path(self, path: str) -> str:
         """Remove dynamic path parameters to get normalized path for metrics"""
         if not path.startswith("/api"):
@@ -112,68 +157,71 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
         return path
 
-    async def dispatch(self, request, call_next):
-        if not request.url.path.startswith("/api"):
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
 
-        if request.url.path.startswith("/api/v1/healthcheck"):
+        path = scope["path"]
+        if path.startswith("/api/v1/healthcheck"):
             telemetry_manager.increment_counter_metric(
                 CounterMetricName.HEALTHCHECK,
                 1,
             )
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
-        auth_token = request.headers.get("Authorization")
+        auth_token = Headers(scope=scope).get("Authorization")
         if not auth_token or not auth_token.startswith("Bearer "):
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=CODE.UNAUTHORIZED.value,
                 content=BaseResponse(
                     errno=CODE.UNAUTHORIZED.value,
-                    errmsg=f"Unauthorized access to {request.url.path}. You have to provide a valid Bearer token.",
+                    errmsg=f"Unauthorized access to {path}. You have to provide a valid Bearer token.",
                 ).model_dump(),
             )
+            await response(scope, receive, send)
+            return
         auth_token = (auth_token.split(" ")[1]).strip()
         is_root = self.is_valid_root(auth_token)
-        request.state.is_memobase_root = is_root
-        request.state.memobase_project_id = DEFAULT_PROJECT_ID
+        state = scope.setdefault("state", {})
+        state["is_memobase_root"] = is_root
+        state["memobase_project_id"] = DEFAULT_PROJECT_ID
         if not is_root:
             p = await self.parse_project_token(auth_token)
             if not p.ok():
-                return JSONResponse(
+                response = JSONResponse(
                     status_code=CODE.UNAUTHORIZED.value,
                     content=BaseResponse(
                         errno=CODE.UNAUTHORIZED.value,
-                        errmsg=f"Unauthorized access to {request.url.path}. {p.msg()}",
+                        errmsg=f"Unauthorized access to {path}. {p.msg()}",
                     ).model_dump(),
                 )
-            request.state.memobase_project_id = p.data()
+                await response(scope, receive, send)
+                return
+            state["memobase_project_id"] = p.data()
         # await capture_int_key(TelemetryKeyName.has_request)
 
-        normalized_path = self.normalize_path(request.url.path)
-
+        metric_attributes = {
+            "project_id": state["memobase_project_id"],
+            "path": self.normalize_path(path),
+            "method": scope["method"],
+        }
         telemetry_manager.increment_counter_metric(
             CounterMetricName.REQUEST,
             1,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
+            metric_attributes,
         )
 
         start_time = time.time()
-        response = await call_next(request)
-
-        telemetry_manager.record_histogram_metric(
-            HistogramMetricName.REQUEST_LATENCY_MS,
-            (time.time() - start_time) * 1000,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
-        )
-        return response
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            telemetry_manager.record_histogram_metric(
+                HistogramMetricName.REQUEST_LATENCY_MS,
+                (time.time() - start_time) * 1000,
+                metric_attributes,
+            )
 
     def is_valid_root(self, token: str) -> bool:
         access_token = os.getenv("ACCESS_TOKEN")
@@ -1,9 +1,11 @@
 import json
+from typing import Literal
 from fastapi import Request
 from fastapi import Path, Query, Body
 from datetime import datetime
 from ..controllers import full as controllers
-from ..controllers.post_process.profile import filter_profiles_with_chats
+from ..controllers.post_process.profile import filter_profiles_within_deadline
+from ..deadline import deadline_scope
 
 from ..models.response import CODE, UUID
 from ..models.utils import Promise
@@ -41,6 +43,14 @@ async def get_user_profile(
         None,
         description='List of chats in OpenAI Message format, for example: [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi"}]',
     ),
+    timeout_ms: int = Query(
+        None,
+        description="Time budget of the request in milliseconds. When it runs out, the LLM filtering with `chats_str` is cut off and the latest profiles are returned, with `profile_filter` in `skipped_stages`.",
+    ),
+    profile_filter_method: Literal["llm", "embedding"] = Query(
+        None,
+        description="How profiles are picked with `chats_str`: `llm` or `embedding` (requires `enable_profile_embedding`), default is the project's `profile_filter_method`.",
+    ),
 ) -> res.UserProfileResponse:
     """Get the real-time user profiles for long term memory"""
     project_id = request.state.memobase_project_id
@@ -53,21 +63,24 @@ async def get_user_profile(
         return Promise.reject(
             CODE.BAD_REQUEST, f"Invalid JSON requests: {e}"
         ).to_response(res.UserProfileResponse)
-    p = await controllers.profile.get_user_profiles(user_id, project_id)
+    # The profiles are the response, only the filtering is cut off by the deadline
+    p = await controllers.profile.get_user_profiles(
+        user_id, project_id, local_cache=True
+    )
     if not p.ok():
         return p.to_response(res.UserProfileResponse)
     total_profiles = p.data()
+    filter_skipped = False
     if chats:
-        p = await filter_profiles_with_chats(
-            user_id,
-            project_id,
-            total_profiles,
-            chats,
-            only_topics=only_topics,
-            # max_filter_num=topk,
-        )
-        if p.ok():
-            total_profiles.profiles = p.data()["profiles"]
+        with deadline_scope(timeout_ms):
+            filter_skipped = await filter_profiles_within_deadline(
+                user_id,
+                project_id,
+                total_profiles,
+                chats,
+                only_topics=only_topics,
+                method=profile_filter_method,
+            )
     p = await controllers.profile.truncate_profiles(
         total_profiles,
         prefer_topics=prefer_topics,
@@ -77,6 +90,8 @@ async def get_user_profile(
         max_subtopic_size=max_subtopic_size,
         topic_limits=topic_limits,
     )
+    if p.ok() and filter_skipped:
+        p.data().skipped_stages = ["profile_filter"]
     return p.to_response(res.UserProfileResponse)
 
 
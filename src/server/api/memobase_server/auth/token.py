@@ -1,13 +1,25 @@
+import hmac
+import asyncio
 from hashlib import sha256
 from datetime import datetime
 from random import random
 from typing import Tuple
 from uuid import uuid4
+from ..env import CONFIG, LOG
+from ..local_cache import LocalTTLCache
 from ..models.utils import Promise
 from ..models.response import CODE
 from ..connectors import get_redis_client
 from ..controllers import project
 
+AUTH_INVALIDATE_CHANNEL = "memobase::auth::invalidate"
+
+# project_id -> sha256 of the secret / project status, so a warm request
+# doesn't touch redis. Entries are dropped on AUTH_INVALIDATE_CHANNEL messages
+# and expire after `auth_cache_ttl` in case a message was missed.
+LOCAL_SECRET_CACHE = LocalTTLCache(CONFIG.auth_cache_max_size, CONFIG.auth_cache_ttl)
+LOCAL_STATUS_CACHE = LocalTTLCache(CONFIG.auth_cache_max_size, CONFIG.auth_cache_ttl)
+
 
 def parse_project_id(secret_key: str) -> Promise[str]:
     if not secret_key.startswith("sk-"):
@@ -27,19 +39,32 @@ def project_status_redis_key(project_id: str) -> str:
     return f"memobase::auth::project_status::{project_id}"
 
 
+def hash_secret(secret: str) -> bytes:
+    return sha256(secret.encode()).digest()
+
+
 async def check_project_secret(project_id: str, secret_key: str) -> Promise[bool]:
-    async with get_redis_client() as client:
-        secret = await client.get(token_redis_key(project_id))
-        if secret is None:
-            p = await project.get_project_secret(project_id)
-            if not p.ok():
-                return Promise.reject(CODE.UNAUTHORIZED, "Your project is not exists!")
-            secret = p.data()
-            await client.set(token_redis_key(project_id), secret, ex=None)
-    return Promise.resolve(secret == secret_key)
+    secret_hash = LOCAL_SECRET_CACHE.get(project_id)
+    if secret_hash is None:
+        async with get_redis_client() as client:
+            secret = await client.get(token_redis_key(project_id))
+            if secret is None:
+                p = await project.get_project_secret(project_id)
+                if not p.ok():
+                    return Promise.reject(
+                        CODE.UNAUTHORIZED, "Your project is not exists!"
+                    )
+                secret = p.data()
+                await client.set(token_redis_key(project_id), secret, ex=None)
+        secret_hash = hash_secret(secret)
+        LOCAL_SECRET_CACHE.set(project_id, secret_hash)
+    return Promise.resolve(hmac.compare_digest(secret_hash, hash_secret(secret_key)))
 
 
 async def get_project_status(project_id: str) -> Promise[str]:
+    status = LOCAL_STATUS_CACHE.get(project_id)
+    if status is not None:
+        return Promise.resolve(status)
     async with get_redis_client() as client:
         status = await client.get(project_status_redis_key(project_id))
         if status is None:
@@ -50,4 +75,44 @@ async def get_project_status(project_id: str) -> Promise[str]:
             await client.set(
                 project_status_redis_key(project_id), status.strip(), ex=60 * 60
             )
+    LOCAL_STATUS_CACHE.set(project_id, status)
     return Promise.resolve(status)
+
+
+def evict_local_project_auth(project_id: str):
+    LOCAL_SECRET_CACHE.delete(project_id)
+    LOCAL_STATUS_CACHE.delete(project_id)
+
+
+async def invalidate_project_auth(project_id: str):
+    """Call after a project's secret or status changes.
+
+    Drops the redis copies and tells every API process to drop its local one.
+    """
+    evict_local_project_auth(project_id)
+    async with get_redis_client() as client:
+        await client.delete(
+            token_redis_key(project_id), project_status_redis_key(project_id)
+        )
+        await client.publish(AUTH_INVALIDATE_CHANNEL, project_id)
+
+
+async def listen_project_auth_invalidation():
+    """Long running task, evicts local auth entries on invalidation messages"""
+    while True:
+        try:
+            async with get_redis_client() as client:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(AUTH_INVALIDATE_CHANNEL)
+                    # Messages may have been lost while we were not subscribed
+                    LOCAL_SECRET_CACHE.clear()
+                    LOCAL_STATUS_CACHE.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        evict_local_project_auth(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOG.warning(f"Auth invalidation listener disconnected: {e}")
+            await asyncio.sleep(1)
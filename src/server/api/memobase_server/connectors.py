@@ -2,18 +2,30 @@ import os
 import asyncio
 import redis.exceptions as redis_exceptions
 import redis.asyncio as redis
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.orm import sessionmaker, Session as ORMSession
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from uuid import uuid4
 from .env import LOG
-from .models.database import REG, Project, UserEvent, UserEventGist
+from .deadline import remaining_seconds
+from .models.database import (
+    REG,
+    Project,
+    UserEvent,
+    UserEventGist,
+    UserProfile,
+    ann_search_settings,
+)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_URL = os.getenv("REDIS_URL")
 PROJECT_ID = os.getenv("PROJECT_ID")
 ADMIN_URL = os.getenv("ADMIN_URL")
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# asyncpg connections are bound to one event loop, tests run many loops
+DATABASE_USE_NULL_POOL = os.getenv("DATABASE_USE_NULL_POOL", "").lower() == "true"
 
 if PROJECT_ID is None:
     LOG.warning(f"PROJECT_ID is not set")
@@ -22,9 +34,7 @@ LOG.info(f"Project ID: {PROJECT_ID}")
 LOG.info(f"Database URL: {DATABASE_URL}")
 LOG.info(f"Redis URL: {REDIS_URL}")
 
-# Create an engine
-DB_ENGINE = create_engine(
-    DATABASE_URL,
+DB_POOL_KWARGS = dict(
     pool_size=75,  # Increased from 50 to handle more concurrent operations
     max_overflow=50,  # Increased from 30 to provide more buffer
     pool_recycle=300,  # Reduced from 600 to recycle connections more frequently
@@ -33,9 +43,42 @@ DB_ENGINE = create_engine(
     pool_reset_on_return="commit",  # Ensure clean state when connections are returned
     echo_pool=False,  # Set to True for debugging pool issues
 )
+
+
+def to_async_database_url(url: str) -> str:
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix) :]
+    return url
+
+
+# Sync engine, only used for bootstrapping tables and scripts
+DB_ENGINE = create_engine(
+    DATABASE_URL, pool_size=5, max_overflow=5, pool_pre_ping=True
+)
+# Async engine, used by all the controllers so DB calls don't block the event loop
+ASYNC_DB_ENGINE = create_async_engine(
+    to_async_database_url(DATABASE_URL),
+    **(dict(poolclass=NullPool) if DATABASE_USE_NULL_POOL else DB_POOL_KWARGS),
+)
+
+
 REDIS_POOL = None
 
 Session = sessionmaker(bind=DB_ENGINE)
+# expire_on_commit=False: async sessions can't lazy-load attributes after commit
+AsyncSession = async_sessionmaker(bind=ASYNC_DB_ENGINE, expire_on_commit=False)
+
+
+@event.listens_for(ORMSession, "after_begin")
+def apply_deadline_statement_timeout(session, transaction, connection):
+    # Statements of a request with a time budget can't outlive it
+    remaining = remaining_seconds()
+    if remaining is None:
+        return
+    # 0 would disable the timeout
+    timeout_ms = max(int(remaining * 1000), 1)
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
 
 
 def create_pgvector_extension():
@@ -48,10 +91,48 @@ def create_pgvector_extension():
         LOG.error(f"Failed to create pgvector extension: {e}")
 
 
+def create_embedding_indexes():
+    # create_all skips indexes of tables that already exist
+    for table in (UserEvent.__table__, UserEventGist.__table__):
+        for index in table.indexes:
+            if not index.name.endswith(("_hnsw", "_ivfflat")):
+                continue
+            try:
+                index.create(DB_ENGINE, checkfirst=True)
+            except Exception as e:
+                LOG.error(f"Failed to create embedding index {index.name}: {e}")
+
+
+# Nullable columns added after their table, create_all doesn't alter tables
+ADDED_COLUMNS = [
+    UserProfile.__table__.c.token_size,
+    UserProfile.__table__.c.embedding,
+    UserEventGist.__table__.c.token_size,
+]
+
+
+def add_missing_columns():
+    for column in ADDED_COLUMNS:
+        column_type = column.type.compile(dialect=DB_ENGINE.dialect)
+        try:
+            with Session() as session:
+                session.execute(
+                    text(
+                        f"ALTER TABLE {column.table.name} ADD COLUMN IF NOT EXISTS "
+                        f"{column.name} {column_type}"
+                    )
+                )
+                session.commit()
+        except Exception as e:
+            LOG.error(f"Failed to add column {column.table.name}.{column.name}: {e}")
+
+
 def create_tables():
     create_pgvector_extension()
 
     REG.metadata.create_all(DB_ENGINE)
+    add_missing_columns()
+    create_embedding_indexes()
     with Session() as session:
         Project.initialize_root_project(session)
         UserEvent.check_legal_embedding_dim(session)
@@ -62,17 +143,23 @@ def create_tables():
 create_tables()
 
 
-def db_health_check() -> bool:
+async def db_health_check() -> bool:
     try:
-        conn = DB_ENGINE.connect()
-    except OperationalError as e:
+        async with ASYNC_DB_ENGINE.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except (OperationalError, OSError) as e:
         LOG.error(f"Database connection failed: {e}")
         return False
     else:
-        conn.close()
         return True
 
 
+async def set_ann_search_params(session) -> None:
+    """Tune the embedding index scan for the current transaction"""
+    for statement in ann_search_settings():
+        await session.execute(text(statement))
+
+
 async def redis_health_check() -> bool:
     try:
         async with get_redis_client() as redis_client:
@@ -85,6 +172,7 @@ async def redis_health_check() -> bool:
 
 
 async def close_connection():
+    await ASYNC_DB_ENGINE.dispose()
     DB_ENGINE.dispose()
     if REDIS_POOL is not None:
         await REDIS_POOL.aclose()
@@ -105,7 +193,9 @@ def get_redis_client() -> redis.Redis:
 
 def get_pool_status() -> dict:
     """Get current connection pool status for monitoring."""
-    pool = DB_ENGINE.pool
+    pool = ASYNC_DB_ENGINE.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"utilization_percent": 0}
     return {
         "size": pool.size(),
         "checked_in": pool.checkedin(),
@@ -1,4 +1,7 @@
+import uuid
+import asyncio
 from pydantic import ValidationError
+from sqlalchemy import select, update, bindparam
 from ..models.utils import Promise
 from ..models.database import (
     ProjectBilling,
@@ -6,9 +9,11 @@ from ..models.database import (
     next_month_first_day,
 )
 from ..models.response import CODE, IdData, IdsData, UserProfilesData, BillingData
-from ..connectors import Session, ADMIN_URL
+from ..connectors import AsyncSession, ADMIN_URL, PROJECT_ID, get_redis_client
 from ..telemetry.capture_key import get_int_key, capture_int_key
 from ..env import (
+    CONFIG,
+    LOG,
     TelemetryKeyName,
     USAGE_TOKEN_LIMIT_MAP,
     BILLING_REFILL_AMOUNT_MAP,
@@ -17,23 +22,52 @@ from ..env import (
 from datetime import datetime, date
 from ..auth import admin_api
 
+# project_id -> tokens used but not yet subtracted from Billing.usage_left
+BILLING_DELTA_KEY = f"memobase:billing_delta:{PROJECT_ID}"
+# The batch taken by the running reconciler, still counted by readers
+BILLING_RECONCILING_KEY = f"memobase:billing_reconciling:{PROJECT_ID}"
+BILLING_RECONCILE_LOCK_KEY = f"memobase:billing_reconcile_lock:{PROJECT_ID}"
+
+# A leftover batch means the last reconciler died before finishing, retry it
+# first. It's re-applied if it died between the commit and the DEL.
+REDIS_LUA_TAKE_BILLING_DELTAS = """
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call("RENAME", KEYS[1], KEYS[2])
+end
+return redis.call("HGETALL", KEYS[2])
+"""
+# Drop one project's pending delta, returns it
+REDIS_LUA_TAKE_PROJECT_DELTA = """
+local delta = tonumber(redis.call("HGET", KEYS[1], ARGV[1]) or "0")
+    + tonumber(redis.call("HGET", KEYS[2], ARGV[1]) or "0")
+redis.call("HDEL", KEYS[1], ARGV[1])
+redis.call("HDEL", KEYS[2], ARGV[1])
+return delta
+"""
+
 
 async def get_project_billing(project_id: str) -> Promise[BillingData]:
     if ADMIN_URL is not None:
         return await admin_api.get_project_usage(project_id)
 
-    with Session() as session:
+    async with AsyncSession() as session:
+        # Join explicitly, async sessions can't lazy-load ProjectBilling.billing
         billing = (
-            session.query(ProjectBilling)
-            .filter(ProjectBilling.project_id == project_id)
-            .first()
-        )
+            await session.execute(
+                select(Billing)
+                .join(ProjectBilling, ProjectBilling.billing_id == Billing.id)
+                .where(ProjectBilling.project_id == project_id)
+                .limit(1)
+            )
+        ).scalar_one_or_none()
         if billing is None:
             return await fallback_billing_data(project_id)
             # return Promise.reject(CODE.NOT_FOUND, "Billing not found").to_response(
             #     BillingData
             # )
-        billing = billing.billing
 
         this_month_token_costs_in = await get_int_key(
             TelemetryKeyName.llm_input_tokens, project_id, in_month=True
@@ -42,6 +76,8 @@ async def get_project_billing(project_id: str) -> Promise[BillingData]:
             TelemetryKeyName.llm_output_tokens, project_id, in_month=True
         )
         usage_left_this_billing = billing.usage_left
+        if usage_left_this_billing is not None:
+            usage_left_this_billing -= await get_pending_billing_delta(project_id)
 
         next_refill_date = billing.next_refill_at
         today = datetime.now(next_refill_date.tzinfo)
@@ -51,11 +87,13 @@ async def get_project_billing(project_id: str) -> Promise[BillingData]:
             and BILLING_REFILL_AMOUNT_MAP[BillingStatus.free] is not None
             and usage_left_this_billing < BILLING_REFILL_AMOUNT_MAP[BillingStatus.free]
         ):
-            usage_left_this_billing = BILLING_REFILL_AMOUNT_MAP[BillingStatus.free]
-
-            billing.next_refill_at = next_month_first_day()
-            billing.usage_left = usage_left_this_billing
-            session.commit()
+            if await refill_project_billing(
+                session,
+                project_id,
+                billing,
+                BILLING_REFILL_AMOUNT_MAP[BillingStatus.free],
+            ):
+                usage_left_this_billing = BILLING_REFILL_AMOUNT_MAP[BillingStatus.free]
     billing_data = BillingData(
         token_left=usage_left_this_billing,
         next_refill_at=next_refill_date,
@@ -64,6 +102,69 @@ async def get_project_billing(project_id: str) -> Promise[BillingData]:
     return Promise.resolve(billing_data)
 
 
+async def refill_project_billing(
+    session: AsyncSession, project_id: str, billing: Billing, amount: int
+) -> bool:
+    """Reset `usage_left` to `amount` for the new month, False if not refilled now
+
+    The pending delta is last month's usage, it's dropped under the reconciler
+    lock so it isn't subtracted from the new allowance later.
+    """
+    from .buffer_background import REDIS_LUA_CHECK_AND_DELETE_LOCK
+
+    # Only one refill per month, even with concurrent readers
+    stmt = (
+        update(Billing)
+        .where(
+            Billing.id == billing.id,
+            Billing.next_refill_at == billing.next_refill_at,
+        )
+        .values(usage_left=amount, next_refill_at=next_month_first_day())
+    )
+    lock_value = str(uuid.uuid4())
+    try:
+        async with get_redis_client() as redis_client:
+            acquired = await redis_client.set(
+                BILLING_RECONCILE_LOCK_KEY, lock_value, nx=True, ex=60
+            )
+    except Exception as e:
+        # No deltas are kept in redis while it's down
+        LOG.warning(f"Billing delta counter unavailable: {e}")
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount > 0
+    if not acquired:
+        # The reconciler is running, the next read refills
+        return False
+
+    async with get_redis_client() as redis_client:
+        try:
+            dropped = await redis_client.eval(
+                REDIS_LUA_TAKE_PROJECT_DELTA,
+                2,
+                BILLING_DELTA_KEY,
+                BILLING_RECONCILING_KEY,
+                project_id,
+            )
+            refilled = False
+            try:
+                result = await session.execute(stmt)
+                await session.commit()
+                refilled = result.rowcount > 0
+            finally:
+                # Not refilled, the usage still counts
+                if not refilled and dropped:
+                    await redis_client.hincrby(BILLING_DELTA_KEY, project_id, dropped)
+        finally:
+            await redis_client.eval(
+                REDIS_LUA_CHECK_AND_DELETE_LOCK,
+                1,
+                BILLING_RECONCILE_LOCK_KEY,
+                lock_value,
+            )
+    return refilled
+
+
 async def fallback_billing_data(project_id: str) -> Promise[BillingData]:
     from .project import get_project_status
 
@@ -118,17 +219,109 @@ async def project_cost_token_billing(
         return await admin_api.cost_project_usage(
             project_id, input_tokens, output_tokens
         )
-    with Session() as session:
-        _billing = (
-            session.query(ProjectBilling)
-            .filter(ProjectBilling.project_id == project_id)
-            .one_or_none()
-        )
-        if _billing is None:
-            return Promise.reject(CODE.NOT_FOUND, "Billing not found")
-        billing = _billing.billing
+    try:
+        # Summed in redis, run_billing_reconciler applies it to Billing in batches
+        async with get_redis_client() as redis_client:
+            await redis_client.hincrby(
+                BILLING_DELTA_KEY, project_id, input_tokens + output_tokens
+            )
+        return Promise.resolve(None)
+    except Exception as e:
+        LOG.warning(f"Billing delta counter unavailable, update billing directly: {e}")
+    return await apply_billing_deltas({project_id: input_tokens + output_tokens})
+
 
-        if billing.usage_left is not None:
-            billing.usage_left -= input_tokens + output_tokens
-            session.commit()
+async def get_pending_billing_delta(project_id: str) -> int:
+    try:
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hget(BILLING_DELTA_KEY, project_id)
+            pipe.hget(BILLING_RECONCILING_KEY, project_id)
+            pending, reconciling = await pipe.execute()
+    except Exception as e:
+        LOG.warning(f"Billing delta counter unavailable: {e}")
+        return 0
+    return int(pending or 0) + int(reconciling or 0)
+
+
+async def apply_billing_deltas(deltas: dict[str, int]) -> Promise[None]:
+    """Subtract used tokens from each project's Billing in one executemany"""
+    if not deltas:
+        return Promise.resolve(None)
+    billings = Billing.__table__
+    project_billings = ProjectBilling.__table__
+    # Decrement in SQL so concurrent writers don't overwrite each other
+    stmt = (
+        update(billings)
+        .where(
+            billings.c.id == project_billings.c.billing_id,
+            project_billings.c.project_id == bindparam("b_project_id"),
+            billings.c.usage_left.is_not(None),
+        )
+        .values(usage_left=billings.c.usage_left - bindparam("b_delta"))
+    )
+    async with AsyncSession() as session:
+        await session.execute(
+            stmt,
+            [{"b_project_id": pid, "b_delta": delta} for pid, delta in deltas.items()],
+        )
+        await session.commit()
     return Promise.resolve(None)
+
+
+async def reconcile_billing_deltas() -> int:
+    """Move the billing deltas from redis to Billing, returns the projects updated"""
+    from .buffer_background import REDIS_LUA_CHECK_AND_DELETE_LOCK
+
+    lock_value = str(uuid.uuid4())
+    async with get_redis_client() as redis_client:
+        acquired = await redis_client.set(
+            BILLING_RECONCILE_LOCK_KEY,
+            lock_value,
+            nx=True,
+            ex=max(60, int(CONFIG.billing_reconcile_interval * 3)),
+        )
+        if not acquired:
+            return 0
+        try:
+            raw = await redis_client.eval(
+                REDIS_LUA_TAKE_BILLING_DELTAS,
+                2,
+                BILLING_DELTA_KEY,
+                BILLING_RECONCILING_KEY,
+            )
+            deltas = {
+                pid: int(delta)
+                for pid, delta in zip(raw[::2], raw[1::2])
+                if int(delta) != 0
+            }
+            await apply_billing_deltas(deltas)
+            await redis_client.delete(BILLING_RECONCILING_KEY)
+        finally:
+            await redis_client.eval(
+                REDIS_LUA_CHECK_AND_DELETE_LOCK,
+                1,
+                BILLING_RECONCILE_LOCK_KEY,
+                lock_value,
+            )
+    return len(deltas)
+
+
+async def run_billing_reconciler(
+    interval: float = CONFIG.billing_reconcile_interval,
+):
+    """Long running task, reconciles once more when cancelled"""
+    if ADMIN_URL is not None:
+        return
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await reconcile_billing_deltas()
+            except Exception as e:
+                LOG.error(f"Failed to reconcile billing deltas: {e}")
+    finally:
+        try:
+            await reconcile_billing_deltas()
+        except Exception as e:
+            LOG.error(f"Failed to reconcile billing deltas on shutdown: {e}")
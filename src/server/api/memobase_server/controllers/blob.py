@@ -1,9 +1,10 @@
 import pydantic
+from sqlalchemy import select, delete
 from ..models.utils import Promise
 from ..models.database import GeneralBlob, DEFAULT_PROJECT_ID
 from ..models.response import CODE, BlobData, IdData
 from ..models.blob import ChatBlob, DocBlob, BlobType
-from ..connectors import Session
+from ..connectors import AsyncSession
 
 
 async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[IdData]:
@@ -11,7 +12,7 @@ async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[
         blob_parsed = blob.to_blob()
     except pydantic.ValidationError as e:
         return Promise.reject(CODE.BAD_REQUEST, f"Unable to parse blob: {e}")
-    with Session() as session:
+    async with AsyncSession() as session:
         blob_db = GeneralBlob(
             blob_type=blob_parsed.type,
             blob_data=blob_parsed.get_blob_data(),
@@ -20,18 +21,20 @@ async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[
             project_id=project_id,
         )
         session.add(blob_db)
-        session.commit()
+        await session.commit()
         b_id = blob_db.id
     return Promise.resolve(IdData(id=b_id))
 
 
 async def get_blob(user_id: str, project_id: str, blob_id: str) -> Promise[BlobData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         blob_db = (
-            session.query(GeneralBlob)
-            .filter_by(id=blob_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(GeneralBlob).filter_by(
+                    id=blob_id, user_id=user_id, project_id=project_id
+                )
+            )
+        ).scalar_one_or_none()
         if not blob_db:
             return Promise.reject(
                 CODE.NOT_FOUND, f"Blob with id {blob_id} of user {user_id} not found"
@@ -47,15 +50,11 @@ async def get_blob(user_id: str, project_id: str, blob_id: str) -> Promise[BlobD
 
 
 async def remove_blob(user_id: str, project_id: str, blob_id: str) -> Promise[None]:
-    with Session() as session:
-        blob_db = (
-            session.query(GeneralBlob)
-            .filter_by(id=blob_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        await session.execute(
+            delete(GeneralBlob).filter_by(
+                id=blob_id, user_id=user_id, project_id=project_id
+            )
         )
-        if not blob_db:
-            return Promise.resolve(None)
-        else:
-            session.delete(blob_db)
-            session.commit()
+        await session.commit()
     return Promise.resolve(None)
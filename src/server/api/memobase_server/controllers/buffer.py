@@ -1,4 +1,5 @@
-from sqlalchemy import func
+import pydantic
+from sqlalchemy import select, update, delete, func
 from pydantic import BaseModel
 from ..env import CONFIG, BufferStatus, TRACE_LOG
 from ..utils import (
@@ -6,34 +7,34 @@ from ..utils import (
     pack_blob_from_db,
 )
 from ..models.utils import Promise
-from ..models.response import CODE, ChatModalResponse, IdsData
+from ..models.response import CODE, ChatModalResponse, IdsData, IdData, BlobData
 from ..models.database import BufferZone, GeneralBlob
 from ..models.blob import BlobType, Blob
-from ..connectors import Session, log_pool_status
+from ..connectors import AsyncSession, log_pool_status
 from .modal import BLOBS_PROCESS
 
 
 async def get_buffer_capacity(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[int]:
-    with Session() as session:
+    async with AsyncSession() as session:
         buffer_count = (
-            session.query(BufferZone.id)
-            .filter_by(
-                user_id=user_id,
-                blob_type=str(blob_type),
-                project_id=project_id,
-                status=BufferStatus.idle,
+            await session.execute(
+                select(func.count(BufferZone.id)).filter_by(
+                    user_id=user_id,
+                    blob_type=str(blob_type),
+                    project_id=project_id,
+                    status=BufferStatus.idle,
+                )
             )
-            .count()
-        )
+        ).scalar()
     return Promise.resolve(buffer_count)
 
 
 async def insert_blob_to_buffer(
     user_id: str, project_id: str, blob_id: str, blob_data: Blob
 ) -> Promise[None]:
-    with Session() as session:
+    async with AsyncSession() as session:
         buffer = BufferZone(
             user_id=user_id,
             blob_id=blob_id,
@@ -43,10 +44,67 @@ async def insert_blob_to_buffer(
             status=BufferStatus.idle,
         )
         session.add(buffer)
-        session.commit()
+        await session.commit()
     return Promise.resolve(None)
 
 
+async def insert_blob_and_detect_buffer(
+    user_id: str, project_id: str, blob: BlobData
+) -> Promise[tuple[IdData, IdsData]]:
+    """Insert the blob and its buffer row, then sum the idle buffer in one transaction.
+
+    Returns the blob id and the buffer ids to flush, empty if the buffer isn't full.
+    """
+    try:
+        blob_parsed = blob.to_blob()
+    except pydantic.ValidationError as e:
+        return Promise.reject(CODE.BAD_REQUEST, f"Unable to parse blob: {e}")
+    async with AsyncSession() as session:
+        blob_db = GeneralBlob(
+            blob_type=blob_parsed.type,
+            blob_data=blob_parsed.get_blob_data(),
+            additional_fields=blob_parsed.fields,
+            user_id=user_id,
+            project_id=project_id,
+        )
+        session.add(blob_db)
+        session.add(
+            BufferZone(
+                user_id=user_id,
+                blob_id=blob_db.id,
+                blob_type=blob_parsed.type,
+                token_size=get_blob_token_size(blob_parsed),
+                project_id=project_id,
+                status=BufferStatus.idle,
+            )
+        )
+        # autoflush sends both inserts before the aggregate
+        buffer_token_size, buffer_ids = (
+            await session.execute(
+                select(
+                    func.coalesce(func.sum(BufferZone.token_size), 0),
+                    func.array_agg(BufferZone.id),
+                ).filter_by(
+                    user_id=user_id,
+                    blob_type=blob_db.blob_type,
+                    project_id=project_id,
+                    status=BufferStatus.idle,
+                )
+            )
+        ).one()
+        await session.commit()
+        b_id = blob_db.id
+
+    if buffer_token_size <= CONFIG.max_chat_blob_buffer_token_size:
+        return Promise.resolve((IdData(id=b_id), IdsData(ids=[])))
+    TRACE_LOG.info(
+        project_id,
+        user_id,
+        f"Flush {blob_parsed.type} buffer due to reach maximum token size({buffer_token_size} > {CONFIG.max_chat_blob_buffer_token_size})",
+    )
+    return Promise.resolve((IdData(id=b_id), IdsData(ids=buffer_ids or [])))
+
+
 async def wait_insert_done_then_flush(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[ChatModalResponse | None]:
@@ -66,18 +124,18 @@ async def wait_insert_done_then_flush(
 async def detect_buffer_full_or_not(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[IdsData | None]:
-    with Session() as session:
+    async with AsyncSession() as session:
         # 1. if buffer size reach maximum, flush it
         buffer_zone = (
-            session.query(BufferZone.id, BufferZone.token_size)
-            .filter_by(
-                user_id=user_id,
-                blob_type=str(blob_type),
-                project_id=project_id,
-                status=BufferStatus.idle,
+            await session.execute(
+                select(BufferZone.id, BufferZone.token_size).filter_by(
+                    user_id=user_id,
+                    blob_type=str(blob_type),
+                    project_id=project_id,
+                    status=BufferStatus.idle,
+                )
             )
-            .all()
-        )
+        ).all()
         buffer_ids = [row.id for row in buffer_zone]
         buffer_token_size = sum(row.token_size for row in buffer_zone)
         if (
@@ -100,17 +158,17 @@ async def get_unprocessed_buffer_ids(
     blob_type: BlobType,
     select_status: str = BufferStatus.idle,
 ) -> Promise[IdsData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         buffer_ids = (
-            session.query(BufferZone.id)
-            .filter_by(
-                user_id=user_id,
-                blob_type=str(blob_type),
-                project_id=project_id,
-                status=select_status,
+            await session.execute(
+                select(BufferZone.id).filter_by(
+                    user_id=user_id,
+                    blob_type=str(blob_type),
+                    project_id=project_id,
+                    status=select_status,
+                )
             )
-            .all()
-        )
+        ).all()
         return Promise.resolve(IdsData(ids=[row.id for row in buffer_ids]))
 
 
@@ -130,38 +188,38 @@ async def flush_buffer_by_ids(
     # Log initial pool status
     log_pool_status(f"flush_buffer_by_ids_start_{blob_type}")
 
-    with Session() as session:
+    async with AsyncSession() as session:
         # Join BufferZone with GeneralBlob to get all data in one query
         buffer_blob_data = (
-            session.query(
-                BufferZone.id.label("buffer_id"),
-                BufferZone.blob_id,
-                BufferZone.token_size,
-                BufferZone.created_at.label("buffer_created_at"),
-                GeneralBlob.created_at,
-                GeneralBlob.blob_data,
-            )
-            .join(GeneralBlob, BufferZone.blob_id == GeneralBlob.id)
-            .filter(
-                BufferZone.user_id == user_id,
-                BufferZone.blob_type == str(blob_type),
-                BufferZone.project_id == project_id,
-                GeneralBlob.user_id == user_id,
-                GeneralBlob.project_id == project_id,
-                BufferZone.status == select_status,
-                BufferZone.id.in_(buffer_ids),
+            await session.execute(
+                select(
+                    BufferZone.id.label("buffer_id"),
+                    BufferZone.blob_id,
+                    BufferZone.token_size,
+                    BufferZone.created_at.label("buffer_created_at"),
+                    GeneralBlob.created_at,
+                    GeneralBlob.blob_data,
+                )
+                .join(GeneralBlob, BufferZone.blob_id == GeneralBlob.id)
+                .where(
+                    BufferZone.user_id == user_id,
+                    BufferZone.blob_type == str(blob_type),
+                    BufferZone.project_id == project_id,
+                    GeneralBlob.user_id == user_id,
+                    GeneralBlob.project_id == project_id,
+                    BufferZone.status == select_status,
+                    BufferZone.id.in_(buffer_ids),
+                )
+                .order_by(BufferZone.created_at)
             )
-            .order_by(BufferZone.created_at)
-            .all()
-        )
+        ).all()
         # Update buffer status to processing
         process_buffer_ids = [row.buffer_id for row in buffer_blob_data]
         if select_status != BufferStatus.processing:
-            session.query(BufferZone).filter(
-                BufferZone.id.in_(process_buffer_ids),
-            ).update(
-                {BufferZone.status: BufferStatus.processing},
-                synchronize_session=False,
+            await session.execute(
+                update(BufferZone)
+                .where(BufferZone.id.in_(process_buffer_ids))
+                .values(status=BufferStatus.processing)
             )
 
         if not buffer_blob_data:
@@ -181,7 +239,7 @@ async def flush_buffer_by_ids(
             f"Flush {blob_type} buffer with {len(buffer_blob_data)} blobs and total token size({total_token_size})",
         )
 
-        session.commit()
+        await session.commit()
 
     try:
         # Pack blobs from the joined data
@@ -190,37 +248,37 @@ async def flush_buffer_by_ids(
         p = await BLOBS_PROCESS[blob_type](user_id, project_id, blobs)
         if not p.ok():
             # Rollback buffer status to failed if the process failed
-            with Session() as session:
-                session.query(BufferZone).filter(
-                    BufferZone.id.in_(process_buffer_ids),
-                ).update(
-                    {BufferZone.status: BufferStatus.failed},
-                    synchronize_session=False,
+            async with AsyncSession() as session:
+                await session.execute(
+                    update(BufferZone)
+                    .where(BufferZone.id.in_(process_buffer_ids))
+                    .values(status=BufferStatus.failed)
                 )
-                session.commit()
+                await session.commit()
             return p
-        with Session() as session:
+        async with AsyncSession() as session:
             try:
                 # Update buffer status to done
-                session.query(BufferZone).filter(
-                    BufferZone.id.in_(process_buffer_ids),
-                ).update(
-                    {BufferZone.status: BufferStatus.done},
-                    synchronize_session=False,
+                await session.execute(
+                    update(BufferZone)
+                    .where(BufferZone.id.in_(process_buffer_ids))
+                    .values(status=BufferStatus.done)
                 )
                 if blob_type == BlobType.chat and not CONFIG.persistent_chat_blobs:
-                    session.query(GeneralBlob).filter(
-                        GeneralBlob.id.in_(blob_ids),
-                        GeneralBlob.project_id == project_id,
-                    ).delete(synchronize_session=False)
-                session.commit()
+                    await session.execute(
+                        delete(GeneralBlob).where(
+                            GeneralBlob.id.in_(blob_ids),
+                            GeneralBlob.project_id == project_id,
+                        )
+                    )
+                await session.commit()
                 TRACE_LOG.info(
                     project_id,
                     user_id,
                     f"Flushed {blob_type} buffer(size: {len(buffer_blob_data)})",
                 )
             except Exception as e:
-                session.rollback()
+                await session.rollback()
                 TRACE_LOG.error(
                     project_id,
                     user_id,
@@ -232,14 +290,13 @@ async def flush_buffer_by_ids(
         return p
 
     except Exception as e:
-        with Session() as session:
-            session.query(BufferZone).filter(
-                BufferZone.id.in_(process_buffer_ids),
-            ).update(
-                {BufferZone.status: BufferStatus.failed},
-                synchronize_session=False,
+        async with AsyncSession() as session:
+            await session.execute(
+                update(BufferZone)
+                .where(BufferZone.id.in_(process_buffer_ids))
+                .values(status=BufferStatus.failed)
             )
-            session.commit()
+            await session.commit()
         TRACE_LOG.error(
             project_id,
             user_id,
@@ -1,14 +1,14 @@
 import uuid
 import asyncio
 import traceback
-from sqlalchemy import func
+from sqlalchemy import select, update, func
 from pydantic import BaseModel
 from ..env import CONFIG, BufferStatus, TRACE_LOG
 from ..models.utils import Promise
 from ..models.response import CODE, ChatModalResponse, IdsData, UUID
 from ..models.database import BufferZone, GeneralBlob
 from ..models.blob import BlobType, Blob
-from ..connectors import Session, PROJECT_ID, get_redis_client
+from ..connectors import AsyncSession, PROJECT_ID, get_redis_client
 from .modal import BLOBS_PROCESS
 from .buffer import flush_buffer_by_ids
 
@@ -46,30 +46,51 @@ async def flush_buffer_by_ids_in_background(
         return
 
     # 1. mark buffer as processing
-    with Session() as session:
+    async with AsyncSession() as session:
         buffer_blob_data = (
-            session.query(BufferZone.id)
-            .filter(
-                BufferZone.user_id == user_id,
-                BufferZone.blob_type == str(blob_type),
-                BufferZone.project_id == project_id,
-                BufferZone.status == BufferStatus.idle,
-                BufferZone.id.in_(buffer_ids),
+            await session.execute(
+                select(BufferZone.id)
+                .where(
+                    BufferZone.user_id == user_id,
+                    BufferZone.blob_type == str(blob_type),
+                    BufferZone.project_id == project_id,
+                    BufferZone.status == BufferStatus.idle,
+                    BufferZone.id.in_(buffer_ids),
+                )
+                .order_by(BufferZone.created_at)
             )
-            .order_by(BufferZone.created_at)
-            .all()
-        )
+        ).all()
         actual_buffer_ids = [row.id for row in buffer_blob_data]
         if not len(actual_buffer_ids):
             return
-        session.query(BufferZone).filter(
-            BufferZone.id.in_(actual_buffer_ids),
-        ).update(
-            {BufferZone.status: BufferStatus.processing},
-            synchronize_session=False,
+        await session.execute(
+            update(BufferZone)
+            .where(BufferZone.id.in_(actual_buffer_ids))
+            .values(status=BufferStatus.processing)
         )
 
-        session.commit()
+        await session.commit()
+
+    if CONFIG.use_flush_worker:
+        # Imported lazily, flush_queue imports this module
+        from .flush_queue import enqueue_flush_job
+
+        try:
+            message_id = await enqueue_flush_job(
+                user_id, project_id, blob_type, actual_buffer_ids
+            )
+            TRACE_LOG.info(
+                project_id,
+                user_id,
+                f"[background] Enqueued {len(actual_buffer_ids)} buffer IDs to flush worker ({message_id})",
+            )
+        except Exception as e:
+            TRACE_LOG.error(
+                project_id,
+                user_id,
+                f"[background] Error enqueue flush job: {e}: {traceback.format_exc()}",
+            )
+        return
 
     # 2. add actual buffer ids to a redis queue
     buffer_queue_key = get_user_buffer_queue_key(
@@ -1,21 +1,39 @@
+import asyncio
 from functools import partial
+from typing import AsyncIterator
 from ..models.utils import Promise, CODE
-from ..models.response import ContextData, OpenAICompatibleMessage, UserEventGistsData
+from ..models.response import (
+    ContextData,
+    ContextStreamChunk,
+    OpenAICompatibleMessage,
+    UserEventGistsData,
+)
 from ..prompts.chat_context_pack import CONTEXT_PROMPT_PACK
-from ..utils import get_encoded_tokens
-from ..env import CONFIG, TRACE_LOG
+from ..env import CONFIG, TRACE_LOG, LOG
+from ..deadline import (
+    deadline_context,
+    deadline_exceeded,
+    is_deadline_error,
+    within_deadline,
+    without_deadline,
+)
 from .project import get_project_profile_config
-from .profile import get_user_profiles, truncate_profiles
-from .post_process.profile import filter_profiles_with_chats
+from .profile import get_user_profiles, truncate_profiles, profile_token_size
+from .post_process.profile import filter_profiles_within_deadline
 
 # from .event import get_user_events, search_user_events, truncate_events
 from .event_gist import (
     get_user_event_gists,
     truncate_event_gists,
     search_user_event_gists,
+    event_gist_token_size,
 )
 
 
+# "- " before and the newline after each profile line
+PROFILE_LINE_TOKEN_OVERHEAD = 2
+
+
 def customize_context_prompt_func(
     context_prompt: str, profile_section: str, event_section: str
 ) -> str:
@@ -38,24 +56,31 @@ async def get_user_profiles_data(
     topic_limits: dict[str, int],
     chats: list[OpenAICompatibleMessage],
     full_profile_and_only_search_event: bool,
-) -> Promise[tuple[str, list]]:
-    """Retrieve and process user profiles."""
-    p = await get_user_profiles(user_id, project_id)
+    profile_filter_method: str = None,
+) -> Promise[tuple[str, list, bool]]:
+    """Retrieve and process user profiles.
+
+    The flag tells whether the deadline cut off the LLM filtering, the profiles are
+    then ranked by recency.
+    """
+    # The profiles are the response, only the filtering is cut off by the deadline
+    with without_deadline():
+        p = await get_user_profiles(user_id, project_id, local_cache=True)
     if not p.ok():
         return p
     total_profiles = p.data()
+    filter_skipped = False
 
     if max_profile_token_size > 0:
         if chats and (not full_profile_and_only_search_event):
-            p = await filter_profiles_with_chats(
+            filter_skipped = await filter_profiles_within_deadline(
                 user_id,
                 project_id,
                 total_profiles,
                 chats,
                 only_topics=only_topics,
+                method=profile_filter_method,
             )
-            if p.ok():
-                total_profiles.profiles = p.data()["profiles"]
 
         user_profiles = total_profiles
         use_profiles = await truncate_profiles(
@@ -80,7 +105,7 @@ async def get_user_profiles_data(
         profile_section = ""
         use_profiles = []
 
-    return Promise.resolve((profile_section, use_profiles))
+    return Promise.resolve((profile_section, use_profiles, filter_skipped))
 
 
 async def get_user_event_gists_data(
@@ -90,29 +115,59 @@ async def get_user_event_gists_data(
     require_event_summary: bool,
     event_similarity_threshold: float,
     time_range_in_days: int,
-) -> Promise[UserEventGistsData]:
-    """Retrieve user events data."""
+) -> Promise[tuple[UserEventGistsData, bool]]:
+    """Retrieve user events data.
+
+    The flag tells whether the deadline cut off the search, the latest events are
+    returned instead.
+    """
     if chats and CONFIG.enable_event_embedding:
         search_query = pack_latest_chat(chats)
-        p = await search_user_event_gists(
-            user_id,
-            project_id,
-            query=search_query,
-            topk=60,
-            similarity_threshold=event_similarity_threshold,
-            time_range_in_days=time_range_in_days,
-        )
-    else:
-        p = await get_user_event_gists(
-            user_id,
-            project_id,
-            topk=60,
-            time_range_in_days=time_range_in_days,
-        )
-    return p
+        cut_off = False
+        try:
+            p = await within_deadline(
+                search_user_event_gists(
+                    user_id,
+                    project_id,
+                    query=search_query,
+                    topk=60,
+                    similarity_threshold=event_similarity_threshold,
+                    time_range_in_days=time_range_in_days,
+                )
+            )
+        except Exception as e:
+            if not is_deadline_error(e):
+                raise
+            cut_off = True
+            p = Promise.reject(CODE.GATEWAY_TIMEOUT, "Exceeded the request deadline")
+        if p.ok():
+            return Promise.resolve((p.data(), False))
+        if not (cut_off or deadline_exceeded()):
+            return p
+        TRACE_LOG.warning(project_id, user_id, f"Skip event search: {p.msg()}")
+        # The latest events are one indexed query, let it finish
+        with without_deadline():
+            p = await get_user_event_gists(
+                user_id,
+                project_id,
+                topk=60,
+                time_range_in_days=time_range_in_days,
+            )
+        if not p.ok():
+            return p
+        return Promise.resolve((p.data(), True))
+    p = await get_user_event_gists(
+        user_id,
+        project_id,
+        topk=60,
+        time_range_in_days=time_range_in_days,
+    )
+    if not p.ok():
+        return p
+    return Promise.resolve((p.data(), False))
 
 
-async def get_user_context(
+async def stream_user_context(
     user_id: str,
     project_id: str,
     max_token_size: int,
@@ -128,15 +183,25 @@ async def get_user_context(
     customize_context_prompt: str = None,
     full_profile_and_only_search_event: bool = False,
     fill_window_with_events: bool = False,
-) -> Promise[ContextData]:
-    import asyncio
+    timeout_ms: int = None,
+    profile_filter_method: str = None,
+) -> AsyncIterator[Promise[ContextStreamChunk]]:
+    """Yield the profile section, then the event section, then the whole context.
 
+    Profiles and events are fetched concurrently, the profile section is yielded
+    as soon as it is ready. Once `timeout_ms` runs out, the LLM profile filtering
+    and the event search fall back to recency, and are listed in `skipped_stages`.
+    Stops after the first rejected Promise.
+    """
     assert 0 < profile_event_ratio <= 1, "profile_event_ratio must be between 0 and 1"
     max_profile_token_size = int(max_token_size * profile_event_ratio)
+    # Both fetches run as tasks, so the deadline doesn't leak into our consumer
+    context = deadline_context(timeout_ms)
 
     p = await get_project_profile_config(project_id)
     if not p.ok():
-        return p
+        yield p
+        return
     profile_config = p.data()
     use_language = profile_config.language or CONFIG.language
     context_prompt_func = CONTEXT_PROMPT_PACK[use_language]
@@ -145,8 +210,8 @@ async def get_user_context(
             customize_context_prompt_func, customize_context_prompt
         )
 
-    # Execute profile and event retrieval in parallel
-    profile_result, event_gist_result = await asyncio.gather(
+    # Events are fetched while the profile section is being built
+    profile_task = asyncio.create_task(
         get_user_profiles_data(
             user_id,
             project_id,
@@ -157,7 +222,11 @@ async def get_user_context(
             topic_limits,
             chats,
             full_profile_and_only_search_event,
+            profile_filter_method=profile_filter_method,
         ),
+        context=context,
+    )
+    event_gist_task = asyncio.create_task(
         get_user_event_gists_data(
             user_id,
             project_id,
@@ -166,57 +235,111 @@ async def get_user_context(
             event_similarity_threshold,
             time_range_in_days,
         ),
-        return_exceptions=True,
+        context=context,
     )
-
-    # Handle profile result
-    if isinstance(profile_result, Exception):
-        return Promise.reject(
-            CODE.SERVER_PARSE_ERROR, f"Profile retrieval failed: {str(profile_result)}"
-        )
-    if not profile_result.ok():
-        return profile_result
-    profile_section, use_profiles = profile_result.data()
-
-    # Handle event result
-    if isinstance(event_gist_result, Exception):
-        return Promise.reject(
-            CODE.SERVER_PARSE_ERROR, f"Event retrieval failed: {str(event_gist_result)}"
+    try:
+        skipped_stages = []
+        try:
+            profile_result = await profile_task
+        except Exception as e:
+            LOG.error(f"Profile retrieval failed: {e}")
+            yield Promise.reject(
+                CODE.SERVER_PARSE_ERROR, f"Profile retrieval failed: {str(e)}"
+            )
+            return
+        if not profile_result.ok():
+            yield profile_result
+            return
+        profile_section, use_profiles, filter_skipped = profile_result.data()
+        if filter_skipped:
+            skipped_stages.append("profile_filter")
+        profile_section_tokens = sum(
+            profile_token_size(p) + PROFILE_LINE_TOKEN_OVERHEAD for p in use_profiles
         )
-    if not event_gist_result.ok():
-        return event_gist_result
-    user_event_gists = event_gist_result.data()
-
-    # Calculate token sizes and truncate events if needed
-    profile_section_tokens = len(get_encoded_tokens(profile_section))
-    if fill_window_with_events:
-        max_event_token_size = max_token_size - profile_section_tokens
-    else:
-        max_event_token_size = min(
-            max_token_size - profile_section_tokens,
-            max_token_size - max_profile_token_size,
+        yield Promise.resolve(
+            ContextStreamChunk(
+                section="profile",
+                content=profile_section,
+                token_size=profile_section_tokens,
+                skipped_stages=list(skipped_stages),
+            )
         )
 
-    if max_event_token_size <= 0:
-        return Promise.resolve(
-            ContextData(context=context_prompt_func(profile_section, ""))
-        )
+        if fill_window_with_events:
+            max_event_token_size = max_token_size - profile_section_tokens
+        else:
+            max_event_token_size = min(
+                max_token_size - profile_section_tokens,
+                max_token_size - max_profile_token_size,
+            )
 
-    # Truncate events based on calculated token size
-    p = await truncate_event_gists(user_event_gists, max_event_token_size)
-    if not p.ok():
-        return p
-    user_event_gists = p.data()
+        event_section = ""
+        event_section_tokens = 0
+        user_event_gists = UserEventGistsData(gists=[])
+        if max_event_token_size > 0:
+            try:
+                event_gist_result = await event_gist_task
+            except Exception as e:
+                LOG.error(f"Event retrieval failed: {e}")
+                yield Promise.reject(
+                    CODE.SERVER_PARSE_ERROR, f"Event retrieval failed: {str(e)}"
+                )
+                return
+            if not event_gist_result.ok():
+                yield event_gist_result
+                return
+            all_event_gists, search_skipped = event_gist_result.data()
+            if search_skipped:
+                skipped_stages.append("event_search")
+
+            # Truncate events based on calculated token size
+            p = await truncate_event_gists(all_event_gists, max_event_token_size)
+            if not p.ok():
+                yield p
+                return
+            user_event_gists = p.data()
+            event_section = "\n".join(
+                [ed.gist_data.content for ed in user_event_gists.gists]
+            )
+            event_section_tokens = sum(
+                event_gist_token_size(ed) for ed in user_event_gists.gists
+            )
+        yield Promise.resolve(
+            ContextStreamChunk(
+                section="event",
+                content=event_section,
+                token_size=event_section_tokens,
+                skipped_stages=list(skipped_stages),
+            )
+        )
 
-    event_section = "\n".join([ed.gist_data.content for ed in user_event_gists.gists])
-    event_section_tokens = len(get_encoded_tokens(event_section))
+        TRACE_LOG.info(
+            project_id,
+            user_id,
+            f"Retrieved {len(use_profiles)} profiles({profile_section_tokens} tokens), {len(user_event_gists.gists)} event gists({event_section_tokens} tokens)",
+        )
+        yield Promise.resolve(
+            ContextStreamChunk(
+                section="context",
+                content=context_prompt_func(profile_section, event_section),
+                token_size=profile_section_tokens + event_section_tokens,
+                skipped_stages=list(skipped_stages),
+            )
+        )
+    finally:
+        profile_task.cancel()
+        event_gist_task.cancel()
 
-    TRACE_LOG.info(
-        project_id,
-        user_id,
-        f"Retrieved {len(use_profiles)} profiles({profile_section_tokens} tokens), {len(user_event_gists.gists)} event gists({event_section_tokens} tokens)",
-    )
 
-    return Promise.resolve(
-        ContextData(context=context_prompt_func(profile_section, event_section))
-    )
+async def get_user_context(*args, **kwargs) -> Promise[ContextData]:
+    """Assemble the whole context, takes the arguments of `stream_user_context`"""
+    async for p in stream_user_context(*args, **kwargs):
+        if not p.ok():
+            return p
+        chunk = p.data()
+        if chunk.section == "context":
+            return Promise.resolve(
+                ContextData(
+                    context=chunk.content, skipped_stages=chunk.skipped_stages
+                )
+            )
@@ -2,14 +2,15 @@ from pydantic import ValidationError
 from ..models.database import UserEvent, UserEventGist
 from ..models.response import UserEventData, UserEventsData, EventData
 from ..models.utils import Promise, CODE
-from ..connectors import Session
+from ..connectors import AsyncSession, set_ann_search_params
 from ..utils import get_encoded_tokens, event_str_repr, event_embedding_str
 
 from ..llms.embeddings import get_embedding
 from datetime import timedelta
-from sqlalchemy import desc, select
+from sqlalchemy import select, delete
 from sqlalchemy.sql import func
 from ..env import TRACE_LOG, CONFIG
+from ..telemetry.stage import stage_timer
 
 
 async def get_user_events(
@@ -19,9 +20,9 @@ async def get_user_events(
     need_summary: bool = False,
     time_range_in_days: int = 21,
 ) -> Promise[UserEventsData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         query = (
-            session.query(UserEvent)
+            select(UserEvent)
             .filter_by(user_id=user_id, project_id=project_id)
             .filter(
                 UserEvent.created_at > (func.now() - timedelta(days=time_range_in_days))
@@ -32,7 +33,15 @@ async def get_user_events(
         #     query = query.filter(
         #         UserEvent.event_data.contains({"event_tip": None}).is_(False)
         #     ).filter(UserEvent.event_data.has_key("event_tip"))
-        user_events = query.order_by(UserEvent.created_at.desc()).limit(topk).all()
+        user_events = (
+            (
+                await session.execute(
+                    query.order_by(UserEvent.created_at.desc()).limit(topk)
+                )
+            )
+            .scalars()
+            .all()
+        )
         if user_events is None:
             return Promise.resolve(UserEventsData(events=[]))
         results = [
@@ -81,105 +90,95 @@ async def append_user_event(
             f"Invalid event data: {str(e)}",
         )
 
+    event_gists = []
+    if validated_event.event_tip is not None:
+        event_gists = validated_event.event_tip.split("\n")
+        event_gists = [l.strip() for l in event_gists if l.strip().startswith("-")]
+        TRACE_LOG.info(
+            project_id, user_id, f"Processing {len(event_gists)} event gists"
+        )
+
+    # The event and its gists are embedded in one call
+    embeddings = [None] * (len(event_gists) + 1)
     if CONFIG.enable_event_embedding:
         event_data_str = event_embedding_str(validated_event)
-        embedding = await get_embedding(
-            project_id,
-            [event_data_str],
-            phase="document",
-            model=CONFIG.embedding_model,
-        )
-        if not embedding.ok():
+        with stage_timer(project_id, "event_embedding"):
+            p = await get_embedding(
+                project_id,
+                [event_data_str] + event_gists,
+                phase="document",
+                model=CONFIG.embedding_model,
+            )
+        if not p.ok():
             TRACE_LOG.error(
                 project_id,
                 user_id,
-                f"Failed to get embeddings: {embedding.msg()}",
+                f"Failed to get embeddings: {p.msg()}",
             )
-            embedding = [None]
         else:
-            embedding = embedding.data()
-            embedding_dim_current = embedding.shape[-1]
+            embedding_dim_current = p.data().shape[-1]
             if embedding_dim_current != CONFIG.embedding_dim:
                 TRACE_LOG.error(
                     project_id,
                     user_id,
                     f"Embedding dimension mismatch! Expected {CONFIG.embedding_dim}, got {embedding_dim_current}.",
                 )
-                embedding = [None]
-    else:
-        embedding = [None]
+            else:
+                embeddings = list(p.data())
+    embedding = embeddings[:1]
+    event_gists_embedding = embeddings[1:]
+    event_gists_embedding += [None] * (len(event_gists) - len(event_gists_embedding))
 
     event_gist_dbs = []
-    if validated_event.event_tip is not None:
-        event_gists = validated_event.event_tip.split("\n")
-        event_gists = [l.strip() for l in event_gists if l.strip().startswith("-")]
-        TRACE_LOG.info(
-            project_id, user_id, f"Processing {len(event_gists)} event gists"
+    for event_gist, event_gist_embedding in zip(event_gists, event_gists_embedding):
+        event_gist_dbs.append(
+            {
+                "gist_data": {"content": event_gist},
+                "embedding": event_gist_embedding,
+                "token_size": len(get_encoded_tokens(event_gist)),
+            }
         )
-        if CONFIG.enable_event_embedding and len(event_gists) > 0:
-            event_gists_embedding = await get_embedding(
-                project_id,
-                event_gists,
-                phase="document",
-                model=CONFIG.embedding_model,
-            )
-            if not event_gists_embedding.ok():
-                TRACE_LOG.error(
-                    project_id,
-                    user_id,
-                    f"Failed to get embeddings: {event_gists_embedding.msg()}",
-                )
-                event_gists_embedding = [None] * len(event_gists)
-            else:
-                event_gists_embedding = event_gists_embedding.data()
-        else:
-            event_gists_embedding = [None] * len(event_gists)
-        for event_gist, event_gist_embedding in zip(event_gists, event_gists_embedding):
-            event_gist_dbs.append(
-                {
-                    "gist_data": {"content": event_gist},
-                    "embedding": event_gist_embedding,
-                }
+    with stage_timer(project_id, "event_db_write"):
+        async with AsyncSession() as session:
+            user_event = UserEvent(
+                user_id=user_id,
+                project_id=project_id,
+                event_data=validated_event.model_dump(),
+                embedding=embedding[0],
             )
-    with Session() as session:
-        user_event = UserEvent(
-            user_id=user_id,
-            project_id=project_id,
-            event_data=validated_event.model_dump(),
-            embedding=embedding[0],
-        )
-        session.add(user_event)
-        for event_gist_data in event_gist_dbs:
-            session.add(
-                UserEventGist(
-                    user_id=user_id,
-                    project_id=project_id,
-                    event_id=user_event.id,
-                    gist_data=event_gist_data["gist_data"],
-                    embedding=event_gist_data["embedding"],
+            session.add(user_event)
+            for event_gist_data in event_gist_dbs:
+                session.add(
+                    UserEventGist(
+                        user_id=user_id,
+                        project_id=project_id,
+                        event_id=user_event.id,
+                        gist_data=event_gist_data["gist_data"],
+                        embedding=event_gist_data["embedding"],
+                        token_size=event_gist_data["token_size"],
+                    )
                 )
-            )
-        session.commit()
-        eid = user_event.id
+            await session.commit()
+            eid = user_event.id
     return Promise.resolve(eid)
 
 
 async def delete_user_event(
     user_id: str, project_id: str, event_id: str
 ) -> Promise[None]:
-    with Session() as session:
-        user_event = (
-            session.query(UserEvent)
-            .filter_by(user_id=user_id, project_id=project_id, id=event_id)
-            .first()
+    async with AsyncSession() as session:
+        # Bulk delete, the event gists are removed by the ON DELETE CASCADE FK
+        result = await session.execute(
+            delete(UserEvent).filter_by(
+                user_id=user_id, project_id=project_id, id=event_id
+            )
         )
-        if user_event is None:
+        if not result.rowcount:
             return Promise.reject(
                 CODE.NOT_FOUND,
                 f"User event {event_id} not found",
             )
-        session.delete(user_event)
-        session.commit()
+        await session.commit()
     return Promise.resolve(None)
 
 
@@ -194,12 +193,14 @@ async def update_user_event(
             f"Invalid event data: {str(e)}",
         )
     need_to_update = {k: v for k, v in event_data.items() if v is not None}
-    with Session() as session:
+    async with AsyncSession() as session:
         user_event = (
-            session.query(UserEvent)
-            .filter_by(user_id=user_id, project_id=project_id, id=event_id)
-            .first()
-        )
+            await session.execute(
+                select(UserEvent)
+                .filter_by(user_id=user_id, project_id=project_id, id=event_id)
+                .limit(1)
+            )
+        ).scalar_one_or_none()
         if user_event is None:
             return Promise.reject(
                 CODE.NOT_FOUND,
@@ -209,7 +210,7 @@ async def update_user_event(
         new_events.update(need_to_update)
 
         user_event.event_data = new_events
-        session.commit()
+        await session.commit()
     return Promise.resolve(None)
 
 
@@ -244,26 +245,24 @@ async def search_user_events(
         return query_embeddings
     query_embedding = query_embeddings.data()[0]
 
+    # Order by the raw distance ascending so the ANN index can serve the query
+    distance_expr = UserEvent.embedding.cosine_distance(query_embedding)
     stmt = (
         select(
             UserEvent,
-            (1 - UserEvent.embedding.cosine_distance(query_embedding)).label(
-                "similarity"
-            ),
+            (1 - distance_expr).label("similarity"),
         )
         .where(UserEvent.user_id == user_id, UserEvent.project_id == project_id)
         .where(UserEvent.created_at > func.now() - timedelta(days=time_range_in_days))
-        .where(
-            (1 - UserEvent.embedding.cosine_distance(query_embedding))
-            > similarity_threshold
-        )
-        .order_by(desc("similarity"))
+        .where((1 - distance_expr) > similarity_threshold)
+        .order_by(distance_expr)
         .limit(topk)
     )
 
-    with Session() as session:
+    async with AsyncSession() as session:
+        await set_ann_search_params(session)
         # Use .all() instead of .scalars().all() to get both columns
-        result = session.execute(stmt).all()
+        result = (await session.execute(stmt)).all()
         user_events: list[UserEventData] = []
         for row in result:
             user_event: UserEvent = row[0]  # UserEvent object
@@ -309,10 +308,8 @@ async def filter_user_events(
     Returns:
         Promise containing filtered UserEventsData
     """
-    with Session() as session:
-        query = session.query(UserEvent).filter_by(
-            user_id=user_id, project_id=project_id
-        )
+    async with AsyncSession() as session:
+        query = select(UserEvent).filter_by(user_id=user_id, project_id=project_id)
 
         # Apply tag filters if provided
         if has_event_tag or event_tag_equal:
@@ -324,10 +321,10 @@ async def filter_user_events(
             if has_event_tag:
                 for tag_name in has_event_tag:
                     # Check if any event_tag in the array has the specified tag name
+                    # contains() binds the right side as JSONB, asyncpg sends
+                    # a plain string as VARCHAR
                     query = query.filter(
-                        UserEvent.event_data["event_tags"].op("@>")(
-                            f'[{{"tag": "{tag_name}"}}]'
-                        )
+                        UserEvent.event_data["event_tags"].contains([{"tag": tag_name}])
                     )
 
             # Filter by exact tag-value pairs (event_tag_equal)
@@ -335,12 +332,20 @@ async def filter_user_events(
                 for tag_name, tag_value in event_tag_equal.items():
                     # Check if any event_tag in the array has both the tag name and value
                     query = query.filter(
-                        UserEvent.event_data["event_tags"].op("@>")(
-                            f'[{{"tag": "{tag_name}", "value": "{tag_value}"}}]'
+                        UserEvent.event_data["event_tags"].contains(
+                            [{"tag": tag_name, "value": tag_value}]
                         )
                     )
 
-        user_events = query.order_by(UserEvent.created_at.desc()).limit(topk).all()
+        user_events = (
+            (
+                await session.execute(
+                    query.order_by(UserEvent.created_at.desc()).limit(topk)
+                )
+            )
+            .scalars()
+            .all()
+        )
 
         if user_events is None:
             return Promise.resolve(UserEventsData(events=[]))
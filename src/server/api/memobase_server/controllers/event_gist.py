@@ -1,13 +1,15 @@
+from bisect import bisect_right
+from itertools import accumulate
 from pydantic import ValidationError
 from ..models.database import UserEventGist
 from ..models.response import UserEventGistsData, UserEventGistData
 from ..models.utils import Promise, CODE
-from ..connectors import Session
+from ..connectors import AsyncSession, set_ann_search_params
 from ..utils import get_encoded_tokens, event_str_repr, event_embedding_str
 
 from ..llms.embeddings import get_embedding
 from datetime import timedelta
-from sqlalchemy import desc, select
+from sqlalchemy import select
 from sqlalchemy.sql import func
 from ..env import TRACE_LOG, CONFIG
 
@@ -18,9 +20,9 @@ async def get_user_event_gists(
     topk: int = 10,
     time_range_in_days: int = 21,
 ) -> Promise[UserEventGistsData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         query = (
-            session.query(UserEventGist)
+            select(UserEventGist)
             .filter_by(user_id=user_id, project_id=project_id)
             .filter(
                 UserEventGist.created_at
@@ -28,7 +30,13 @@ async def get_user_event_gists(
             )
         )
         user_event_gists = (
-            query.order_by(UserEventGist.created_at.desc()).limit(topk).all()
+            (
+                await session.execute(
+                    query.order_by(UserEventGist.created_at.desc()).limit(topk)
+                )
+            )
+            .scalars()
+            .all()
         )
         if user_event_gists is None:
             return Promise.resolve(UserEventGistsData(gists=[]))
@@ -38,6 +46,7 @@ async def get_user_event_gists(
                 "gist_data": ue.gist_data,
                 "created_at": ue.created_at,
                 "updated_at": ue.updated_at,
+                "token_size": ue.token_size,
             }
             for ue in user_event_gists
         ]
@@ -45,20 +54,21 @@ async def get_user_event_gists(
     return Promise.resolve(gists)
 
 
+def event_gist_token_size(gist: UserEventGistData) -> int:
+    # Rows written before token_size was stored don't have it
+    if gist.token_size is None:
+        return len(get_encoded_tokens(gist.gist_data.content))
+    return gist.token_size
+
+
 async def truncate_event_gists(
     events: UserEventGistsData,
     max_token_size: int | None,
 ) -> Promise[UserEventGistsData]:
     if max_token_size is None:
         return Promise.resolve(events)
-    c_tokens = 0
-    truncated_results = []
-    for r in events.gists:
-        c_tokens += len(get_encoded_tokens(r.gist_data.content))
-        if c_tokens > max_token_size:
-            break
-        truncated_results.append(r)
-    events.gists = truncated_results
+    cumulative_tokens = list(accumulate(event_gist_token_size(r) for r in events.gists))
+    events.gists = events.gists[: bisect_right(cumulative_tokens, max_token_size)]
     return Promise.resolve(events)
 
 
@@ -95,8 +105,9 @@ async def search_user_event_gists(
     # Calculate the time cutoff once
     time_cutoff = func.now() - timedelta(days=time_range_in_days)
 
-    # Store the similarity expression to avoid recomputation
-    similarity_expr = 1 - UserEventGist.embedding.cosine_distance(query_embedding)
+    # Order by the raw distance ascending so the ANN index can serve the query
+    distance_expr = UserEventGist.embedding.cosine_distance(query_embedding)
+    similarity_expr = 1 - distance_expr
 
     stmt = (
         select(
@@ -110,13 +121,14 @@ async def search_user_event_gists(
             similarity_expr > similarity_threshold,
             UserEventGist.embedding.is_not(None),  # Skip null embeddings
         )
-        .order_by(desc("similarity"))
+        .order_by(distance_expr)
         .limit(topk)
     )
 
-    with Session() as session:
+    async with AsyncSession() as session:
+        await set_ann_search_params(session)
         # Use .all() instead of .scalars().all() to get both columns
-        result = session.execute(stmt).all()
+        result = (await session.execute(stmt)).all()
         user_event_gists: list[UserEventGistData] = []
         for row in result:
             user_event: UserEventGist = row[0]  # UserEventGist object
@@ -128,6 +140,7 @@ async def search_user_event_gists(
                     created_at=user_event.created_at,
                     updated_at=user_event.updated_at,
                     similarity=similarity,
+                    token_size=user_event.token_size,
                 )
             )
 
@@ -0,0 +1,502 @@
+"""
+Shared buffer flush queue on Redis Streams, see `python -m memobase_server.worker`.
+
+Each entry is one flush job (a user's buffer ids already marked as processing).
+A job is acked only when it's done, and its entry is deleted along with the ack
+so the stream only holds unfinished jobs. Failed jobs are re-added with
+`attempt + 1`, and jobs of crashed workers are reclaimed with XAUTOCLAIM once
+they have been idle longer than `flush_worker_visibility_timeout`. A job whose user is being
+flushed elsewhere waits in a delayed set with backoff, without holding a worker
+slot, and is dead-lettered after `flush_worker_max_busy_requeues` tries. The
+dead-letter stream keeps about the latest `flush_worker_dead_letter_maxlen` jobs.
+
+A worker fetches up to `flush_worker_prefetch` jobs ahead and starts them with
+`FlushScheduler`, round-robin across projects. It holds off starting jobs while
+background LLM calls are already waiting on the rate limiter. With
+`flush_worker_sweep_interval` set, one worker per interval also flushes the
+users whose idle buffers are older than `buffer_flush_interval`.
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import traceback
+import redis.exceptions as redis_exceptions
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update, select
+from ..env import CONFIG, BufferStatus, LOG, TRACE_LOG
+from ..models.database import BufferZone
+from ..models.blob import BlobType
+from ..connectors import AsyncSession, PROJECT_ID, get_redis_client
+from ..llms.limiter import LLM_LIMITER
+from .buffer import flush_buffer_by_ids, get_unprocessed_buffer_ids
+from .buffer_background import (
+    REDIS_LUA_CHECK_AND_DELETE_LOCK,
+    flush_buffer_by_ids_in_background,
+    get_user_lock_key,
+    pack_ids_to_str,
+    unpack_ids_from_str,
+)
+from .flush_scheduler import FlushJob, FlushScheduler
+
+FLUSH_STREAM_KEY = f"memobase:flush_stream:{PROJECT_ID}"
+FLUSH_DEAD_STREAM_KEY = f"memobase:flush_stream_dead:{PROJECT_ID}"
+FLUSH_DELAYED_KEY = f"memobase:flush_delayed:{PROJECT_ID}"
+FLUSH_GROUP = "memobase_flush_workers"
+FLUSH_SWEEP_LOCK_KEY = f"memobase:flush_sweep_lock:{PROJECT_ID}"
+# Wait before re-adding a job whose user is being flushed by someone else,
+# doubled on every busy requeue
+USER_BUSY_REQUEUE_DELAY_S = 1
+USER_BUSY_MAX_DELAY_S = 60
+PROMOTE_DELAYED_BATCH = 100
+# Re-check interval while no job can start
+DISPATCH_WAIT_S = 0.5
+# Users flushed by one sweep at most
+SWEEP_MAX_USERS = 100
+
+# Move the due delayed jobs (JSON encoded fields) back to the stream
+REDIS_LUA_PROMOTE_DELAYED = """
+local due = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, member in ipairs(due) do
+    if redis.call("zrem", KEYS[1], member) == 1 then
+        local args = {}
+        for k, v in pairs(cjson.decode(member)) do
+            table.insert(args, k)
+            table.insert(args, v)
+        end
+        redis.call("xadd", KEYS[2], "*", unpack(args))
+    end
+end
+return #due
+"""
+
+
+def finish_job(pipe, message_id: str):
+    """Queue the ack of a job on `pipe`, and drop its entry from the stream.
+    Acked entries are never read again, only the trimming keeps them around"""
+    pipe.xack(FLUSH_STREAM_KEY, FLUSH_GROUP, message_id)
+    pipe.xdel(FLUSH_STREAM_KEY, message_id)
+
+
+async def enqueue_flush_job(
+    user_id: str,
+    project_id: str,
+    blob_type: BlobType,
+    buffer_ids: list[str],
+    attempt: int = 0,
+) -> str:
+    async with get_redis_client() as redis_client:
+        return await redis_client.xadd(
+            FLUSH_STREAM_KEY,
+            {
+                "user_id": str(user_id),
+                "project_id": str(project_id),
+                "blob_type": str(blob_type),
+                "buffer_ids": pack_ids_to_str(buffer_ids),
+                "attempt": str(attempt),
+            },
+        )
+
+
+async def ensure_flush_group():
+    async with get_redis_client() as redis_client:
+        try:
+            await redis_client.xgroup_create(
+                FLUSH_STREAM_KEY, FLUSH_GROUP, id="0", mkstream=True
+            )
+        except redis_exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise e
+
+
+async def mark_buffers_failed(buffer_ids: list[str]):
+    async with AsyncSession() as session:
+        await session.execute(
+            update(BufferZone)
+            .where(BufferZone.id.in_(buffer_ids))
+            .values(status=BufferStatus.failed)
+        )
+        await session.commit()
+
+
+class FlushWorker:
+    def __init__(
+        self,
+        consumer_name: str,
+        concurrency: int = CONFIG.flush_worker_concurrency,
+        visibility_timeout_s: int = CONFIG.flush_worker_visibility_timeout,
+        max_retries: int = CONFIG.flush_worker_max_retries,
+        max_busy_requeues: int = CONFIG.flush_worker_max_busy_requeues,
+        prefetch: int = CONFIG.flush_worker_prefetch,
+        sweep_interval_s: int = CONFIG.flush_worker_sweep_interval,
+        block_ms: int = 5000,
+    ):
+        self.consumer_name = consumer_name
+        self.concurrency = concurrency
+        self.visibility_timeout_s = visibility_timeout_s
+        self.max_retries = max_retries
+        self.max_busy_requeues = max_busy_requeues
+        self.sweep_interval_s = sweep_interval_s
+        self.block_ms = block_ms
+        self.scheduler = FlushScheduler(concurrency, max(prefetch, concurrency))
+        self.stopping = asyncio.Event()
+        self.tasks: set[asyncio.Task] = set()
+        self.sweeper: asyncio.Task | None = None
+
+    def stop(self):
+        self.stopping.set()
+
+    async def run(self):
+        await ensure_flush_group()
+        LOG.info(
+            f"Flush worker {self.consumer_name} started, concurrency {self.concurrency}"
+        )
+        if self.sweep_interval_s > 0 and CONFIG.buffer_flush_interval > 0:
+            self.sweeper = asyncio.create_task(self.run_sweeper())
+        last_reclaim = last_refresh = 0.0
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            room = self.scheduler.fetch_room()
+            try:
+                if loop.time() - last_refresh > self.visibility_timeout_s / 3:
+                    last_refresh = loop.time()
+                    await self.refresh_queued()
+                await self.promote_delayed()
+                messages = []
+                if room and loop.time() - last_reclaim > self.visibility_timeout_s / 2:
+                    last_reclaim = loop.time()
+                    messages = await self.reclaim_stale(room)
+                if room and not messages:
+                    # Don't sit on redis while fetched jobs are waiting to start
+                    messages = await self.read_new(
+                        room, block=not self.scheduler.queued()
+                    )
+            except redis_exceptions.ConnectionError as e:
+                LOG.error(f"Flush worker lost redis connection: {e}")
+                await asyncio.sleep(1)
+                continue
+            for message_id, fields in messages:
+                self.scheduler.add(FlushJob(message_id, fields))
+
+            started = await self.dispatch()
+            if not started and (self.scheduler.queued() or not room):
+                # Waiting for a free slot, a user's running job or LLM capacity
+                if self.tasks:
+                    await asyncio.wait(
+                        self.tasks,
+                        timeout=DISPATCH_WAIT_S,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                else:
+                    await asyncio.sleep(DISPATCH_WAIT_S)
+
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+        if self.tasks:
+            LOG.info(f"Flush worker waiting for {len(self.tasks)} running jobs")
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.release_queued()
+        LOG.info(f"Flush worker {self.consumer_name} stopped")
+
+    async def dispatch(self) -> int:
+        """Start queued jobs while there are free slots and LLM capacity"""
+        started = 0
+        while self.scheduler.free_slots() > 0 and self.scheduler.queued():
+            if await LLM_LIMITER.background_saturated(CONFIG.best_llm_model):
+                LOG.debug("Flush worker holds off, background LLM calls are waiting")
+                break
+            job = self.scheduler.next_job()
+            if job is None:
+                break
+            task = asyncio.create_task(self.run_job(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            started += 1
+        return started
+
+    async def run_job(self, job: FlushJob):
+        try:
+            await self.handle(job.message_id, job.fields)
+        except Exception as e:
+            LOG.error(f"Flush job {job.message_id} crashed: {e}")
+        finally:
+            self.scheduler.done(job)
+
+    async def refresh_queued(self):
+        """Keep fetched jobs that haven't started from being reclaimed"""
+        message_ids = self.scheduler.queued_message_ids()
+        if not message_ids:
+            return
+        async with get_redis_client() as redis_client:
+            await redis_client.xclaim(
+                FLUSH_STREAM_KEY,
+                FLUSH_GROUP,
+                self.consumer_name,
+                min_idle_time=0,
+                message_ids=message_ids,
+                justid=True,
+            )
+
+    async def release_queued(self):
+        """Hand the jobs that never started back to the stream"""
+        jobs = self.scheduler.drain()
+        if not jobs:
+            return
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=True)
+            for job in jobs:
+                pipe.xadd(FLUSH_STREAM_KEY, job.fields)
+                finish_job(pipe, job.message_id)
+            await pipe.execute()
+        LOG.info(f"Flush worker released {len(jobs)} queued jobs")
+
+    async def run_sweeper(self):
+        """Long running task next to the dispatch loop, so a slow sweep can't
+        hold up jobs"""
+        while not self.stopping.is_set():
+            try:
+                await self.sweep_stale_buffers()
+            except Exception as e:
+                LOG.error(f"Failed to sweep stale buffers: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.sweep_interval_s)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sweep_stale_buffers(self):
+        """Flush the users whose idle buffers are older than `buffer_flush_interval`
+
+        They are not full yet, so nothing else would flush them until the user
+        talks again. One worker sweeps per interval, up to `SWEEP_MAX_USERS`.
+        """
+        async with get_redis_client() as redis_client:
+            if not await redis_client.set(
+                FLUSH_SWEEP_LOCK_KEY,
+                self.consumer_name,
+                nx=True,
+                ex=self.sweep_interval_s,
+            ):
+                return
+        threshold = datetime.now(timezone.utc) - timedelta(
+            seconds=CONFIG.buffer_flush_interval
+        )
+        async with AsyncSession() as session:
+            rows = (
+                await session.execute(
+                    select(
+                        BufferZone.user_id, BufferZone.project_id, BufferZone.blob_type
+                    )
+                    .where(
+                        BufferZone.status == BufferStatus.idle,
+                        BufferZone.created_at < threshold,
+                    )
+                    .distinct()
+                    .limit(SWEEP_MAX_USERS)
+                )
+            ).all()
+        for user_id, project_id, blob_type in rows:
+            blob_type = BlobType(blob_type)
+            p = await get_unprocessed_buffer_ids(user_id, project_id, blob_type)
+            if not p.ok() or p.data() is None:
+                continue
+            buffer_ids = p.data().ids
+            TRACE_LOG.info(
+                project_id,
+                user_id,
+                f"[worker] Flush {len(buffer_ids)} {blob_type} buffers idle over {CONFIG.buffer_flush_interval}s",
+            )
+            await flush_buffer_by_ids_in_background(
+                user_id, project_id, blob_type, buffer_ids
+            )
+
+    async def read_new(self, count: int, block: bool = True) -> list[tuple[str, dict]]:
+        async with get_redis_client() as redis_client:
+            response = await redis_client.xreadgroup(
+                FLUSH_GROUP,
+                self.consumer_name,
+                {FLUSH_STREAM_KEY: ">"},
+                count=count,
+                block=self.block_ms if block else None,
+            )
+        if not response:
+            return []
+        return response[0][1]
+
+    async def reclaim_stale(self, count: int) -> list[tuple[str, dict]]:
+        """Take over jobs whose consumer stopped heartbeating"""
+        async with get_redis_client() as redis_client:
+            _, messages, deleted_ids = await redis_client.xautoclaim(
+                FLUSH_STREAM_KEY,
+                FLUSH_GROUP,
+                self.consumer_name,
+                min_idle_time=self.visibility_timeout_s * 1000,
+                start_id="0-0",
+                count=count,
+            )
+            if deleted_ids:
+                await redis_client.xack(FLUSH_STREAM_KEY, FLUSH_GROUP, *deleted_ids)
+            reclaimed = []
+            for message_id, fields in messages:
+                pending = await redis_client.xpending_range(
+                    FLUSH_STREAM_KEY,
+                    FLUSH_GROUP,
+                    min=message_id,
+                    max=message_id,
+                    count=1,
+                )
+                deliveries = pending[0]["times_delivered"] if pending else 1
+                if deliveries > self.max_retries + 1:
+                    await self.dead_letter(
+                        message_id, fields, f"delivered {deliveries} times"
+                    )
+                    continue
+                reclaimed.append((message_id, fields))
+        if reclaimed:
+            LOG.warning(f"Flush worker reclaimed {len(reclaimed)} stale jobs")
+        return reclaimed
+
+    async def promote_delayed(self):
+        async with get_redis_client() as redis_client:
+            await redis_client.eval(
+                REDIS_LUA_PROMOTE_DELAYED,
+                2,
+                FLUSH_DELAYED_KEY,
+                FLUSH_STREAM_KEY,
+                time.time(),
+                PROMOTE_DELAYED_BATCH,
+            )
+
+    async def heartbeat(self, message_id: str, user_key: str, lock_value: str):
+        """Keep a running job from being reclaimed and its user lock from expiring"""
+        while True:
+            await asyncio.sleep(self.visibility_timeout_s / 3)
+            try:
+                async with get_redis_client() as redis_client:
+                    if await redis_client.get(user_key) == lock_value:
+                        await redis_client.expire(user_key, self.visibility_timeout_s)
+                    await redis_client.xclaim(
+                        FLUSH_STREAM_KEY,
+                        FLUSH_GROUP,
+                        self.consumer_name,
+                        min_idle_time=0,
+                        message_ids=[message_id],
+                        justid=True,
+                    )
+            except Exception as e:
+                # Keep beating, a missed beat only matters once the timeout passes
+                LOG.warning(f"Flush job {message_id} heartbeat failed: {e}")
+
+    async def requeue_busy(self, message_id: str, fields: dict):
+        """Retry later a job whose user is being flushed by someone else"""
+        busy = int(fields.get("busy", 0))
+        if busy >= self.max_busy_requeues:
+            await self.dead_letter(
+                message_id, fields, f"user still busy after {busy} requeues"
+            )
+            return
+        delay = min(USER_BUSY_REQUEUE_DELAY_S * 2**busy, USER_BUSY_MAX_DELAY_S)
+        member = json.dumps({**fields, "busy": str(busy + 1)})
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.zadd(FLUSH_DELAYED_KEY, {member: time.time() + delay})
+            finish_job(pipe, message_id)
+            await pipe.execute()
+
+    async def dead_letter(self, message_id: str, fields: dict, reason: str):
+        buffer_ids = unpack_ids_from_str(fields.get("buffer_ids", ""))
+        TRACE_LOG.error(
+            fields.get("project_id"),
+            fields.get("user_id"),
+            f"[worker] Flush job {message_id} dead-lettered: {reason}",
+        )
+        if buffer_ids:
+            await mark_buffers_failed(buffer_ids)
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.xadd(
+                FLUSH_DEAD_STREAM_KEY,
+                {**fields, "reason": reason[:1024]},
+                maxlen=CONFIG.flush_worker_dead_letter_maxlen,
+                approximate=True,
+            )
+            finish_job(pipe, message_id)
+            await pipe.execute()
+
+    async def handle(self, message_id: str, fields: dict):
+        user_id = fields["user_id"]
+        project_id = fields["project_id"]
+        blob_type = BlobType(fields["blob_type"])
+        buffer_ids = unpack_ids_from_str(fields.get("buffer_ids", ""))
+        attempt = int(fields.get("attempt", 0))
+
+        # Same lock as the in-process flush, one flush per user at a time
+        user_key = get_user_lock_key(
+            user_id, project_id, f"flush_buffer_background_{blob_type}"
+        )
+        lock_value = str(uuid.uuid4())
+        async with get_redis_client() as redis_client:
+            acquired = await redis_client.set(
+                user_key, lock_value, nx=True, ex=self.visibility_timeout_s
+            )
+        if not acquired:
+            await self.requeue_busy(message_id, fields)
+            return
+
+        heartbeat = asyncio.create_task(
+            self.heartbeat(message_id, user_key, lock_value)
+        )
+        error = None
+        try:
+            p = await flush_buffer_by_ids(
+                user_id,
+                project_id,
+                blob_type,
+                buffer_ids,
+                select_status=BufferStatus.processing,
+            )
+            if not p.ok():
+                error = p.msg()
+        except Exception as e:
+            error = f"{e}\n{traceback.format_exc()}"
+        finally:
+            heartbeat.cancel()
+            async with get_redis_client() as redis_client:
+                await redis_client.eval(
+                    REDIS_LUA_CHECK_AND_DELETE_LOCK, 1, user_key, lock_value
+                )
+
+        if error is None:
+            async with get_redis_client() as redis_client:
+                pipe = redis_client.pipeline(transaction=True)
+                finish_job(pipe, message_id)
+                await pipe.execute()
+            TRACE_LOG.info(project_id, user_id, f"[worker] Flush job {message_id} done")
+            return
+
+        if attempt >= self.max_retries:
+            await self.dead_letter(message_id, fields, error)
+            return
+        TRACE_LOG.warning(
+            project_id,
+            user_id,
+            f"[worker] Flush job {message_id} failed (attempt {attempt}), retrying: {error}",
+        )
+        # flush_buffer_by_ids marks the buffers failed, set them back for the retry
+        async with AsyncSession() as session:
+            await session.execute(
+                update(BufferZone)
+                .where(
+                    BufferZone.id.in_(buffer_ids),
+                    BufferZone.status == BufferStatus.failed,
+                )
+                .values(status=BufferStatus.processing)
+            )
+            await session.commit()
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.xadd(
+                FLUSH_STREAM_KEY, {**fields, "attempt": str(attempt + 1), "busy": "0"}
+            )
+            finish_job(pipe, message_id)
+            await pipe.execute()
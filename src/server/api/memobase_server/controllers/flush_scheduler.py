@@ -0,0 +1,75 @@
+"""
+Fair dispatch of the flush jobs a worker has fetched.
+
+Jobs wait in one FIFO per project and are started round-robin across projects,
+so one project's backlog can't starve the others. At most `concurrency` jobs run
+at once and at most one per user, a user's next job waits for the running one
+instead of being bounced back to the stream.
+"""
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+
+@dataclass
+class FlushJob:
+    message_id: str
+    fields: dict
+    user_id: str = field(init=False)
+    project_id: str = field(init=False)
+
+    def __post_init__(self):
+        self.user_id = self.fields["user_id"]
+        self.project_id = self.fields["project_id"]
+
+
+class FlushScheduler:
+    def __init__(self, concurrency: int, max_queued: int):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        # project_id -> waiting jobs, the next project to serve first
+        self.queues: OrderedDict[str, deque[FlushJob]] = OrderedDict()
+        self.running_users: set[tuple[str, str]] = set()
+
+    def queued(self) -> int:
+        return sum(len(jobs) for jobs in self.queues.values())
+
+    def queued_message_ids(self) -> list[str]:
+        return [job.message_id for jobs in self.queues.values() for job in jobs]
+
+    def fetch_room(self) -> int:
+        """How many more jobs to fetch from the stream"""
+        return max(self.max_queued - self.queued(), 0)
+
+    def free_slots(self) -> int:
+        return self.concurrency - len(self.running_users)
+
+    def add(self, job: FlushJob):
+        self.queues.setdefault(job.project_id, deque()).append(job)
+
+    def next_job(self) -> FlushJob | None:
+        """Take the next runnable job and mark its user as running"""
+        if self.free_slots() <= 0:
+            return None
+        for project_id in list(self.queues):
+            jobs = self.queues[project_id]
+            for i, job in enumerate(jobs):
+                if (job.project_id, job.user_id) in self.running_users:
+                    continue
+                del jobs[i]
+                # A served project goes to the back of the line
+                self.queues.move_to_end(project_id)
+                if not jobs:
+                    del self.queues[project_id]
+                self.running_users.add((job.project_id, job.user_id))
+                return job
+        return None
+
+    def done(self, job: FlushJob):
+        self.running_users.discard((job.project_id, job.user_id))
+
+    def drain(self) -> list[FlushJob]:
+        """Remove and return every waiting job"""
+        jobs = [job for jobs in self.queues.values() for job in jobs]
+        self.queues.clear()
+        return jobs
@@ -1,24 +1,32 @@
+import time
 import asyncio
 from ...project import get_project_profile_config
-from ....connectors import Session
 from ....env import ProfileConfig, CONFIG, TRACE_LOG
 from ....utils import get_blob_str, get_encoded_tokens
 from ....models.blob import Blob
 from ....models.utils import Promise, CODE
 from ....models.response import IdsData, ChatModalResponse, UserProfilesData
+from ....telemetry import telemetry_manager, HistogramMetricName
+from ....telemetry.stage import stage_timer, timed_flush
+from ....prompts import event_tagging as event_tagging_prompt, summary_profile
 from ...profile import add_update_delete_user_profiles
 from ...event import append_user_event
 from ...profile import get_user_profiles
 from .extract import extract_topics
-
-# from .merge import merge_or_valid_new_memos
-from .merge_yolo import merge_or_valid_new_memos
+from . import merge, merge_yolo
 from .summary import re_summary
 from .organize import organize_profiles
 from .types import MergeAddResult
+from .utils import get_prompt_id
 from .event_summary import tag_event
 from .entry_summary import entry_chat_summary
 
+MERGE_STRATEGIES = {
+    "batch": merge_yolo.merge_or_valid_new_memos,
+    "per_fact": merge.merge_or_valid_new_memos,
+}
+MERGE_STRATEGY_PROMPTS = {"batch": "merge_yolo", "per_fact": "merge"}
+
 
 def truncate_chat_blobs(
     blobs: list[Blob], max_token_size: int
@@ -35,6 +43,7 @@ def truncate_chat_blobs(
     return results[::-1]
 
 
+@timed_flush("chat")
 async def process_blobs(
     user_id: str, project_id: str, blobs: list[Blob]
 ) -> Promise[ChatModalResponse]:
@@ -45,19 +54,26 @@ async def process_blobs(
             CODE.SERVER_PARSE_ERROR, "No blobs to process after truncating"
         )
 
-    p = await get_project_profile_config(project_id)
+    with stage_timer(project_id, "load_profile_config"):
+        p = await get_project_profile_config(project_id)
     if not p.ok():
         return p
     project_profiles = p.data()
 
-    p = await get_user_profiles(user_id, project_id)
+    with stage_timer(project_id, "load_user_profiles"):
+        p = await get_user_profiles(user_id, project_id)
     if not p.ok():
         return p
     current_user_profiles = p.data()
 
-    p = await entry_chat_summary(
-        user_id, project_id, blobs, project_profiles, current_user_profiles
-    )
+    with stage_timer(
+        project_id,
+        "entry_summary",
+        get_prompt_id(project_id, project_profiles, "entry_summary"),
+    ):
+        p = await entry_chat_summary(
+            user_id, project_id, blobs, project_profiles, current_user_profiles
+        )
     if not p.ok():
         return p
     user_memo_str = p.data().strip()
@@ -126,23 +142,45 @@ async def process_profile_res(
     current_user_profiles: UserProfilesData,
 ) -> Promise[tuple[MergeAddResult, list[dict]]]:
 
-    p = await extract_topics(
-        user_id, project_id, user_memo_str, project_profiles, current_user_profiles
-    )
+    with stage_timer(
+        project_id,
+        "extract",
+        get_prompt_id(project_id, project_profiles, "extract"),
+    ):
+        p = await extract_topics(
+            user_id, project_id, user_memo_str, project_profiles, current_user_profiles
+        )
     if not p.ok():
         return p
     extracted_data = p.data()
 
     # 2. Merge it to thw whole profile
-    p = await merge_or_valid_new_memos(
-        user_id,
-        project_id,
-        fact_contents=extracted_data["fact_contents"],
-        fact_attributes=extracted_data["fact_attributes"],
-        profiles=extracted_data["profiles"],
-        config=project_profiles,
-        total_profiles=extracted_data["total_profiles"],
+    merge_strategy = (
+        project_profiles.profile_merge_strategy or CONFIG.profile_merge_strategy
     )
+    start_time = time.monotonic()
+    with stage_timer(
+        project_id,
+        "merge",
+        get_prompt_id(
+            project_id, project_profiles, MERGE_STRATEGY_PROMPTS[merge_strategy]
+        ),
+    ):
+        p = await MERGE_STRATEGIES[merge_strategy](
+            user_id,
+            project_id,
+            fact_contents=extracted_data["fact_contents"],
+            fact_attributes=extracted_data["fact_attributes"],
+            profiles=extracted_data["profiles"],
+            config=project_profiles,
+            total_profiles=extracted_data["total_profiles"],
+        )
+    if len(extracted_data["fact_contents"]):
+        telemetry_manager.record_histogram_metric(
+            HistogramMetricName.PROFILE_MERGE_LATENCY_MS,
+            (time.monotonic() - start_time) * 1000,
+            {"project_id": project_id, "strategy": merge_strategy},
+        )
     if not p.ok():
         return p
 
@@ -152,12 +190,17 @@ async def process_profile_res(
     ]
 
     # 3. Check if we need to organize profiles
-    p = await organize_profiles(
-        user_id,
+    with stage_timer(
         project_id,
-        intermediate_profile,
-        config=project_profiles,
-    )
+        "organize",
+        get_prompt_id(project_id, project_profiles, "organize"),
+    ):
+        p = await organize_profiles(
+            user_id,
+            project_id,
+            intermediate_profile,
+            config=project_profiles,
+        )
     if not p.ok():
         TRACE_LOG.error(
             project_id,
@@ -166,12 +209,15 @@ async def process_profile_res(
         )
 
     # 4. Re-summary profiles if any slot is too big
-    p = await re_summary(
-        user_id,
-        project_id,
-        add_profile=intermediate_profile["add"],
-        update_profile=intermediate_profile["update"],
-    )
+    with stage_timer(
+        project_id, "re_summary", summary_profile.get_kwargs()["prompt_id"]
+    ):
+        p = await re_summary(
+            user_id,
+            project_id,
+            add_profile=intermediate_profile["add"],
+            update_profile=intermediate_profile["update"],
+        )
     if not p.ok():
         TRACE_LOG.error(
             project_id,
@@ -189,7 +235,10 @@ async def process_event_res(
     config: ProfileConfig,
     current_user_profiles: UserProfilesData,
 ) -> Promise[list | None]:
-    p = await tag_event(project_id, config, memo_str)
+    with stage_timer(
+        project_id, "tag_event", event_tagging_prompt.get_kwargs()["prompt_id"]
+    ):
+        p = await tag_event(project_id, config, memo_str)
     if not p.ok():
         TRACE_LOG.error(
             project_id,
@@ -232,14 +281,15 @@ async def handle_user_profile_db(
         f"Adding {len(intermediate_profile['add'])}, updating {len(intermediate_profile['update'])}, deleting {len(intermediate_profile['delete'])} profiles",
     )
 
-    p = await add_update_delete_user_profiles(
-        user_id,
-        project_id,
-        [ap["content"] for ap in intermediate_profile["add"]],
-        [ap["attributes"] for ap in intermediate_profile["add"]],
-        [up["profile_id"] for up in intermediate_profile["update"]],
-        [up["content"] for up in intermediate_profile["update"]],
-        [up["attributes"] for up in intermediate_profile["update"]],
-        intermediate_profile["delete"],
-    )
+    with stage_timer(project_id, "profile_db_write"):
+        p = await add_update_delete_user_profiles(
+            user_id,
+            project_id,
+            [ap["content"] for ap in intermediate_profile["add"]],
+            [ap["attributes"] for ap in intermediate_profile["add"]],
+            [up["profile_id"] for up in intermediate_profile["update"]],
+            [up["content"] for up in intermediate_profile["update"]],
+            [up["attributes"] for up in intermediate_profile["update"]],
+            intermediate_profile["delete"],
+        )
     return p
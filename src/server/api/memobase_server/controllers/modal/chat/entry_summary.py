@@ -3,13 +3,15 @@ from ....env import CONFIG
 from ....models.utils import Promise
 from ....models.blob import Blob, BlobType
 from ....llms import llm_complete
-from ....prompts.profile_init_utils import read_out_profile_config
 from ...project import ProfileConfig
-from ....prompts.profile_init_utils import read_out_event_tags
 from ....prompts.utils import tag_chat_blobs_in_order_xml
 from .types import FactResponse, PROMPTS
 from ....models.response import UserProfilesData
-from .utils import pack_current_user_profiles
+from .utils import (
+    pack_current_user_profiles,
+    get_profile_config_artifacts,
+    get_system_prompt,
+)
 
 
 async def entry_chat_summary(
@@ -21,35 +23,35 @@ async def entry_chat_summary(
 ) -> Promise[str]:
     assert all(b.type == BlobType.chat for b in blobs), "All blobs must be chat blobs"
     CURRENT_PROFILE_INFO = pack_current_user_profiles(
-        current_user_profiles, project_profiles
+        project_id, current_user_profiles, project_profiles
     )
 
     USE_LANGUAGE = CURRENT_PROFILE_INFO["use_language"]
-    project_profiles_slots = CURRENT_PROFILE_INFO["project_profile_slots"]
+    artifacts = get_profile_config_artifacts(project_id, project_profiles)
 
     prompt = PROMPTS[USE_LANGUAGE]["entry_summary"]
     event_summary_theme = (
         project_profiles.event_theme_requirement or CONFIG.event_theme_requirement
     )
 
-    event_tags = read_out_event_tags(project_profiles)
-    event_attriubtes_str = "\n".join(
-        [f"- {et.name}({et.description})" for et in event_tags]
-    )
-    profile_topics_str = PROMPTS[USE_LANGUAGE]["profile"].get_prompt(
-        project_profiles_slots
+    event_attriubtes_str = artifacts["event_tags_prompt"]
+    profile_topics_str = artifacts["profile_topics_prompt"]
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id,
+        project_profiles,
+        prompt,
+        profile_topics_str,
+        event_attriubtes_str,
+        additional_requirements=event_summary_theme,
     )
     blob_strs = tag_chat_blobs_in_order_xml(blobs)
     r = await llm_complete(
         project_id,
         prompt.pack_input(CURRENT_PROFILE_INFO["already_topics_prompt"], blob_strs),
-        system_prompt=prompt.get_prompt(
-            profile_topics_str,
-            event_attriubtes_str,
-            additional_requirements=event_summary_theme,
-        ),
+        system_prompt=system_prompt,
         temperature=0.2,  # precise
         model=CONFIG.summary_llm_model,
+        prompt_hash=prompt_hash,
         **prompt.get_kwargs(),
     )
 
@@ -5,7 +5,7 @@ from ....prompts.utils import (
     parse_string_into_subtopics,
     attribute_unify,
 )
-from ....prompts.profile_init_utils import read_out_event_tags
+from .utils import get_profile_config_artifacts, get_system_prompt
 from ....llms import llm_complete
 
 from ....prompts import event_tagging as event_tagging_prompt
@@ -14,17 +14,20 @@ from ....prompts import event_tagging as event_tagging_prompt
 async def tag_event(
     project_id: str, config: ProfileConfig, event_summary: str
 ) -> Promise[Optional[list]]:
-    event_tags = read_out_event_tags(config)
-    available_event_tags = set([et.name for et in event_tags])
-    if len(event_tags) == 0:
+    artifacts = get_profile_config_artifacts(project_id, config)
+    available_event_tags = artifacts["available_event_tags"]
+    if len(artifacts["event_tags"]) == 0:
         return Promise.resolve(None)
-    event_tags_str = "\n".join([f"- {et.name}({et.description})" for et in event_tags])
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id, config, event_tagging_prompt, artifacts["event_tags_prompt"]
+    )
     r = await llm_complete(
         project_id,
         event_summary,
-        system_prompt=event_tagging_prompt.get_prompt(event_tags_str),
+        system_prompt=system_prompt,
         temperature=0.2,
         model=CONFIG.best_llm_model,
+        prompt_hash=prompt_hash,
         **event_tagging_prompt.get_kwargs(),
     )
     if not r.ok():
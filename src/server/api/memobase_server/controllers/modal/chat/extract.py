@@ -6,10 +6,13 @@ from ....prompts.utils import (
     attribute_unify,
     parse_string_into_profiles,
 )
-from ....prompts.profile_init_utils import read_out_profile_config, UserProfileTopic
 from ...project import ProfileConfig
 from .types import FactResponse, PROMPTS
-from .utils import pack_current_user_profiles
+from .utils import (
+    pack_current_user_profiles,
+    get_profile_config_artifacts,
+    get_system_prompt,
+)
 
 
 def merge_by_topic_sub_topics(new_facts: list[FactResponse]):
@@ -33,12 +36,20 @@ async def extract_topics(
 
     profiles = current_user_profiles.profiles
     CURRENT_PROFILE_INFO = pack_current_user_profiles(
-        current_user_profiles, project_profiles
+        project_id, current_user_profiles, project_profiles
     )
     USE_LANGUAGE = CURRENT_PROFILE_INFO["use_language"]
     STRICT_MODE = CURRENT_PROFILE_INFO["strict_mode"]
 
     project_profiles_slots = CURRENT_PROFILE_INFO["project_profile_slots"]
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id,
+        project_profiles,
+        PROMPTS[USE_LANGUAGE]["extract"],
+        get_profile_config_artifacts(project_id, project_profiles)[
+            "profile_topics_prompt"
+        ],
+    )
 
     p = await llm_complete(
         project_id,
@@ -47,10 +58,9 @@ async def extract_topics(
             user_memo,
             strict_mode=STRICT_MODE,
         ),
-        system_prompt=PROMPTS[USE_LANGUAGE]["extract"].get_prompt(
-            PROMPTS[USE_LANGUAGE]["profile"].get_prompt(project_profiles_slots)
-        ),
+        system_prompt=system_prompt,
         temperature=0.2,  # precise
+        prompt_hash=prompt_hash,
         **PROMPTS[USE_LANGUAGE]["extract"].get_kwargs(),
     )
     if not p.ok():
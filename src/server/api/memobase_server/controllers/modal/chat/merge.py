@@ -9,7 +9,9 @@ from ....prompts.utils import (
 )
 from ....prompts.profile_init_utils import UserProfileTopic
 from ....types import SubTopic
+from ....telemetry import telemetry_manager, CounterMetricName
 from .types import UpdateResponse, PROMPTS, AddProfile, UpdateProfile, MergeAddResult
+from .utils import get_system_prompt
 
 
 async def merge_or_valid_new_memos(
@@ -96,6 +98,19 @@ async def handle_profile_merge_or_valid(
             }
         )
         return Promise.resolve(None)
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id, config, PROMPTS[USE_LANGUAGE]["merge"]
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.PROFILE_MERGE_LLM_CALLS,
+        1,
+        {"project_id": project_id, "strategy": "per_fact"},
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.PROFILE_MERGE_FACTS,
+        1,
+        {"project_id": project_id, "strategy": "per_fact"},
+    )
     r = await llm_complete(
         project_id,
         PROMPTS[USE_LANGUAGE]["merge"].get_input(
@@ -106,8 +121,9 @@ async def handle_profile_merge_or_valid(
             update_instruction=define_sub_topic.update_description,  # maybe none
             topic_description=define_sub_topic.description,  # maybe none
         ),
-        system_prompt=PROMPTS[USE_LANGUAGE]["merge"].get_prompt(),
+        system_prompt=system_prompt,
         temperature=0.2,  # precise
+        prompt_hash=prompt_hash,
         **PROMPTS[USE_LANGUAGE]["merge"].get_kwargs(),
     )
     # print(KEY, profile_content)
@@ -1,14 +1,64 @@
+import asyncio
 from ....env import CONFIG, TRACE_LOG
 from ....models.utils import Promise, CODE
 from ....models.response import ProfileData
 from ....env import ProfileConfig, ContanstTable
 from ....llms import llm_complete
+from ....llms.limiter import estimate_tokens
 from ....prompts.utils import (
     parse_string_into_merge_yolo_action,
 )
 from ....prompts.profile_init_utils import UserProfileTopic
 from ....types import SubTopic
+from ....telemetry import telemetry_manager, CounterMetricName
 from .types import UpdateResponse, PROMPTS, AddProfile, UpdateProfile, MergeAddResult
+from .utils import get_system_prompt
+
+
+def batch_new_memos(
+    new_memos: list[tuple[dict, str, dict]], max_size: int, max_tokens: int
+) -> list[list[tuple[dict, str, dict]]]:
+    batches = [[]]
+    batch_tokens = 0
+    for m in new_memos:
+        tokens = estimate_tokens(str(m[0]))
+        if batches[-1] and (
+            len(batches[-1]) >= max_size or batch_tokens + tokens > max_tokens
+        ):
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(m)
+        batch_tokens += tokens
+    return batches
+
+
+async def merge_memos_batch(
+    project_id: str,
+    new_memos_input: list[dict],
+    config: ProfileConfig,
+) -> Promise[str]:
+    USE_LANGUAGE = config.language or CONFIG.language
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id, config, PROMPTS[USE_LANGUAGE]["merge_yolo"]
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.PROFILE_MERGE_LLM_CALLS,
+        1,
+        {"project_id": project_id, "strategy": "batch"},
+    )
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.PROFILE_MERGE_FACTS,
+        len(new_memos_input),
+        {"project_id": project_id, "strategy": "batch"},
+    )
+    return await llm_complete(
+        project_id,
+        PROMPTS[USE_LANGUAGE]["merge_yolo"].get_input(new_memos_input),
+        system_prompt=system_prompt,
+        temperature=0.2,  # precise
+        prompt_hash=prompt_hash,
+        **PROMPTS[USE_LANGUAGE]["merge_yolo"].get_kwargs(),
+    )
 
 
 async def merge_or_valid_new_memos(
@@ -30,7 +80,6 @@ async def merge_or_valid_new_memos(
         (p.attributes[ContanstTable.topic], p.attributes[ContanstTable.sub_topic]): p
         for p in profiles
     }
-    USE_LANGUAGE = config.language or CONFIG.language
     PROFILE_VALIDATE_MODE = (
         config.profile_validate_mode
         if config.profile_validate_mode is not None
@@ -84,23 +133,53 @@ async def merge_or_valid_new_memos(
                 f_a,
             )
         )
-    new_memos_input = [{"memo_id": i + 1, **m[0]} for i, m in enumerate(new_memos)]
-    r = await llm_complete(
-        project_id,
-        PROMPTS[USE_LANGUAGE]["merge_yolo"].get_input(new_memos_input),
-        system_prompt=PROMPTS[USE_LANGUAGE]["merge_yolo"].get_prompt(),
-        temperature=0.2,  # precise
-        **PROMPTS[USE_LANGUAGE]["merge_yolo"].get_kwargs(),
+    if not new_memos:
+        return Promise.resolve(profile_session_results)
+    batches = batch_new_memos(
+        new_memos,
+        config.profile_merge_batch_size or CONFIG.profile_merge_batch_size,
+        CONFIG.profile_merge_batch_max_tokens,
     )
-    oneline_response = r.data().replace("\n", "<br/>")
-    if not r.ok():
-        TRACE_LOG.warning(
-            project_id,
+    # memo_id restarts from 1 in every batch
+    batches_input = [
+        [{"memo_id": i + 1, **m[0]} for i, m in enumerate(batch)] for batch in batches
+    ]
+    rs = await asyncio.gather(
+        *[merge_memos_batch(project_id, bi, config) for bi in batches_input]
+    )
+    for r in rs:
+        if not r.ok():
+            TRACE_LOG.warning(
+                project_id,
+                user_id,
+                f"Failed to merge profiles: {r.msg()}",
+            )
+            return r
+
+    for batch, new_memos_input, r in zip(batches, batches_input, rs):
+        apply_merge_actions(
             user_id,
-            f"Failed to merge profiles: {r.msg()}",
+            project_id,
+            batch,
+            new_memos_input,
+            r.data(),
+            RUNTIME_MAPS,
+            profile_session_results,
         )
-        return r
-    memo_actions = parse_string_into_merge_yolo_action(r.data())
+    return Promise.resolve(profile_session_results)
+
+
+def apply_merge_actions(
+    user_id: str,
+    project_id: str,
+    new_memos: list[tuple[dict, str, dict]],
+    new_memos_input: list[dict],
+    response: str,
+    RUNTIME_MAPS: dict[tuple[str, str], ProfileData],
+    profile_session_results: MergeAddResult,
+):
+    oneline_response = response.replace("\n", "<br/>")
+    memo_actions = parse_string_into_merge_yolo_action(response)
 
     abort_infos = []
     for i, m in enumerate(new_memos):
@@ -183,4 +262,3 @@ async def merge_or_valid_new_memos(
             user_id,
             f"Invalid merge: {abort_infos}. <raw_response> {oneline_response} </raw_response>",
         )
-    return Promise.resolve(profile_session_results)
@@ -7,6 +7,7 @@ from ....models.utils import Promise, CODE
 from ....models.response import ProfileData
 from ....env import CONFIG, TRACE_LOG, ProfileConfig, ContanstTable
 from ....llms import llm_complete
+from .utils import get_system_prompt
 
 
 async def organize_profiles(
@@ -16,7 +17,6 @@ async def organize_profiles(
     config: ProfileConfig,
 ) -> Promise[None]:
     profiles = profile_options["before_profiles"]
-    USE_LANGUAGE = config.language or CONFIG.language
     STRICT_MODE = (
         config.profile_strict_mode
         if config.profile_strict_mode is not None
@@ -35,7 +35,7 @@ async def organize_profiles(
         return Promise.resolve(None)
     ps = await asyncio.gather(
         *[
-            organize_profiles_by_topic(user_id, project_id, group, USE_LANGUAGE)
+            organize_profiles_by_topic(user_id, project_id, group, config)
             for group in need_to_organize_topics.values()
         ]
     )
@@ -62,8 +62,9 @@ async def organize_profiles_by_topic(
     user_id: str,
     project_id: str,
     profiles: list[ProfileData],
-    USE_LANGUAGE: str,  # profiles in the same topics
+    config: ProfileConfig,  # profiles in the same topics
 ) -> Promise[list[AddProfile]]:
+    USE_LANGUAGE = config.language or CONFIG.language
     assert (
         len(profiles) > CONFIG.max_profile_subtopics
     ), f"Unknown Error,{len(profiles)} is not greater than max_profile_subtopics: {CONFIG.max_profile_subtopics}"
@@ -90,13 +91,19 @@ async def organize_profiles_by_topic(
     llm_prompt = f"""topic: {topic}
 {llm_inputs}
 """
+    system_prompt, prompt_hash = get_system_prompt(
+        project_id,
+        config,
+        PROMPTS[USE_LANGUAGE]["organize"],
+        CONFIG.max_profile_subtopics // 2 + 1,
+        suggest_subtopics,
+    )
     p = await llm_complete(
         project_id,
         llm_prompt,
-        PROMPTS[USE_LANGUAGE]["organize"].get_prompt(
-            CONFIG.max_profile_subtopics // 2 + 1, suggest_subtopics
-        ),
+        system_prompt,
         temperature=0.2,  # precise
+        prompt_hash=prompt_hash,
         **PROMPTS[USE_LANGUAGE]["organize"].get_kwargs(),
     )
     if not p.ok():
@@ -1,28 +1,33 @@
+from types import ModuleType
 from typing import TypedDict
 from ....env import CONFIG
 from ....models.response import UserProfilesData
-from ...project import ProfileConfig
-from ....prompts.profile_init_utils import read_out_profile_config
+from ...project import ProfileConfig, get_cached_profile_config_artifacts
+from ....prompts.profile_init_utils import read_out_profile_config, read_out_event_tags
 from .types import PROMPTS
-from ....types import UserProfileTopic
+from ....types import UserProfileTopic, EventTag
 from ....env import ContanstTable
 from ....utils import truncate_string
 from ....prompts.utils import attribute_unify
+from ....llms.utils import compute_prompt_hash
 
 
-class PackCurrentUserProfilesResult(TypedDict):
-    already_topics_prompt: str
-    allowed_topic_subtopics: set[tuple[str, str]]
-    already_topic_subtopics_values: dict[tuple[str, str], str]
-    project_profile_slots: list[UserProfileTopic]
+class ProfileConfigArtifacts(TypedDict):
     use_language: str
     strict_mode: bool
+    project_profile_slots: list[UserProfileTopic]
+    allowed_topic_subtopics: set[tuple[str, str]] | None
+    profile_topics_prompt: str
+    event_tags: list[EventTag]
+    available_event_tags: set[str]
+    event_tags_prompt: str
+    # (prompt module, args) -> (rendered system prompt, its hash)
+    system_prompts: dict[tuple, tuple[str, str]]
 
 
-def pack_current_user_profiles(
-    current_user_profiles: UserProfilesData, project_profiles: ProfileConfig
-) -> PackCurrentUserProfilesResult:
-    profiles = current_user_profiles.profiles
+def build_profile_config_artifacts(
+    project_profiles: ProfileConfig,
+) -> ProfileConfigArtifacts:
     USE_LANGUAGE = project_profiles.language or CONFIG.language
     STRICT_MODE = (
         project_profiles.profile_strict_mode
@@ -43,6 +48,108 @@ def pack_current_user_profiles(
     else:
         allowed_topic_subtopics = None
 
+    event_tags = read_out_event_tags(project_profiles)
+    return {
+        "use_language": USE_LANGUAGE,
+        "strict_mode": STRICT_MODE,
+        "project_profile_slots": project_profiles_slots,
+        "allowed_topic_subtopics": allowed_topic_subtopics,
+        "profile_topics_prompt": PROMPTS[USE_LANGUAGE]["profile"].get_prompt(
+            project_profiles_slots
+        ),
+        "event_tags": event_tags,
+        "available_event_tags": set([et.name for et in event_tags]),
+        "event_tags_prompt": "\n".join(
+            [f"- {et.name}({et.description})" for et in event_tags]
+        ),
+        "system_prompts": {},
+    }
+
+
+def global_config_key() -> str:
+    # The global CONFIG values the artifacts and system prompts are built from
+    return repr(
+        (
+            CONFIG.language,
+            CONFIG.profile_strict_mode,
+            CONFIG.llm_tab_separator,
+            CONFIG.system_prompt,
+            CONFIG.overwrite_user_profiles,
+            CONFIG.additional_user_profiles,
+            CONFIG.event_tags,
+        )
+    )
+
+
+def get_profile_config_artifacts(
+    project_id: str, project_profiles: ProfileConfig
+) -> ProfileConfigArtifacts:
+    """Built once per config version and CONFIG values, if `project_profiles` is
+    the project's cached config, else built on every call"""
+    cached = get_cached_profile_config_artifacts(project_id, project_profiles)
+    if cached is None:
+        return build_profile_config_artifacts(project_profiles)
+    key = global_config_key()
+    artifacts = cached.get(key)
+    if artifacts is None:
+        # CONFIG changed, the old artifacts are stale
+        cached.clear()
+        artifacts = build_profile_config_artifacts(project_profiles)
+        cached[key] = artifacts
+    return artifacts
+
+
+def get_prompt_id(project_id: str, project_profiles: ProfileConfig, name: str) -> str:
+    use_language = get_profile_config_artifacts(project_id, project_profiles)[
+        "use_language"
+    ]
+    return PROMPTS[use_language][name].get_kwargs()["prompt_id"]
+
+
+def get_system_prompt(
+    project_id: str,
+    project_profiles: ProfileConfig,
+    prompt: ModuleType,
+    *args,
+    **kwargs,
+) -> tuple[str, str]:
+    """`prompt.get_prompt(*args, **kwargs)` and its hash, rendered once per config
+    version. The args must only depend on the config, not on the user."""
+    key = (
+        prompt.__name__,
+        *[tuple(a) if isinstance(a, list) else a for a in args],
+        *sorted(kwargs.items()),
+    )
+    system_prompts = get_profile_config_artifacts(project_id, project_profiles)[
+        "system_prompts"
+    ]
+    rendered = system_prompts.get(key)
+    if rendered is None:
+        system_prompt = prompt.get_prompt(*args, **kwargs)
+        rendered = (system_prompt, compute_prompt_hash(system_prompt))
+        system_prompts[key] = rendered
+    return rendered
+
+
+class PackCurrentUserProfilesResult(TypedDict):
+    already_topics_prompt: str
+    allowed_topic_subtopics: set[tuple[str, str]]
+    already_topic_subtopics_values: dict[tuple[str, str], str]
+    project_profile_slots: list[UserProfileTopic]
+    use_language: str
+    strict_mode: bool
+
+
+def pack_current_user_profiles(
+    project_id: str,
+    current_user_profiles: UserProfilesData,
+    project_profiles: ProfileConfig,
+) -> PackCurrentUserProfilesResult:
+    profiles = current_user_profiles.profiles
+    artifacts = get_profile_config_artifacts(project_id, project_profiles)
+    STRICT_MODE = artifacts["strict_mode"]
+    allowed_topic_subtopics = artifacts["allowed_topic_subtopics"]
+
     if len(profiles):
         already_topics_subtopics = set(
             [
@@ -82,7 +189,7 @@ def pack_current_user_profiles(
         "already_topics_prompt": already_topics_prompt,
         "allowed_topic_subtopics": allowed_topic_subtopics,
         "already_topic_subtopics_values": already_topic_subtopics_values,
-        "project_profile_slots": project_profiles_slots,
-        "use_language": USE_LANGUAGE,
+        "project_profile_slots": artifacts["project_profile_slots"],
+        "use_language": artifacts["use_language"],
         "strict_mode": STRICT_MODE,
     }
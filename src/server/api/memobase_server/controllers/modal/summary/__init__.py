@@ -8,6 +8,7 @@ from ....utils import get_blob_str, get_encoded_tokens
 from ....models.blob import Blob
 from ....models.utils import Promise, CODE
 from ....models.response import IdsData, ChatModalResponse
+from ....telemetry.stage import stage_timer, timed_flush
 from ..chat import (
     process_profile_res,
     process_event_res,
@@ -20,18 +21,21 @@ def pack_summary(blobs: list[Blob]) -> str:
     return "\n".join([get_blob_str(b) for b in blobs])
 
 
+@timed_flush("summary")
 async def process_blobs(user_id: str, project_id: str, blobs: list[Blob]):
     if len(blobs) == 0:
         return Promise.reject(
             CODE.SERVER_PARSE_ERROR, "No blobs to process after truncating"
         )
 
-    p = await get_project_profile_config(project_id)
+    with stage_timer(project_id, "load_profile_config"):
+        p = await get_project_profile_config(project_id)
     if not p.ok():
         return p
     project_profiles = p.data()
 
-    p = await get_user_profiles(user_id, project_id)
+    with stage_timer(project_id, "load_user_profiles"):
+        p = await get_user_profiles(user_id, project_id)
     if not p.ok():
         return p
     current_user_profiles = p.data()
@@ -1,15 +1,40 @@
 import json
 import re
+import time
+import asyncio
 from pydantic import ValidationError
-from typing import TypedDict
+from typing import Literal, TypedDict
+from sqlalchemy import select
 from ...models.utils import Promise
 from ...models.database import GeneralBlob, UserProfile
 from ...models.blob import OpenAICompatibleMessage
-from ...models.response import CODE, IdData, IdsData, UserProfilesData
+from ...models.response import (
+    CODE,
+    IdData,
+    IdsData,
+    ProfileData,
+    UserProfilesData,
+)
 from ...utils import truncate_string, find_list_int_or_none
 from ...env import TRACE_LOG, CONFIG
 from ...prompts import pick_related_profiles as pick_prompt
 from ...llms import llm_complete
+from ...llms.embeddings import get_embedding
+from ...connectors import AsyncSession
+from ...deadline import (
+    within_deadline,
+    deadline_exceeded,
+    is_deadline_error,
+    without_deadline,
+)
+from ...telemetry import telemetry_manager, HistogramMetricName
+from ..project import get_project_profile_config
+from ..profile import embed_user_profiles
+
+# Profiles written before enable_profile_embedding are embedded when first ranked
+MAX_BACKFILL_PROFILES = 100
+BACKFILL_TASKS: set[asyncio.Task] = set()
+BACKFILL_RUNNING: set[tuple[str, str]] = set()
 
 
 class FilterProfilesResult(TypedDict):
@@ -65,6 +90,7 @@ async def filter_profiles_with_chats(
         system_prompt=system_prompt,
         temperature=0.2,  # precise
         model=CONFIG.summary_llm_model,
+        priority="read",
         **pick_prompt.get_kwargs(),
     )
     if not r.ok():
@@ -93,3 +119,139 @@ async def filter_profiles_with_chats(
         f"Filter profiles with chats: {reason}, {found_ids}",
     )
     return Promise.resolve({"reason": reason, "profiles": profiles})
+
+
+async def backfill_profile_embeddings(
+    user_id: str, project_id: str, profiles: list[ProfileData]
+):
+    try:
+        await embed_user_profiles(user_id, project_id, profiles)
+    finally:
+        BACKFILL_RUNNING.discard((project_id, user_id))
+
+
+def start_profile_embedding_backfill(
+    user_id: str, project_id: str, profiles: list[ProfileData]
+):
+    """Embed `profiles` in the background, once at a time per user"""
+    key = (project_id, user_id)
+    if not profiles or key in BACKFILL_RUNNING:
+        return
+    BACKFILL_RUNNING.add(key)
+    TRACE_LOG.info(
+        project_id, user_id, f"Backfill embeddings of {len(profiles)} profiles"
+    )
+    # Not bound to the deadline of the request that noticed them
+    with without_deadline():
+        task = asyncio.create_task(
+            backfill_profile_embeddings(
+                user_id, project_id, profiles[:MAX_BACKFILL_PROFILES]
+            )
+        )
+    BACKFILL_TASKS.add(task)
+    task.add_done_callback(BACKFILL_TASKS.discard)
+
+
+async def rank_profiles_with_chats(
+    user_id: str,
+    project_id: str,
+    profiles: UserProfilesData,
+    chats: list[OpenAICompatibleMessage],
+    only_topics: list[str] | None = None,
+    max_previous_chats: int = 4,
+    max_filter_num: int = 10,
+) -> Promise[FilterProfilesResult]:
+    """Pick the profiles closest to the chats by cosine similarity of their embeddings
+
+    Profiles without an embedding yet come after the ranked ones, most recent
+    first, and are embedded in the background.
+    """
+    if not len(chats) or not len(profiles.profiles):
+        return Promise.reject(CODE.BAD_REQUEST, "No chats or profiles to rank")
+    if not (CONFIG.enable_profile_embedding and CONFIG.enable_event_embedding):
+        return Promise.reject(CODE.BAD_REQUEST, "Profile embedding is not enabled")
+    if only_topics:
+        only_topics = set(t.strip() for t in only_topics)
+    candidates = {
+        p.id: p
+        for p in profiles.profiles
+        if only_topics is None or p.attributes["topic"].strip() in only_topics
+    }
+
+    query = "\n".join(m.content for m in chats[-(max_previous_chats + 1) :])
+    p = await get_embedding(project_id, [query], phase="query")
+    if not p.ok():
+        return p
+    # One user has few profiles, no ANN index needed
+    async with AsyncSession() as session:
+        ranked_ids = (
+            await session.execute(
+                select(UserProfile.id)
+                .where(
+                    UserProfile.user_id == user_id,
+                    UserProfile.project_id == project_id,
+                    UserProfile.embedding.is_not(None),
+                )
+                .order_by(UserProfile.embedding.cosine_distance(p.data()[0]))
+            )
+        ).scalars()
+        ranked = [candidates.pop(i) for i in ranked_ids if i in candidates]
+    unembedded = list(candidates.values())
+    start_profile_embedding_backfill(user_id, project_id, unembedded)
+    if not ranked:
+        return Promise.reject(CODE.NOT_FOUND, "No embedded profiles to rank")
+    return Promise.resolve(
+        {"reason": None, "profiles": (ranked + unembedded)[:max_filter_num]}
+    )
+
+
+PROFILE_FILTER_METHODS = {
+    "llm": filter_profiles_with_chats,
+    "embedding": rank_profiles_with_chats,
+}
+
+
+async def filter_profiles_within_deadline(
+    user_id: str,
+    project_id: str,
+    profiles: UserProfilesData,
+    chats: list[OpenAICompatibleMessage],
+    only_topics: list[str] | None = None,
+    method: Literal["llm", "embedding"] | None = None,
+) -> bool:
+    """Filter `profiles` in place, they are kept as they are if the filtering fails.
+
+    `method` defaults to the project's `profile_filter_method`, then CONFIG's.
+    Returns True if the request deadline cut the filtering off.
+    """
+    start = time.monotonic()
+    cut_off = False
+    try:
+        if method is None:
+            p = await get_project_profile_config(project_id)
+            if p.ok():
+                method = p.data().profile_filter_method
+            method = method or CONFIG.profile_filter_method
+        p = await within_deadline(
+            PROFILE_FILTER_METHODS[method](
+                user_id, project_id, profiles, chats, only_topics=only_topics
+            )
+        )
+    except Exception as e:
+        # Also the statement_timeout of the deadline canceling a query
+        if not is_deadline_error(e):
+            raise
+        cut_off = True
+        p = Promise.reject(CODE.GATEWAY_TIMEOUT, "Exceeded the request deadline")
+    telemetry_manager.record_histogram_metric(
+        HistogramMetricName.PROFILE_FILTER_LATENCY_MS,
+        (time.monotonic() - start) * 1000,
+        {"project_id": project_id, "method": method or "unknown"},
+    )
+    if p.ok():
+        profiles.profiles = p.data()["profiles"]
+        return False
+    if cut_off or deadline_exceeded():
+        TRACE_LOG.warning(project_id, user_id, f"Skip profile filtering: {p.msg()}")
+        return True
+    return False
@@ -1,10 +1,144 @@
+import json
+from bisect import bisect_right
+from itertools import accumulate
 from pydantic import ValidationError
+from sqlalchemy import select, delete, update
 from ..models.utils import Promise
 from ..models.database import GeneralBlob, UserProfile
-from ..models.response import CODE, IdData, IdsData, UserProfilesData, ProfileAttributes
-from ..connectors import Session, get_redis_client
-from ..utils import get_encoded_tokens
+from ..models.response import (
+    CODE,
+    IdData,
+    IdsData,
+    UserProfilesData,
+    ProfileData,
+    ProfileAttributes,
+)
+from ..connectors import AsyncSession, get_redis_client
+from ..local_cache import LocalTTLCache
+from ..utils import get_profile_token_size
 from ..env import CONFIG, TRACE_LOG
+from ..llms.embeddings import get_embedding
+
+# Profiles are cached as a redis hash per user, profile id -> ProfileData json.
+# The hash only counts as the full profile set once it has PROFILE_CACHE_LOADED,
+# and every write bumps the user's version so a slow reader can't put an older
+# DB snapshot back.
+PROFILE_CACHE_LOADED = "__loaded__"
+
+# (project_id, user_id) -> (profile version, UserProfilesData), only for callers
+# that don't modify the returned profiles
+LOCAL_PROFILE_CACHE = LocalTTLCache(
+    CONFIG.cache_user_profiles_local_max_size, CONFIG.cache_user_profiles_local_ttl
+)
+
+REDIS_LUA_LOAD_PROFILE_CACHE = """
+if (redis.call("GET", KEYS[2]) or "0") ~= ARGV[1] then
+    return 0
+end
+redis.call("DEL", KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call("HSET", KEYS[1], "__loaded__", "1")
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return 1
+"""
+
+REDIS_LUA_WRITE_THROUGH_PROFILE_CACHE = """
+redis.call("INCR", KEYS[2])
+redis.call("EXPIRE", KEYS[2], ARGV[1] * 2)
+if redis.call("HEXISTS", KEYS[1], "__loaded__") == 0 then
+    return 0
+end
+local deleted = tonumber(ARGV[2])
+for i = 3 + deleted, #ARGV, 2 do
+    redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+-- after the upserts, a profile updated then deleted in one merge is gone
+for i = 3, 2 + deleted do
+    redis.call("HDEL", KEYS[1], ARGV[i])
+end
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def user_profiles_cache_key(user_id: str, project_id: str) -> str:
+    return f"user_profiles_hash::{project_id}::{user_id}"
+
+
+def user_profiles_version_key(user_id: str, project_id: str) -> str:
+    return f"user_profiles_version::{project_id}::{user_id}"
+
+
+def profile_orm_to_data(up: UserProfile) -> ProfileData:
+    return ProfileData(
+        id=up.id,
+        content=up.content,
+        attributes=up.attributes,
+        created_at=up.created_at,
+        updated_at=up.updated_at,
+        token_size=up.token_size,
+    )
+
+
+def profile_to_cache_json(profile: ProfileData) -> str:
+    # Unset fields (e.g. timestamps of a profile not read back from the DB) are
+    # left out, so reading the cache falls back to the model defaults instead of
+    # validating null as a datetime
+    data = profile.model_dump(mode="json", exclude_none=True)
+    # token_size is left out of responses, but the cache needs it
+    if profile.token_size is not None:
+        data["token_size"] = profile.token_size
+    return json.dumps(data)
+
+
+def profile_token_size(profile: ProfileData) -> int:
+    # Rows written before token_size was stored don't have it
+    if profile.token_size is None:
+        return get_profile_token_size(profile.content, profile.attributes)
+    return profile.token_size
+
+
+def profile_embedding_text(content: str, attributes: dict) -> str:
+    return f"{attributes.get('topic')}::{attributes.get('sub_topic')}: {content}"
+
+
+async def embed_user_profiles(
+    user_id: str, project_id: str, db_profiles: list[UserProfile] | list[ProfileData]
+) -> Promise[None]:
+    """Store the embeddings of committed profiles, if `enable_profile_embedding`
+
+    A failure is only logged, the profiles are then left out of embedding ranking.
+    """
+    if not (
+        CONFIG.enable_profile_embedding
+        and CONFIG.enable_event_embedding
+        and db_profiles
+    ):
+        return Promise.resolve(None)
+    p = await get_embedding(
+        project_id,
+        [profile_embedding_text(up.content, up.attributes) for up in db_profiles],
+        phase="document",
+    )
+    if not p.ok():
+        TRACE_LOG.error(project_id, user_id, f"Failed to embed profiles: {p.msg()}")
+        return p
+    async with AsyncSession() as session:
+        for up, vector in zip(db_profiles, p.data()):
+            # Skip profiles rewritten meanwhile, their writer embeds them again
+            await session.execute(
+                update(UserProfile)
+                .where(
+                    UserProfile.id == up.id,
+                    UserProfile.project_id == project_id,
+                    UserProfile.content == up.content,
+                )
+                .values(embedding=vector)
+            )
+        await session.commit()
+    return Promise.resolve(None)
 
 
 async def truncate_profiles(
@@ -60,60 +194,89 @@ async def truncate_profiles(
     if topk:
         profiles.profiles = profiles.profiles[:topk]
     if max_token_size:
-        current_length = 0
-        use_index = 0
-        for max_i, p in enumerate(profiles.profiles):
-            single_p = f"{p.attributes.get('topic')}::{p.attributes.get('sub_topic')}: {p.content}"
-            current_length += len(get_encoded_tokens(single_p))
-            if current_length > max_token_size:
-                break
-            use_index = max_i
-        profiles.profiles = profiles.profiles[: use_index + 1]
+        prefix_sizes = list(accumulate(profile_token_size(p) for p in profiles.profiles))
+        # Keeps at least the first profile
+        use_size = max(bisect_right(prefix_sizes, max_token_size), 1)
+        profiles.profiles = profiles.profiles[:use_size]
     return Promise.resolve(profiles)
 
 
-async def get_user_profiles(user_id: str, project_id: str) -> Promise[UserProfilesData]:
+def copy_profiles(profiles: UserProfilesData) -> UserProfilesData:
+    # Callers re-order and filter the list, the items are shared
+    return UserProfilesData.model_construct(profiles=list(profiles.profiles))
+
+
+async def get_user_profiles(
+    user_id: str, project_id: str, local_cache: bool = False
+) -> Promise[UserProfilesData]:
+    """With `local_cache`, the result may be shared with other requests of this
+    process, don't modify the profiles in it."""
+    cache_key = user_profiles_cache_key(user_id, project_id)
+    version_key = user_profiles_version_key(user_id, project_id)
+    local_cache = local_cache and CONFIG.cache_user_profiles_local_ttl > 0
+    local = LOCAL_PROFILE_CACHE.get((project_id, user_id)) if local_cache else None
+    if local is not None:
+        async with get_redis_client() as redis_client:
+            version = await redis_client.get(version_key)
+        if version == local[0]:
+            return Promise.resolve(copy_profiles(local[1]))
     async with get_redis_client() as redis_client:
-        user_profiles = await redis_client.get(
-            f"user_profiles::{project_id}::{user_id}"
-        )
-        if user_profiles:
-            try:
-                return Promise.resolve(
-                    UserProfilesData.model_validate_json(user_profiles)
-                )
-            except ValidationError as e:
-                TRACE_LOG.error(
-                    project_id,
-                    user_id,
-                    f"Invalid user profiles: {e}",
+        # MULTI, the version must match the hash it's read with
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hgetall(cache_key)
+        pipe.get(version_key)
+        cached, version = await pipe.execute()
+    load_cache = True
+    if cached.pop(PROFILE_CACHE_LOADED, None) is not None:
+        try:
+            profiles = [ProfileData.model_validate_json(v) for v in cached.values()]
+            profiles.sort(key=lambda p: p.updated_at, reverse=True)
+            return_profiles = UserProfilesData(profiles=profiles)
+            if local_cache:
+                LOCAL_PROFILE_CACHE.set(
+                    (project_id, user_id), (version, return_profiles)
                 )
-                await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
-    with Session() as session:
+                return Promise.resolve(copy_profiles(return_profiles))
+            return Promise.resolve(return_profiles)
+        except ValidationError as e:
+            TRACE_LOG.error(
+                project_id,
+                user_id,
+                f"Invalid user profiles: {e}",
+            )
+            await refresh_user_profile_cache(user_id, project_id)
+            load_cache = False
+    async with AsyncSession() as session:
         user_profiles = (
-            session.query(UserProfile)
-            .filter_by(user_id=user_id, project_id=project_id)
-            .order_by(UserProfile.updated_at.desc())
+            (
+                await session.execute(
+                    select(UserProfile)
+                    .filter_by(user_id=user_id, project_id=project_id)
+                    .order_by(UserProfile.updated_at.desc())
+                )
+            )
+            .scalars()
             .all()
         )
-        results = []
-        for up in user_profiles:
-            results.append(
-                {
-                    "id": up.id,
-                    "content": up.content,
-                    "attributes": up.attributes,
-                    "created_at": up.created_at,
-                    "updated_at": up.updated_at,
-                }
+        profiles = [profile_orm_to_data(up) for up in user_profiles]
+    return_profiles = UserProfilesData(profiles=profiles)
+    if load_cache:
+        fields = []
+        for p in profiles:
+            fields.extend([str(p.id), profile_to_cache_json(p)])
+        async with get_redis_client() as redis_client:
+            await redis_client.eval(
+                REDIS_LUA_LOAD_PROFILE_CACHE,
+                2,
+                cache_key,
+                version_key,
+                version or "0",
+                CONFIG.cache_user_profiles_ttl,
+                *fields,
             )
-    return_profiles = UserProfilesData(profiles=results)
-    async with get_redis_client() as redis_client:
-        await redis_client.set(
-            f"user_profiles::{project_id}::{user_id}",
-            return_profiles.model_dump_json(),
-            ex=CONFIG.cache_user_profiles_ttl,
-        )
+    if local_cache:
+        LOCAL_PROFILE_CACHE.set((project_id, user_id), (version, return_profiles))
+        return Promise.resolve(copy_profiles(return_profiles))
     return Promise.resolve(return_profiles)
 
 
@@ -133,17 +296,22 @@ async def add_user_profiles(
             return Promise.reject(
                 CODE.SERVER_PARSE_ERROR, f"Invalid profile attributes: {e}"
             )
-    with Session() as session:
+    async with AsyncSession() as session:
         db_profiles = [
             UserProfile(
-                user_id=user_id, project_id=project_id, content=content, attributes=attr
+                user_id=user_id,
+                project_id=project_id,
+                content=content,
+                attributes=attr,
+                token_size=get_profile_token_size(content, attr),
             )
             for content, attr in zip(profiles, attributes)
         ]
         session.add_all(db_profiles)
-        session.commit()
+        await session.commit()
         profile_ids = [profile.id for profile in db_profiles]
-    await refresh_user_profile_cache(user_id, project_id)
+    await write_through_user_profile_cache(user_id, project_id, upserts=db_profiles)
+    await embed_user_profiles(user_id, project_id, db_profiles)
     return Promise.resolve(IdsData(ids=profile_ids))
 
 
@@ -160,14 +328,17 @@ async def update_user_profiles(
     assert len(profile_ids) == len(
         attributes
     ), "Length of profile_ids, attributes must be equal"
-    with Session() as session:
+    async with AsyncSession() as session:
         db_profiles = []
+        updated_db_profiles = []
         for profile_id, content, attribute in zip(profile_ids, contents, attributes):
             db_profile = (
-                session.query(UserProfile)
-                .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-                .one_or_none()
-            )
+                await session.execute(
+                    select(UserProfile).filter_by(
+                        id=profile_id, user_id=user_id, project_id=project_id
+                    )
+                )
+            ).scalar_one_or_none()
             if db_profile is None:
                 TRACE_LOG.error(
                     project_id,
@@ -178,48 +349,94 @@ async def update_user_profiles(
             db_profile.content = content
             if attribute is not None:
                 db_profile.attributes = attribute
+            db_profile.token_size = get_profile_token_size(
+                db_profile.content, db_profile.attributes
+            )
             db_profiles.append(profile_id)
-        session.commit()
-    await refresh_user_profile_cache(user_id, project_id)
+            updated_db_profiles.append(db_profile)
+        await session.commit()
+    await write_through_user_profile_cache(
+        user_id, project_id, upserts=updated_db_profiles
+    )
+    await embed_user_profiles(user_id, project_id, updated_db_profiles)
     return Promise.resolve(IdsData(ids=db_profiles))
 
 
 async def delete_user_profile(
     user_id: str, project_id: str, profile_id: str
 ) -> Promise[None]:
-    with Session() as session:
-        db_profile = (
-            session.query(UserProfile)
-            .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        result = await session.execute(
+            delete(UserProfile).filter_by(
+                id=profile_id, user_id=user_id, project_id=project_id
+            )
         )
-        if db_profile is None:
+        if not result.rowcount:
             return Promise.reject(
                 CODE.NOT_FOUND, f"Profile {profile_id} not found for user {user_id}"
             )
-        session.delete(db_profile)
-        session.commit()
-    await refresh_user_profile_cache(user_id, project_id)
+        await session.commit()
+    await write_through_user_profile_cache(
+        user_id, project_id, deleted_ids=[profile_id]
+    )
     return Promise.resolve(None)
 
 
 async def delete_user_profiles(
     user_id: str, project_id: str, profile_ids: list[str]
 ) -> Promise[IdsData]:
-    with Session() as session:
-        session.query(UserProfile).filter(
-            UserProfile.id.in_(profile_ids),
-            UserProfile.user_id == user_id,
-            UserProfile.project_id == project_id,
-        ).delete(synchronize_session=False)
-        session.commit()
-    await refresh_user_profile_cache(user_id, project_id)
+    async with AsyncSession() as session:
+        await session.execute(
+            delete(UserProfile).where(
+                UserProfile.id.in_(profile_ids),
+                UserProfile.user_id == user_id,
+                UserProfile.project_id == project_id,
+            )
+        )
+        await session.commit()
+    await write_through_user_profile_cache(
+        user_id, project_id, deleted_ids=profile_ids
+    )
     return Promise.resolve(IdsData(ids=profile_ids))
 
 
 async def refresh_user_profile_cache(user_id: str, project_id: str) -> Promise[None]:
+    """Drop the cached profiles, the next read loads them from the DB"""
+    LOCAL_PROFILE_CACHE.delete((project_id, user_id))
     async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(user_profiles_cache_key(user_id, project_id))
+        pipe.incr(user_profiles_version_key(user_id, project_id))
+        pipe.expire(
+            user_profiles_version_key(user_id, project_id),
+            CONFIG.cache_user_profiles_ttl * 2,
+        )
+        await pipe.execute()
+    return Promise.resolve(None)
+
+
+async def write_through_user_profile_cache(
+    user_id: str,
+    project_id: str,
+    upserts: list[UserProfile] = (),
+    deleted_ids: list[str] = (),
+) -> Promise[None]:
+    """Apply committed profile changes to the cached hash, if it's loaded"""
+    LOCAL_PROFILE_CACHE.delete((project_id, user_id))
+    fields = []
+    for up in upserts:
+        fields.extend([str(up.id), profile_to_cache_json(profile_orm_to_data(up))])
+    async with get_redis_client() as redis_client:
+        await redis_client.eval(
+            REDIS_LUA_WRITE_THROUGH_PROFILE_CACHE,
+            2,
+            user_profiles_cache_key(user_id, project_id),
+            user_profiles_version_key(user_id, project_id),
+            CONFIG.cache_user_profiles_ttl,
+            len(deleted_ids),
+            *[str(i) for i in deleted_ids],
+            *fields,
+        )
     return Promise.resolve(None)
 
 
@@ -254,7 +471,7 @@ async def add_update_delete_user_profiles(
             )
     # Sanity Check done
 
-    with Session() as session:
+    async with AsyncSession() as session:
         try:
             # 1. add new profiles
             if len(add_profiles):
@@ -264,12 +481,14 @@ async def add_update_delete_user_profiles(
                         project_id=project_id,
                         content=content,
                         attributes=attr,
+                        token_size=get_profile_token_size(content, attr),
                     )
                     for content, attr in zip(add_profiles, add_attributes)
                 ]
                 session.add_all(add_db_profiles)
                 add_profile_ids = [p.id for p in add_db_profiles]
             else:
+                add_db_profiles = []
                 add_profile_ids = []
             # 2. update existing profiles
             update_db_profiles = []
@@ -277,10 +496,12 @@ async def add_update_delete_user_profiles(
                 update_profile_ids, update_contents, update_attributes
             ):
                 db_profile = (
-                    session.query(UserProfile)
-                    .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-                    .one_or_none()
-                )
+                    await session.execute(
+                        select(UserProfile).filter_by(
+                            id=profile_id, user_id=user_id, project_id=project_id
+                        )
+                    )
+                ).scalar_one_or_none()
                 if db_profile is None:
                     TRACE_LOG.error(
                         project_id,
@@ -291,26 +512,39 @@ async def add_update_delete_user_profiles(
                 db_profile.content = content
                 if attribute is not None:
                     db_profile.attributes = attribute
-                update_db_profiles.append(profile_id)
+                db_profile.token_size = get_profile_token_size(
+                    db_profile.content, db_profile.attributes
+                )
+                update_db_profiles.append(db_profile)
 
             # 3. delete profiles
-            session.query(UserProfile).filter(
-                UserProfile.id.in_(delete_profile_ids),
-                UserProfile.user_id == user_id,
-                UserProfile.project_id == project_id,
-            ).delete(synchronize_session=False)
+            await session.execute(
+                delete(UserProfile).where(
+                    UserProfile.id.in_(delete_profile_ids),
+                    UserProfile.user_id == user_id,
+                    UserProfile.project_id == project_id,
+                )
+            )
 
-            session.commit()
+            await session.commit()
         except Exception as e:
             TRACE_LOG.error(
                 project_id,
                 user_id,
                 f"Error merging user profiles: {e}",
             )
-            session.rollback()
+            await session.rollback()
             return Promise.reject(
                 CODE.SERVER_PARSE_ERROR, f"Error merging user profiles: {e}"
             )
 
-    await refresh_user_profile_cache(user_id, project_id)
+    await write_through_user_profile_cache(
+        user_id,
+        project_id,
+        upserts=add_db_profiles + update_db_profiles,
+        deleted_ids=delete_profile_ids,
+    )
+    await embed_user_profiles(
+        user_id, project_id, add_db_profiles + update_db_profiles
+    )
     return Promise.resolve(IdsData(ids=add_profile_ids))
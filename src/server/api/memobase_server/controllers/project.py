@@ -1,76 +1,113 @@
-from sqlalchemy import cast, String, func, desc
+from sqlalchemy import select, update, cast, String, func, desc
 from ..models.database import Project, User, UserProfile, UserEvent
 from ..models.utils import Promise, CODE
 from ..models.response import IdData, ProfileConfigData, ProjectUsersData, DailyUsage
-from ..connectors import Session
-from ..env import ProfileConfig, TelemetryKeyName
+from ..connectors import AsyncSession, get_redis_client
+from ..local_cache import LocalTTLCache
+from ..env import CONFIG, ProfileConfig, TelemetryKeyName
 from ..telemetry.capture_key import get_int_key, date_past_key
 
+# project_id -> (config version, ProfileConfig, artifacts). The parsed config is
+# shared by every request of this process, don't modify it. `artifacts` holds
+# what the chat pipeline derives from it, see get_profile_config_artifacts.
+LOCAL_PROFILE_CONFIG_CACHE = LocalTTLCache(
+    CONFIG.cache_profile_config_local_max_size, CONFIG.cache_profile_config_local_ttl
+)
+
+
+def profile_config_version_key(project_id: str) -> str:
+    return f"project_profile_config_version::{project_id}"
+
 
 async def get_project_secret(project_id: str) -> Promise[str]:
-    with Session() as session:
+    async with AsyncSession() as session:
         p = (
-            session.query(Project)
-            .filter(Project.project_id == project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(Project).where(Project.project_id == project_id)
+            )
+        ).scalar_one_or_none()
         if not p:
             return Promise.reject(CODE.NOT_FOUND, "Project not found")
         return Promise.resolve(p.project_secret)
 
 
 async def get_project_status(project_id: str) -> Promise[str]:
-    with Session() as session:
+    async with AsyncSession() as session:
         p = (
-            session.query(Project.status)
-            .filter(Project.project_id == project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(Project.status).where(Project.project_id == project_id)
+            )
+        ).one_or_none()
         if not p:
             return Promise.reject(CODE.NOT_FOUND, "Project not found")
         return Promise.resolve(p.status)
 
 
 async def get_project_profile_config(project_id: str) -> Promise[ProfileConfig]:
-    with Session() as session:
+    use_cache = CONFIG.cache_profile_config_local_ttl > 0
+    if use_cache:
+        # Read the version before the DB, an update in between makes it stale
+        async with get_redis_client() as redis_client:
+            version = await redis_client.get(profile_config_version_key(project_id))
+        local = LOCAL_PROFILE_CONFIG_CACHE.get(project_id)
+        if local is not None and local[0] == version:
+            return Promise.resolve(local[1])
+    async with AsyncSession() as session:
         p = (
-            session.query(Project.profile_config)
-            .filter(Project.project_id == project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(Project.profile_config).where(Project.project_id == project_id)
+            )
+        ).one_or_none()
         if not p:
             return Promise.reject(CODE.NOT_FOUND, "Project not found")
         if not p.profile_config:
-            return Promise.resolve(ProfileConfig())
-        p_parse = ProfileConfig.load_config_string(p.profile_config)
+            p_parse = ProfileConfig()
+        else:
+            p_parse = ProfileConfig.load_config_string(p.profile_config)
+    if use_cache:
+        LOCAL_PROFILE_CONFIG_CACHE.set(project_id, (version, p_parse, {}))
     return Promise.resolve(p_parse)
 
 
+def get_cached_profile_config_artifacts(
+    project_id: str, config: ProfileConfig
+) -> dict | None:
+    """The artifacts dict cached next to `config`, None if `config` isn't the
+    cached one of the project"""
+    local = LOCAL_PROFILE_CONFIG_CACHE.get(project_id)
+    if local is None or local[1] is not config:
+        return None
+    return local[2]
+
+
 async def update_project_profile_config(
     project_id: str, profile_config: str | None
 ) -> Promise[None]:
-    with Session() as session:
-        p = (
-            session.query(Project)
-            .filter(Project.project_id == project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        result = await session.execute(
+            update(Project)
+            .where(Project.project_id == project_id)
+            .values(profile_config=profile_config)
         )
-        if not p:
+        if not result.rowcount:
             return Promise.reject(CODE.NOT_FOUND, "Project not found")
-        p.profile_config = profile_config
-        session.commit()
+        await session.commit()
+    # Other processes see the new version and reload
+    async with get_redis_client() as redis_client:
+        await redis_client.incr(profile_config_version_key(project_id))
+    LOCAL_PROFILE_CONFIG_CACHE.delete(project_id)
     return Promise.resolve(None)
 
 
 async def get_project_profile_config_string(
     project_id: str,
 ) -> Promise[ProfileConfigData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         p = (
-            session.query(Project.profile_config)
-            .filter(Project.project_id == project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(Project.profile_config).where(Project.project_id == project_id)
+            )
+        ).one_or_none()
         if not p:
             return Promise.reject(CODE.NOT_FOUND, "Project not found")
         return Promise.resolve(ProfileConfigData(profile_config=p.profile_config or ""))
@@ -84,29 +121,29 @@ async def get_project_users(
     order_by: str = "updated_at",
     order_desc: bool = True,
 ) -> Promise[ProjectUsersData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         profile_subq = (
-            session.query(
+            select(
                 UserProfile.user_id.label("user_id"),
                 func.count(UserProfile.id).label("profile_count"),
             )
-            .filter(UserProfile.project_id == project_id)
+            .where(UserProfile.project_id == project_id)
             .group_by(UserProfile.user_id)
             .subquery()
         )
 
         event_subq = (
-            session.query(
+            select(
                 UserEvent.user_id.label("user_id"),
                 func.count(UserEvent.id).label("event_count"),
             )
-            .filter(UserEvent.project_id == project_id)
+            .where(UserEvent.project_id == project_id)
             .group_by(UserEvent.user_id)
             .subquery()
         )
 
         query = (
-            session.query(
+            select(
                 User,
                 func.coalesce(profile_subq.c.profile_count, 0).label("profile_count"),
                 func.coalesce(event_subq.c.event_count, 0).label("event_count"),
@@ -129,13 +166,17 @@ async def get_project_users(
             )
 
         count = (
-            session.query(func.count())
-            .filter(User.project_id == project_id)
-            .filter(cast(User.id, String).like(f"%{search}%"))
-            .scalar()
-        )
+            await session.execute(
+                select(func.count())
+                .select_from(User)
+                .filter(User.project_id == project_id)
+                .filter(cast(User.id, String).like(f"%{search}%"))
+            )
+        ).scalar()
 
-        users_with_counts = query.limit(limit).offset(offset).all()
+        users_with_counts = (
+            await session.execute(query.limit(limit).offset(offset))
+        ).all()
 
         user_dicts = []
         for user, profile_count, event_count in users_with_counts:
@@ -1,28 +1,29 @@
+from sqlalchemy import select, delete
 from ..models.utils import Promise
 from ..models.database import User, GeneralBlob, UserProfile
 from ..models.response import CODE, UserData, IdData, IdsData, UserProfilesData
-from ..connectors import Session
+from ..connectors import AsyncSession
 from .profile import refresh_user_profile_cache
 from ..models.blob import BlobType
 
 
 async def create_user(data: UserData, project_id: str) -> Promise[IdData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         db_user = User(additional_fields=data.data, project_id=project_id)
         if data.id is not None:
             db_user.id = str(data.id)
         session.add(db_user)
-        session.commit()
+        await session.commit()
         return Promise.resolve(IdData(id=db_user.id))
 
 
 async def get_user(user_id: str, project_id: str) -> Promise[UserData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         db_user = (
-            session.query(User)
-            .filter_by(id=user_id, project_id=project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(User).filter_by(id=user_id, project_id=project_id)
+            )
+        ).scalar_one_or_none()
         if db_user is None:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
         return Promise.resolve(
@@ -35,30 +36,28 @@ async def get_user(user_id: str, project_id: str) -> Promise[UserData]:
 
 
 async def update_user(user_id: str, project_id: str, data: dict) -> Promise[IdData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         db_user = (
-            session.query(User)
-            .filter_by(id=user_id, project_id=project_id)
-            .one_or_none()
-        )
+            await session.execute(
+                select(User).filter_by(id=user_id, project_id=project_id)
+            )
+        ).scalar_one_or_none()
         if db_user is None:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
         db_user.additional_fields = data
-        session.commit()
+        await session.commit()
         return Promise.resolve(IdData(id=db_user.id))
 
 
 async def delete_user(user_id: str, project_id: str) -> Promise[None]:
-    with Session() as session:
-        db_user = (
-            session.query(User)
-            .filter_by(id=user_id, project_id=project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        # Bulk delete, related rows are removed by the ON DELETE CASCADE FKs
+        result = await session.execute(
+            delete(User).filter_by(id=user_id, project_id=project_id)
         )
-        if db_user is None:
+        if not result.rowcount:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
-        session.delete(db_user)
-        session.commit()
+        await session.commit()
     await refresh_user_profile_cache(user_id, project_id)
     return Promise.resolve(None)
 
@@ -70,15 +69,18 @@ async def get_user_all_blobs(
     page: int = 0,
     page_size: int = 10,
 ) -> Promise[IdsData]:
-    with Session() as session:
+    async with AsyncSession() as session:
         user_blobs = (
-            session.query(GeneralBlob.id)
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .order_by(GeneralBlob.created_at)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
-        )
+            await session.execute(
+                select(GeneralBlob.id)
+                .filter_by(
+                    user_id=user_id, blob_type=str(blob_type), project_id=project_id
+                )
+                .order_by(GeneralBlob.created_at)
+                .offset(page * page_size)
+                .limit(page_size)
+            )
+        ).all()
         if user_blobs is None:
             return Promise.reject(CODE.NOT_FOUND, f"User {user_id} not found")
         return Promise.resolve(IdsData(ids=[blob.id for blob in user_blobs]))
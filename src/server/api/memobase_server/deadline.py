@@ -0,0 +1,92 @@
+"""
+Time budget of a request, shared by everything it awaits.
+
+`deadline_scope(timeout_ms)` sets the deadline for the current task and the tasks
+it starts. LLM and embedding calls give up once it passes, DB transactions get a
+matching `statement_timeout`. Callers with a cheaper fallback catch what
+`is_deadline_error()` accepts, check `deadline_exceeded()` and run the fallback
+in `without_deadline()`. Reads the response can't do without should run in
+`without_deadline()` from the start.
+"""
+
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar, Context, copy_context
+from typing import Awaitable, Optional, TypeVar
+from sqlalchemy.exc import DBAPIError
+
+T = TypeVar("T")
+
+# SQLSTATE of a statement canceled by statement_timeout
+QUERY_CANCELED_SQLSTATE = "57014"
+
+# time.monotonic() at which the current request runs out of budget
+CURRENT_DEADLINE: ContextVar[Optional[float]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+def next_deadline(timeout_ms: Optional[int]) -> Optional[float]:
+    current = CURRENT_DEADLINE.get()
+    if timeout_ms is None:
+        return current
+    deadline = time.monotonic() + timeout_ms / 1000
+    # A nested budget can only shorten the outer one
+    return deadline if current is None else min(current, deadline)
+
+
+@contextmanager
+def deadline_scope(timeout_ms: Optional[int]):
+    token = CURRENT_DEADLINE.set(next_deadline(timeout_ms))
+    try:
+        yield
+    finally:
+        CURRENT_DEADLINE.reset(token)
+
+
+@contextmanager
+def without_deadline():
+    token = CURRENT_DEADLINE.set(None)
+    try:
+        yield
+    finally:
+        CURRENT_DEADLINE.reset(token)
+
+
+def deadline_context(timeout_ms: Optional[int]) -> Context:
+    """A copy of the current context with the deadline set, for `create_task(context=...)`
+
+    Async generators can't hold a `deadline_scope` across yields, their consumer
+    would run inside it.
+    """
+    context = copy_context()
+    context.run(CURRENT_DEADLINE.set, next_deadline(timeout_ms))
+    return context
+
+
+def remaining_seconds() -> Optional[float]:
+    deadline = CURRENT_DEADLINE.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+def deadline_exceeded() -> bool:
+    return remaining_seconds() == 0
+
+
+def is_deadline_error(e: BaseException) -> bool:
+    """Whether `e` is the deadline cutting a call off: `within_deadline`'s timeout,
+    or a DB statement canceled by the deadline's `statement_timeout`"""
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    if not isinstance(e, DBAPIError) or CURRENT_DEADLINE.get() is None:
+        return False
+    sqlstate = getattr(e.orig, "sqlstate", None) or getattr(e.orig, "pgcode", None)
+    return sqlstate == QUERY_CANCELED_SQLSTATE or "statement timeout" in str(e)
+
+
+async def within_deadline(aw: Awaitable[T]) -> T:
+    """Await `aw`, raising `asyncio.TimeoutError` once the current deadline passes"""
+    return await asyncio.wait_for(aw, remaining_seconds())
@@ -89,25 +89,83 @@ class Config:
     max_pre_profile_token_size: int = 128
     llm_tab_separator: str = "::"
     cache_user_profiles_ttl: int = 60 * 20  # 20 minutes
+    # Per-process cache of parsed profiles for the read APIs, 0 disables it.
+    # Entries are checked against the user's profile version in redis
+    cache_user_profiles_local_ttl: int = 10
+    cache_user_profiles_local_max_size: int = 2000
+    # Per-process cache of parsed project profile configs, 0 disables it.
+    # Entries are checked against the project's config version in redis
+    cache_profile_config_local_ttl: int = 60
+    cache_profile_config_local_max_size: int = 1000
+    # Hand buffer flushes to `python -m memobase_server.worker` over Redis Streams
+    use_flush_worker: bool = False
+    flush_worker_concurrency: int = 8
+    flush_worker_visibility_timeout: int = 60 * 10  # 10 minutes
+    flush_worker_max_retries: int = 3
+    flush_worker_max_busy_requeues: int = 20
+    flush_worker_prefetch: int = 32
+    flush_worker_sweep_interval: int = 0
+    flush_worker_dead_letter_maxlen: int = 10000
+    # Seconds between batched writes of the redis billing deltas to the billings table
+    billing_reconcile_interval: float = 10.0
+    # In-process cache of project secrets/status, evicted early over redis pub/sub
+    auth_cache_ttl: int = 60
+    auth_cache_max_size: int = 10000
 
     # LLM
     language: Literal["en", "zh"] = "en"
-    llm_style: Literal["openai", "doubao_cache"] = "openai"
+    llm_style: Literal["openai", "doubao_cache", "fake"] = "openai"
     llm_base_url: str = None
     llm_api_key: str = None
     llm_openai_default_query: dict[str, str] = None
     llm_openai_default_header: dict[str, str] = None
+    # Send `prompt_cache_key` for prompts with a precomputed hash, OpenAI only
+    llm_openai_prompt_cache_key: bool = False
     best_llm_model: str = "gpt-4o-mini"
     thinking_llm_model: str = "o4-mini"
     summary_llm_model: str = None
+    # LLM limiter, None means no limit. RPM/TPM budgets are shared through redis
+    llm_max_concurrency: Optional[int] = None
+    llm_rpm_limit: Optional[int] = None
+    llm_tpm_limit: Optional[int] = None
+    llm_model_rate_limits: dict[str, dict[str, int]] = field(default_factory=dict)
+    llm_background_budget_ratio: float = 0.8
+    llm_limiter_max_wait: int = 120
 
     enable_event_embedding: bool = True
-    embedding_provider: Literal["openai", "jina", "ollama"] = "openai"
+    embedding_provider: Literal["openai", "jina", "ollama", "fake"] = "openai"
     embedding_api_key: str = None
     embedding_base_url: str = None
     embedding_dim: int = 1536
     embedding_model: str = "text-embedding-3-small"
     embedding_max_token_size: int = 8192
+    # Embedding cache: in-process LRU bounded by bytes, then redis
+    embedding_cache_enabled: bool = True
+    embedding_cache_local_max_bytes: int = 64 * 1024 * 1024  # 64MB
+    embedding_cache_ttl: int = 60 * 60 * 24 * 7  # 7 days
+    embedding_cache_dtype: Literal["float32", "float16"] = "float32"
+    # Micro-batch concurrent embedding calls, 0 disables it
+    embedding_batch_wait_ms: int = 5
+    embedding_batch_max_size: int = 128
+    embedding_batch_max_tokens: int = 32768
+    # ANN index on event/gist embeddings, pgvector only indexes dim <= 2000.
+    # Opt-in: searches filter by user after the index scan, so without
+    # embedding_index_iterative_scan they can return fewer rows than asked
+    embedding_index_type: Literal["hnsw", "ivfflat", "none"] = "none"
+    embedding_hnsw_m: int = 16
+    embedding_hnsw_ef_construction: int = 64
+    embedding_hnsw_ef_search: int = 100
+    embedding_ivfflat_lists: int = 100
+    embedding_ivfflat_probes: int = 10
+    # requires pgvector>=0.8, keeps filtered searches from returning too few rows
+    embedding_index_iterative_scan: bool = False
+    # Offline providers for load tests, llm_style/embedding_provider "fake"
+    fake_llm_latency_ms: float = 800
+    fake_embedding_latency_ms: float = 50
+    fake_latency_distribution: Literal["fixed", "exponential", "lognormal"] = (
+        "lognormal"
+    )
+    fake_latency_sigma: float = 0.5
 
     additional_user_profiles: list[dict] = field(default_factory=list)
     overwrite_user_profiles: Optional[list[dict]] = None
@@ -116,11 +174,22 @@ class Config:
     )
     profile_strict_mode: bool = False
     profile_validate_mode: bool = True
+    # "batch" merges up to profile_merge_batch_size facts per LLM call,
+    # "per_fact" makes one call per fact
+    profile_merge_strategy: Literal["batch", "per_fact"] = "batch"
+    profile_merge_batch_size: int = 16
+    profile_merge_batch_max_tokens: int = 4096
+    # Embed profiles when written, so reads can rank them against the chats
+    enable_profile_embedding: bool = False
+    # How profiles are picked for the chats passed to context/profile reads
+    profile_filter_method: Literal["llm", "embedding"] = "llm"
 
     minimum_chats_token_size_for_event_summary: int = 256
     event_tags: list[dict] = field(default_factory=list)
     # Telemetry
     telemetry_deployment_environment: str = "local"
+    # Seconds between batched writes of the usage counters to redis
+    telemetry_flush_interval: float = 2.0
 
     @classmethod
     def _process_env_vars(cls, config_dict):
@@ -191,8 +260,10 @@ class Config:
         return overwrite_config
 
     def __post_init__(self):
-        assert self.llm_api_key is not None, "llm_api_key is required"
-        if self.enable_event_embedding:
+        assert (
+            self.llm_api_key is not None or self.llm_style == "fake"
+        ), "llm_api_key is required"
+        if self.enable_event_embedding and self.embedding_provider != "fake":
             if self.embedding_api_key is None and (
                 self.llm_style == self.embedding_provider == "openai"
             ):
@@ -211,6 +282,15 @@ class Config:
                     "jina-embeddings-v3",
                 }, "embedding_model must be one of the following: jina-embeddings-v3"
 
+        assert self.profile_merge_strategy in {
+            "batch",
+            "per_fact",
+        }, "profile_merge_strategy must be one of the following: batch, per_fact"
+        assert self.profile_filter_method in {
+            "llm",
+            "embedding",
+        }, "profile_filter_method must be one of the following: llm, embedding"
+
         if self.additional_user_profiles:
             [UserProfileTopic(**up) for up in self.additional_user_profiles]
         if self.overwrite_user_profiles:
@@ -230,6 +310,9 @@ class ProfileConfig:
     language: Literal["en", "zh"] = None
     profile_strict_mode: bool | None = None
     profile_validate_mode: bool | None = None
+    profile_merge_strategy: Literal["batch", "per_fact"] | None = None
+    profile_merge_batch_size: int | None = None
+    profile_filter_method: Literal["llm", "embedding"] | None = None
     additional_user_profiles: list[dict] = field(default_factory=list)
     overwrite_user_profiles: Optional[list[dict]] = None
     event_theme_requirement: Optional[str] = None
@@ -239,6 +322,10 @@ class ProfileConfig:
     def __post_init__(self):
         if self.language not in ["en", "zh"]:
             self.language = None
+        if self.profile_merge_strategy not in ["batch", "per_fact"]:
+            self.profile_merge_strategy = None
+        if self.profile_filter_method not in ["llm", "embedding"]:
+            self.profile_filter_method = None
         if self.additional_user_profiles:
             [UserProfileTopic(**up) for up in self.additional_user_profiles]
         if self.overwrite_user_profiles:
@@ -7,16 +7,36 @@ from ..controllers.billing import project_cost_token_billing
 from ..models.utils import Promise
 from ..models.response import CODE
 from ..models.database import DEFAULT_PROJECT_ID
+from ..deadline import within_deadline
 from ..telemetry import telemetry_manager, CounterMetricName, HistogramMetricName
 
+from .limiter import LLM_LIMITER, LLMPriority, LLMRateLimitTimeout, estimate_tokens
 from .openai_model_llm import openai_complete
 from .doubao_cache_llm import doubao_cache_complete
+from .fake_llm import fake_complete
 
-FACTORIES = {"openai": openai_complete, "doubao_cache": doubao_cache_complete}
+
+def count_tokens_locally(
+    prompt: str, system_prompt: str | None, history_messages: list[dict], output: str
+) -> tuple[int, int]:
+    in_tokens = len(
+        get_encoded_tokens(
+            prompt
+            + (system_prompt or "")
+            + "\n".join([m["content"] for m in history_messages])
+        )
+    )
+    return in_tokens, len(get_encoded_tokens(output))
+
+
+FACTORIES = {
+    "openai": openai_complete,
+    "doubao_cache": doubao_cache_complete,
+    "fake": fake_complete,
+}
 assert CONFIG.llm_style in FACTORIES, f"Unsupported LLM style: {CONFIG.llm_style}"
 
 
-# TODO: add TPM/Rate limiter
 async def llm_complete(
     project_id,
     prompt,
@@ -25,37 +45,67 @@ async def llm_complete(
     json_mode=False,
     model=None,
     max_tokens=1024,
+    priority: LLMPriority = "background",
     **kwargs,
 ) -> Promise[str | dict]:
     use_model = model or CONFIG.best_llm_model
     if json_mode:
         kwargs["response_format"] = {"type": "json_object"}
+    try:
+        reservation = await within_deadline(
+            LLM_LIMITER.acquire(
+                use_model,
+                estimate_tokens(
+                    prompt,
+                    system_prompt,
+                    *[m["content"] for m in history_messages],
+                )
+                + max_tokens,
+                priority,
+            )
+        )
+    except asyncio.TimeoutError:
+        return Promise.reject(
+            CODE.GATEWAY_TIMEOUT, "LLM call exceeded the request deadline"
+        )
+    except LLMRateLimitTimeout as e:
+        LOG.error(f"Error in llm_complete: {e}")
+        return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in llm_complete: {e}")
     try:
         start_time = time.time()
-        results = await FACTORIES[CONFIG.llm_style](
-            use_model,
-            prompt,
-            system_prompt=system_prompt,
-            history_messages=history_messages,
-            max_tokens=max_tokens,
-            **kwargs,
+        llm_result = await within_deadline(
+            FACTORIES[CONFIG.llm_style](
+                use_model,
+                prompt,
+                system_prompt=system_prompt,
+                history_messages=history_messages,
+                max_tokens=max_tokens,
+                **kwargs,
+            )
         )
         latency = (time.time() - start_time) * 1000
+    except asyncio.TimeoutError:
+        return Promise.reject(
+            CODE.GATEWAY_TIMEOUT, "LLM call exceeded the request deadline"
+        )
     except Exception as e:
         LOG.error(f"Error in llm_complete: {e}")
         return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in llm_complete: {e}")
+    finally:
+        LLM_LIMITER.release(reservation)
 
-    in_tokens = len(
-        get_encoded_tokens(
-            prompt
-            + (system_prompt or "")
-            + "\n".join([m["content"] for m in history_messages])
+    results = llm_result.text
+    if llm_result.input_tokens is not None and llm_result.output_tokens is not None:
+        in_tokens, out_tokens = llm_result.input_tokens, llm_result.output_tokens
+    else:
+        # Provider didn't report usage, tokenize off the event loop
+        in_tokens, out_tokens = await asyncio.to_thread(
+            count_tokens_locally, prompt, system_prompt, history_messages, results
         )
-    )
-    out_tokens = len(get_encoded_tokens(results))
 
     # await project_cost_token_billing(project_id, in_tokens, out_tokens)
     asyncio.create_task(project_cost_token_billing(project_id, in_tokens, out_tokens))
+    asyncio.create_task(LLM_LIMITER.settle(reservation, in_tokens + out_tokens))
 
     telemetry_manager.increment_counter_metric(
         CounterMetricName.LLM_TOKENS_INPUT,
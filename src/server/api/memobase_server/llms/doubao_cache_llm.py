@@ -1,5 +1,9 @@
-import hashlib
-from .utils import get_doubao_async_client_instance, exclude_special_kwargs
+from .utils import (
+    get_doubao_async_client_instance,
+    exclude_special_kwargs,
+    compute_prompt_hash,
+    LLMResult,
+)
 from ..connectors import get_redis_client
 from ..env import LOG
 
@@ -7,14 +11,10 @@ CONTEXT_EXPIRE_TIME = 60 * 60 * 24
 BEFORE_EXPIRE_TIME = 10
 
 
-def compute_prompt_hash(system_prompt: str) -> str:
-    return hashlib.md5(system_prompt.encode()).hexdigest()
-
-
 async def doubao_cache_create_context_and_save(
-    model, system_prompt, context_name
+    model, system_prompt, context_name, prompt_hash=None
 ) -> str:
-    prompt_hash = compute_prompt_hash(system_prompt)
+    prompt_hash = prompt_hash or compute_prompt_hash(system_prompt)
     redis_key = f"memobase::doubao_context_id::{model}::{prompt_hash}"
     async with get_redis_client() as redis_client:
         context_id = await redis_client.get(redis_key)
@@ -56,7 +56,7 @@ async def doubao_cache_complete(
     history_messages=[],
     thinking_enable=False,
     **kwargs,
-) -> str:
+) -> LLMResult:
     sp_args, kwargs = exclude_special_kwargs(kwargs)
     prompt_id = sp_args.get("prompt_id", None)
     assert prompt_id is not None, "prompt_id is required"
@@ -80,10 +80,10 @@ async def doubao_cache_complete(
             model=model, messages=messages, timeout=120, **kwargs
         )
         LOG.info(f"No Cached {prompt_id} {model} {response.usage.prompt_tokens}")
-        return response.choices[0].message.content
+        return LLMResult.from_response(response)
 
     context_id = await doubao_cache_create_context_and_save(
-        model, system_prompt, prompt_id
+        model, system_prompt, prompt_id, prompt_hash=sp_args["prompt_hash"]
     )
 
     if system_prompt and context_id is None:
@@ -94,12 +94,13 @@ async def doubao_cache_complete(
         response = await doubao_async_client.chat.completions.create(
             model=model, messages=messages, timeout=120, **kwargs
         )
-        return response.choices[0].message.content
+        return LLMResult.from_response(response)
     else:
         response = await doubao_async_client.context.completions.create(
             model=model, messages=messages, context_id=context_id, timeout=120, **kwargs
         )
+        result = LLMResult.from_response(response)
         LOG.info(
-            f"Cached {prompt_id} {model} {response.usage.prompt_tokens_details.cached_tokens}/{response.usage.prompt_tokens}"
+            f"Cached {prompt_id} {model} {result.cached_tokens}/{result.input_tokens}"
         )
-        return response.choices[0].message.content
+        return result
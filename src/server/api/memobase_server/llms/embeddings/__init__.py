@@ -1,4 +1,5 @@
 import time
+import asyncio
 from typing import Literal
 import numpy as np
 from traceback import format_exc
@@ -6,24 +7,42 @@ from ...env import CONFIG, LOG
 from ...models.utils import Promise
 from ...models.response import CODE
 from ...models.database import DEFAULT_PROJECT_ID
+from ...deadline import within_deadline
 from .jina_embedding import jina_embedding
 from .openai_embedding import openai_embedding
 from .lmstudio_embedding import lmstudio_embedding
 from .ollama_embedding import ollama_embedding
+from .fake_embedding import fake_embedding
+from .cache import get_cached_embeddings, set_cached_embeddings
+from .batcher import EmbeddingBatcher
 from ...telemetry import telemetry_manager, HistogramMetricName, CounterMetricName
 from ...utils import get_encoded_tokens
 
-FACTORIES = {"openai": openai_embedding, "jina": jina_embedding, "lmstudio": lmstudio_embedding, "ollama": ollama_embedding}
+FACTORIES = {
+    "openai": openai_embedding,
+    "jina": jina_embedding,
+    "lmstudio": lmstudio_embedding,
+    "ollama": ollama_embedding,
+    "fake": fake_embedding,
+}
 assert (
     CONFIG.embedding_provider in FACTORIES
 ), f"Unsupported embedding provider: {CONFIG.embedding_provider}"
 
+# Looks the provider up on every batch, so FACTORIES can still be patched
+EMBEDDING_BATCHER = EmbeddingBatcher(
+    lambda model, texts, phase: FACTORIES[CONFIG.embedding_provider](
+        model, texts, phase
+    )
+)
+
 
 async def check_embedding_sanity():
     if not CONFIG.enable_event_embedding:
         LOG.info("Event embedding is disabled, skipping sanity check.")
         return
-    r = await get_embedding(DEFAULT_PROJECT_ID, ["Hello, world!"])
+    # Skip the cache, a cached vector says nothing about the API key
+    r = await get_embedding(DEFAULT_PROJECT_ID, ["Hello, world!"], use_cache=False)
     if not r.ok():
         raise ValueError(
             "Embedding API check failed! Make sure the embedding API key is valid."
@@ -42,24 +61,47 @@ async def get_embedding(
     texts: list[str],
     phase: Literal["query", "document"] = "document",
     model: str = None,
+    use_cache: bool = True,
 ) -> Promise[np.ndarray]:
     model = model or CONFIG.embedding_model
-    try:
-        start_time = time.time()
-        results = await FACTORIES[CONFIG.embedding_provider](model, texts, phase)
-        latency_ms = (time.time() - start_time) * 1000
-    except Exception as e:
-        LOG.error(f"Error in get_embedding: {e} {format_exc()}")
-        return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in get_embedding: {e}")
-    embedding_tokens = len(get_encoded_tokens("\n".join(texts)))
-    telemetry_manager.increment_counter_metric(
-        CounterMetricName.EMBEDDING_TOKENS,
-        embedding_tokens,
-        {"project_id": project_id},
-    )
-    telemetry_manager.record_histogram_metric(
-        HistogramMetricName.EMBEDDING_LATENCY_MS,
-        latency_ms,
-        {"project_id": project_id},
-    )
-    return Promise.resolve(results)
+    use_cache = use_cache and CONFIG.embedding_cache_enabled
+    if use_cache:
+        results = await get_cached_embeddings(project_id, model, phase, texts)
+    else:
+        results = [None] * len(texts)
+    # Duplicated texts are only sent once
+    missing_texts = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+    if missing_texts:
+        try:
+            start_time = time.time()
+            embedded = await within_deadline(
+                EMBEDDING_BATCHER.embed(model, missing_texts, phase)
+            )
+            latency_ms = (time.time() - start_time) * 1000
+        except asyncio.TimeoutError:
+            return Promise.reject(
+                CODE.GATEWAY_TIMEOUT, "Embedding call exceeded the request deadline"
+            )
+        except Exception as e:
+            LOG.error(f"Error in get_embedding: {e} {format_exc()}")
+            return Promise.reject(
+                CODE.SERVICE_UNAVAILABLE, f"Error in get_embedding: {e}"
+            )
+        embedding_tokens = len(get_encoded_tokens("\n".join(missing_texts)))
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.EMBEDDING_TOKENS,
+            embedding_tokens,
+            {"project_id": project_id},
+        )
+        telemetry_manager.record_histogram_metric(
+            HistogramMetricName.EMBEDDING_LATENCY_MS,
+            latency_ms,
+            {"project_id": project_id},
+        )
+        if use_cache:
+            await set_cached_embeddings(model, phase, missing_texts, embedded)
+        by_text = dict(zip(missing_texts, embedded))
+        results = [by_text[t] if r is None else r for t, r in zip(texts, results)]
+    if not results:
+        return Promise.resolve(np.zeros((0, CONFIG.embedding_dim), dtype=np.float32))
+    return Promise.resolve(np.stack(results).astype(np.float32))
@@ -0,0 +1,126 @@
+"""
+Micro-batching in front of the embedding providers.
+
+Texts from concurrent callers with the same model and phase are collected for
+`embedding_batch_wait_ms`, or until `embedding_batch_max_size` texts /
+`embedding_batch_max_tokens` estimated tokens, then sent in one provider call.
+One caller's texts always stay in the same batch.
+"""
+
+import asyncio
+import numpy as np
+from typing import Awaitable, Callable, Literal
+from dataclasses import dataclass, field
+from ...env import CONFIG, LOG
+from ..limiter import estimate_tokens
+
+EmbeddingProvider = Callable[
+    [str, list[str], Literal["query", "document"]], Awaitable[np.ndarray]
+]
+
+
+@dataclass
+class PendingBatch:
+    texts: list[str] = field(default_factory=list)
+    # (offset, size, future) of each caller
+    callers: list[tuple[int, int, asyncio.Future]] = field(default_factory=list)
+    tokens: int = 0
+    timer: asyncio.TimerHandle = None
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        wait_ms: int = CONFIG.embedding_batch_wait_ms,
+        max_size: int = CONFIG.embedding_batch_max_size,
+        max_tokens: int = CONFIG.embedding_batch_max_tokens,
+    ):
+        self.provider = provider
+        self.wait_ms = wait_ms
+        self.max_size = max_size
+        self.max_tokens = max_tokens
+        self.pending: dict[tuple[str, str], PendingBatch] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def embed(
+        self, model: str, texts: list[str], phase: Literal["query", "document"]
+    ) -> np.ndarray:
+        if self.wait_ms <= 0:
+            return await self.provider(model, texts, phase)
+
+        key = (model, phase)
+        tokens = estimate_tokens(*texts)
+        batch = self.pending.get(key)
+        if batch is not None and (
+            len(batch.texts) + len(texts) > self.max_size
+            or batch.tokens + tokens > self.max_tokens
+        ):
+            self.send(key)
+            batch = None
+        if batch is None:
+            batch = self.pending[key] = PendingBatch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.wait_ms / 1000, self.send, key
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        batch.callers.append((len(batch.texts), len(texts), future))
+        batch.texts.extend(texts)
+        batch.tokens += tokens
+        if len(batch.texts) >= self.max_size or batch.tokens >= self.max_tokens:
+            self.send(key)
+        return await future
+
+    def send(self, key: tuple[str, str]):
+        batch = self.pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self.run_batch(key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, key: tuple[str, str], batch: PendingBatch):
+        model, phase = key
+        try:
+            results = await self.provider(model, batch.texts, phase)
+        except Exception as e:
+            if len(batch.callers) == 1:
+                self.resolve(batch.callers[0][2], exception=e)
+                return
+            # Don't let one caller's bad input fail the others
+            LOG.warning(
+                f"Batched embedding of {len(batch.callers)} callers failed, "
+                f"retrying them one by one: {e}"
+            )
+            await asyncio.gather(
+                *[
+                    self.run_single(model, phase, batch.texts[o : o + n], future)
+                    for o, n, future in batch.callers
+                ]
+            )
+            return
+        for offset, size, future in batch.callers:
+            self.resolve(future, result=results[offset : offset + size])
+
+    async def run_single(
+        self,
+        model: str,
+        phase: Literal["query", "document"],
+        texts: list[str],
+        future: asyncio.Future,
+    ):
+        try:
+            self.resolve(future, result=await self.provider(model, texts, phase))
+        except Exception as e:
+            self.resolve(future, exception=e)
+
+    def resolve(self, future: asyncio.Future, result=None, exception=None):
+        # The caller may have been cancelled meanwhile
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
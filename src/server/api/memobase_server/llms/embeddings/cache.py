@@ -0,0 +1,108 @@
+"""
+Two-tier embedding cache, an in-process LRU bounded by bytes in front of redis.
+
+Keys hash the text together with the model, dimension and phase, values are the
+raw vector bytes (`embedding_cache_dtype`), base64 encoded in redis.
+"""
+
+import base64
+import numpy as np
+from hashlib import sha256
+from typing import Literal, Optional
+from ...env import CONFIG, LOG
+from ...connectors import PROJECT_ID, get_redis_client
+from ...local_cache import LocalTTLCache
+from ...telemetry import telemetry_manager, CounterMetricName
+
+CACHE_DTYPE = np.dtype(CONFIG.embedding_cache_dtype)
+
+LOCAL_EMBEDDING_CACHE = LocalTTLCache(
+    maxsize=1_000_000,
+    ttl=None,
+    max_bytes=CONFIG.embedding_cache_local_max_bytes,
+    sizeof=lambda v: v.nbytes,
+)
+
+
+def embedding_cache_key(
+    model: str, phase: Literal["query", "document"], text: str
+) -> str:
+    text_hash = sha256(text.encode()).hexdigest()
+    return (
+        f"memobase:embedding:{PROJECT_ID}:{model}:{CONFIG.embedding_dim}:"
+        f"{CACHE_DTYPE.name}:{phase}:{text_hash}"
+    )
+
+
+def pack_embedding(vector: np.ndarray) -> str:
+    return base64.b64encode(vector.astype(CACHE_DTYPE).tobytes()).decode()
+
+
+def unpack_embedding(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype=CACHE_DTYPE)
+
+
+async def get_cached_embeddings(
+    project_id: str,
+    model: str,
+    phase: Literal["query", "document"],
+    texts: list[str],
+) -> list[Optional[np.ndarray]]:
+    keys = [embedding_cache_key(model, phase, t) for t in texts]
+    results = [LOCAL_EMBEDDING_CACHE.get(k) for k in keys]
+    local_hits = sum(r is not None for r in results)
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    redis_hits = 0
+    if missing:
+        try:
+            async with get_redis_client() as redis_client:
+                values = await redis_client.mget([keys[i] for i in missing])
+        except Exception as e:
+            LOG.warning(f"Embedding cache unavailable: {e}")
+            values = [None] * len(missing)
+        for i, value in zip(missing, values):
+            if value is None:
+                continue
+            vector = unpack_embedding(value)
+            LOCAL_EMBEDDING_CACHE.set(keys[i], vector)
+            results[i] = vector
+            redis_hits += 1
+
+    for tier, hits in (("local", local_hits), ("redis", redis_hits)):
+        if hits:
+            telemetry_manager.increment_counter_metric(
+                CounterMetricName.EMBEDDING_CACHE_HIT,
+                hits,
+                {"project_id": project_id, "tier": tier},
+            )
+    misses = len(texts) - local_hits - redis_hits
+    if misses:
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.EMBEDDING_CACHE_MISS,
+            misses,
+            {"project_id": project_id},
+        )
+    return results
+
+
+async def set_cached_embeddings(
+    model: str,
+    phase: Literal["query", "document"],
+    texts: list[str],
+    vectors: np.ndarray,
+):
+    packed = {}
+    for text, vector in zip(texts, vectors):
+        key = embedding_cache_key(model, phase, text)
+        vector = vector.astype(CACHE_DTYPE)
+        LOCAL_EMBEDDING_CACHE.set(key, vector)
+        packed[key] = pack_embedding(vector)
+    try:
+        async with get_redis_client() as redis_client:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, value in packed.items():
+                pipe.set(key, value, ex=CONFIG.embedding_cache_ttl)
+            await pipe.execute()
+    except Exception as e:
+        LOG.warning(f"Failed to write embedding cache: {e}")
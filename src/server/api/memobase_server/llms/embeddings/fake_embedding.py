@@ -0,0 +1,20 @@
+import asyncio
+import hashlib
+import numpy as np
+from typing import Literal
+from ..utils import sample_fake_latency
+from ...env import CONFIG
+
+
+def fake_vector(text: str) -> np.ndarray:
+    # Same text, same unit vector
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(CONFIG.embedding_dim)
+    return vector / np.linalg.norm(vector)
+
+
+async def fake_embedding(
+    model: str, texts: list[str], phase: Literal["query", "document"] = "document"
+) -> np.ndarray:
+    await asyncio.sleep(sample_fake_latency(CONFIG.fake_embedding_latency_ms))
+    return np.array([fake_vector(t) for t in texts])
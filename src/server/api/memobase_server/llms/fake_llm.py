@@ -0,0 +1,89 @@
+"""
+Offline stand-in for the LLM, for load tests and local development.
+
+Answers by `prompt_id` with canned responses in the formats the parsers in
+`prompts/utils.py` expect, after a latency drawn from the `fake_*` settings.
+The same prompt always gets the same answer.
+"""
+
+import re
+import asyncio
+import hashlib
+from .utils import exclude_special_kwargs, sample_fake_latency, LLMResult
+from .limiter import estimate_tokens
+from ..env import CONFIG
+
+FAKE_FACTS = [
+    ("basic_info", "name", "Alex"),
+    ("basic_info", "age", "29"),
+    ("contact_info", "city", "Berlin"),
+    ("education", "major", "Computer Science"),
+    ("work", "title", "Backend engineer"),
+    ("work", "working_industry", "Logistics"),
+    ("interest", "foods", "Spicy noodles"),
+    ("interest", "movies", "Science fiction"),
+    ("interest", "sports", "Bouldering twice a week"),
+    ("psychological", "goals", "Run a half marathon this year"),
+    ("life_event", "relocation", "Moved to a new flat last month"),
+]
+FAKE_FACTS_PER_PROMPT = 3
+MEMO_ID_REGEX = re.compile(r"'memo_id': (\d+)")
+
+
+def pick_facts(prompt: str) -> list[tuple[str, str, str]]:
+    start = int(hashlib.md5(prompt.encode()).hexdigest(), 16) % len(FAKE_FACTS)
+    return [
+        FAKE_FACTS[(start + i) % len(FAKE_FACTS)] for i in range(FAKE_FACTS_PER_PROMPT)
+    ]
+
+
+def fake_response(prompt_id: str | None, prompt: str) -> str:
+    tab = CONFIG.llm_tab_separator
+    # zh_ prompts share the output format of their en version
+    name = (prompt_id or "").removeprefix("roleplay.").removeprefix("zh_")
+    if name == "summary_entry_chats":
+        return "\n".join(
+            f"- User mentioned {sub_topic}: {memo}"
+            for _, sub_topic, memo in pick_facts(prompt)
+        )
+    if name == "extract_profile":
+        return "\n".join(
+            f"- {topic}{tab}{sub_topic}{tab}{memo}"
+            for topic, sub_topic, memo in pick_facts(prompt)
+        )
+    if name == "merge_profile_yolo":
+        return "\n".join(
+            f"{memo_id}. APPEND{tab}APPEND"
+            for memo_id in MEMO_ID_REGEX.findall(prompt)
+        )
+    if name == "merge_profile":
+        return f"- APPEND{tab}APPEND"
+    if name == "organize_profile":
+        lines = [l for l in prompt.split("\n") if l.startswith("- ")]
+        return "\n".join(lines[: CONFIG.max_profile_subtopics // 2 + 1])
+    if name == "summary_profile":
+        return prompt[: CONFIG.max_pre_profile_token_size]
+    if name == "event_tagging":
+        return f"- emotion{tab}calm"
+    if name == "pick_related_profiles":
+        return '{"reason": "fake", "profiles": [0, 1, 2]}'
+    if name == "detect_interest":
+        return '{"status": "normal", "action": "none"}'
+    if name == "infer_plot":
+        return "<themes>daily life</themes><overview>none</overview><timeline>none</timeline>"
+    return "ok"
+
+
+async def fake_complete(
+    model, prompt, system_prompt=None, history_messages=[], **kwargs
+) -> LLMResult:
+    sp_args, kwargs = exclude_special_kwargs(kwargs)
+    await asyncio.sleep(sample_fake_latency(CONFIG.fake_llm_latency_ms))
+    text = fake_response(sp_args["prompt_id"], prompt)
+    return LLMResult(
+        text=text,
+        input_tokens=estimate_tokens(
+            prompt, system_prompt, *[m["content"] for m in history_messages]
+        ),
+        output_tokens=estimate_tokens(text),
+    )
@@ -0,0 +1,216 @@
+"""
+Rate limiting for LLM calls.
+
+Two layers:
+- per-model RPM/TPM budgets in fixed one-minute windows, shared by every API and
+  worker process through Redis. Background calls can only use
+  `llm_background_budget_ratio` of the budget, the rest is kept for read-path calls;
+- a local priority semaphore (`llm_max_concurrency`), read-path calls are woken
+  up before background extraction.
+
+The budget is reserved before taking a local slot, so calls waiting for budget
+don't hold slots that read-path calls could use.
+"""
+
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from typing import Literal, Optional
+from dataclasses import dataclass
+from ..env import CONFIG, LOG
+from ..connectors import PROJECT_ID, get_redis_client
+from ..telemetry import telemetry_manager, HistogramMetricName
+
+LLMPriority = Literal["read", "background"]
+PRIORITY_ORDER = {"read": 0, "background": 1}
+
+REDIS_LUA_RESERVE_BUDGET = """
+local rpm = tonumber(redis.call("GET", KEYS[1]) or "0")
+local tpm = tonumber(redis.call("GET", KEYS[2]) or "0")
+local rpm_limit = tonumber(ARGV[1])
+local tpm_limit = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+if rpm_limit >= 0 and rpm + 1 > rpm_limit then
+    return 0
+end
+-- an empty window always admits one call, even one larger than the budget
+if tpm_limit >= 0 and tpm > 0 and tpm + tokens > tpm_limit then
+    return 0
+end
+redis.call("INCRBY", KEYS[1], 1)
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("INCRBY", KEYS[2], tokens)
+redis.call("EXPIRE", KEYS[2], ARGV[4])
+return 1
+"""
+WINDOW_S = 60
+
+
+class LLMRateLimitTimeout(Exception):
+    pass
+
+
+class PrioritySemaphore:
+    """asyncio.Semaphore whose waiters are woken up by priority, then FIFO"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Woken up and cancelled at the same time, pass the slot on
+                self.release()
+            raise
+
+    def waiting(self) -> int:
+        return sum(not future.done() for _, _, future in self._waiters)
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+@dataclass
+class LLMReservation:
+    model: str
+    priority: LLMPriority
+    estimated_tokens: int
+    tpm_key: Optional[str] = None
+    holds_slot: bool = False
+
+
+def get_model_limits(model: str) -> tuple[Optional[int], Optional[int]]:
+    limits = CONFIG.llm_model_rate_limits.get(model, {})
+    return (
+        limits.get("rpm", CONFIG.llm_rpm_limit),
+        limits.get("tpm", CONFIG.llm_tpm_limit),
+    )
+
+
+def estimate_tokens(*texts: str) -> int:
+    # Rough count without running the tokenizer, settle() corrects it afterwards
+    return sum(len(t) for t in texts if t) // 3
+
+
+class LLMRateLimiter:
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.local_slots = (
+            PrioritySemaphore(max_concurrency) if max_concurrency else None
+        )
+
+    async def acquire(
+        self, model: str, estimated_tokens: int, priority: LLMPriority
+    ) -> LLMReservation:
+        reservation = LLMReservation(model, priority, estimated_tokens)
+        start = time.monotonic()
+        await self._reserve_budget(reservation, start)
+        if self.local_slots is not None:
+            await self.local_slots.acquire(PRIORITY_ORDER[priority])
+            reservation.holds_slot = True
+        telemetry_manager.record_histogram_metric(
+            HistogramMetricName.LLM_QUEUE_WAIT_MS,
+            (time.monotonic() - start) * 1000,
+            {"model": model, "priority": priority},
+        )
+        return reservation
+
+    def release(self, reservation: LLMReservation):
+        if reservation.holds_slot:
+            reservation.holds_slot = False
+            self.local_slots.release()
+
+    async def settle(self, reservation: LLMReservation, actual_tokens: int):
+        """Replace the estimated tokens with the real count in the reserved window"""
+        if reservation.tpm_key is None:
+            return
+        delta = actual_tokens - reservation.estimated_tokens
+        if delta == 0:
+            return
+        try:
+            async with get_redis_client() as redis_client:
+                await redis_client.incrby(reservation.tpm_key, delta)
+        except Exception as e:
+            LOG.warning(f"Failed to settle LLM token budget: {e}")
+
+    async def background_saturated(self, model: str) -> bool:
+        """Whether a new background call to `model` would have to wait
+
+        For callers that can hold off starting work, like the flush worker.
+        """
+        if self.local_slots is not None and self.local_slots.waiting():
+            return True
+        rpm_limit, tpm_limit = get_model_limits(model)
+        if rpm_limit is None and tpm_limit is None:
+            return False
+        window = int(time.time() // WINDOW_S)
+        prefix = f"memobase:llm_budget:{PROJECT_ID}:{model}:{window}"
+        try:
+            async with get_redis_client() as redis_client:
+                rpm, tpm = await redis_client.mget(f"{prefix}:rpm", f"{prefix}:tpm")
+        except Exception as e:
+            LOG.warning(f"LLM rate limiter unavailable: {e}")
+            return False
+        ratio = CONFIG.llm_background_budget_ratio
+        if rpm_limit is not None and int(rpm or 0) >= rpm_limit * ratio:
+            return True
+        if tpm_limit is not None and int(tpm or 0) >= tpm_limit * ratio:
+            return True
+        return False
+
+    async def _reserve_budget(self, reservation: LLMReservation, start: float):
+        rpm_limit, tpm_limit = get_model_limits(reservation.model)
+        if rpm_limit is None and tpm_limit is None:
+            return
+        ratio = (
+            1 if reservation.priority == "read" else CONFIG.llm_background_budget_ratio
+        )
+        rpm_limit = -1 if rpm_limit is None else int(rpm_limit * ratio)
+        tpm_limit = -1 if tpm_limit is None else int(tpm_limit * ratio)
+
+        while True:
+            window = int(time.time() // WINDOW_S)
+            prefix = f"memobase:llm_budget:{PROJECT_ID}:{reservation.model}:{window}"
+            try:
+                async with get_redis_client() as redis_client:
+                    admitted = await redis_client.eval(
+                        REDIS_LUA_RESERVE_BUDGET,
+                        2,
+                        f"{prefix}:rpm",
+                        f"{prefix}:tpm",
+                        rpm_limit,
+                        tpm_limit,
+                        reservation.estimated_tokens,
+                        WINDOW_S * 2,
+                    )
+            except Exception as e:
+                # Fail open, the provider's own limits still apply
+                LOG.warning(f"LLM rate limiter unavailable: {e}")
+                return
+            if admitted:
+                reservation.tpm_key = f"{prefix}:tpm"
+                return
+            if time.monotonic() - start > CONFIG.llm_limiter_max_wait:
+                raise LLMRateLimitTimeout(
+                    f"Waited over {CONFIG.llm_limiter_max_wait}s for {reservation.model} rate limit"
+                )
+            to_next_window = WINDOW_S - time.time() % WINDOW_S
+            await asyncio.sleep(min(to_next_window, 1) + random.uniform(0, 0.2))
+
+
+LLM_LIMITER = LLMRateLimiter(CONFIG.llm_max_concurrency)
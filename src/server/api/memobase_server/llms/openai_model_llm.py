@@ -1,12 +1,23 @@
-from .utils import exclude_special_kwargs, get_openai_async_client_instance
-from ..env import LOG
+from .utils import (
+    exclude_special_kwargs,
+    get_openai_async_client_instance,
+    LLMResult,
+)
+from ..env import CONFIG, LOG
 
 
 async def openai_complete(
     model, prompt, system_prompt=None, history_messages=[], **kwargs
-) -> str:
+) -> LLMResult:
     sp_args, kwargs = exclude_special_kwargs(kwargs)
     prompt_id = sp_args.get("prompt_id", None)
+    prompt_hash = sp_args.get("prompt_hash", None)
+    if CONFIG.llm_openai_prompt_cache_key and prompt_hash is not None:
+        # Route requests with the same system prompt to the same cache
+        kwargs["extra_body"] = {
+            **(kwargs.get("extra_body") or {}),
+            "prompt_cache_key": f"{prompt_id}:{prompt_hash}",
+        }
 
     openai_async_client = get_openai_async_client_instance()
     messages = []
@@ -18,8 +29,6 @@ async def openai_complete(
     response = await openai_async_client.chat.completions.create(
         model=model, messages=messages, timeout=120, **kwargs
     )
-    cached_tokens = getattr(response.usage.prompt_tokens_details, "cached_tokens", None)
-    LOG.info(
-        f"Cached {prompt_id} {model} {cached_tokens}/{response.usage.prompt_tokens}"
-    )
-    return response.choices[0].message.content
+    result = LLMResult.from_response(response)
+    LOG.info(f"Cached {prompt_id} {model} {result.cached_tokens}/{result.input_tokens}")
+    return result
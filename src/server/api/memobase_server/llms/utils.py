@@ -1,7 +1,34 @@
+import math
+import random
+import hashlib
+from typing import Optional
+from dataclasses import dataclass
 from openai import AsyncOpenAI
 from volcenginesdkarkruntime import AsyncArk
 from ..env import CONFIG
 
+
+@dataclass
+class LLMResult:
+    """Completion text with the provider-reported usage, usage is None if missing"""
+
+    text: str
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+
+    @classmethod
+    def from_response(cls, response) -> "LLMResult":
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            text=response.choices[0].message.content,
+            input_tokens=getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "completion_tokens", None),
+            cached_tokens=getattr(details, "cached_tokens", None),
+        )
+
+
 _global_openai_async_client = None
 _global_doubao_async_client = None
 
@@ -26,7 +53,28 @@ def get_doubao_async_client_instance() -> AsyncArk:
     return _global_doubao_async_client
 
 
+def compute_prompt_hash(system_prompt: str) -> str:
+    return hashlib.md5(system_prompt.encode()).hexdigest()
+
+
 def exclude_special_kwargs(kwargs: dict):
     prompt_id = kwargs.pop("prompt_id", None)
     no_cache = kwargs.pop("no_cache", None)
-    return {"prompt_id": prompt_id, "no_cache": no_cache}, kwargs
+    prompt_hash = kwargs.pop("prompt_hash", None)
+    return {
+        "prompt_id": prompt_id,
+        "no_cache": no_cache,
+        "prompt_hash": prompt_hash,
+    }, kwargs
+
+
+def sample_fake_latency(median_ms: float) -> float:
+    """Seconds the fake providers wait, drawn from `fake_latency_distribution`"""
+    if median_ms <= 0:
+        return 0
+    if CONFIG.fake_latency_distribution == "exponential":
+        # Median of an exponential is ln(2) / rate
+        return random.expovariate(math.log(2) / median_ms) / 1000
+    if CONFIG.fake_latency_distribution == "lognormal":
+        return median_ms * random.lognormvariate(0, CONFIG.fake_latency_sigma) / 1000
+    return median_ms / 1000
@@ -0,0 +1,68 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LocalTTLCache:
+    """Bounded in-process LRU cache with a TTL per entry.
+
+    Each process has its own copy, so callers need another way (TTL, Redis
+    version keys, pub/sub) to notice changes made by other processes.
+    With `max_bytes`, entries are also evicted once the `sizeof` of all values
+    goes over it.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float],
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._data: OrderedDict[Hashable, tuple[Optional[float], Any, int]] = (
+            OrderedDict()
+        )
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expire_at, value, _ = item
+        if expire_at is not None and expire_at < time.monotonic():
+            self.delete(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self.delete(key)
+        self._data[key] = (expire_at, value, size)
+        self.total_bytes += size
+        while len(self._data) > self.maxsize or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def delete(self, key: Hashable):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.total_bytes -= item[2]
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
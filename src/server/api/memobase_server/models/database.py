@@ -99,6 +99,63 @@ def check_legal_embedding_dim(cls, session):
         raise e
 
 
+# pgvector can't build hnsw/ivfflat indexes on vectors wider than this
+MAX_ANN_INDEX_DIM = 2000
+
+
+def embedding_ann_indexes(table_name: str) -> tuple[Index, ...]:
+    """Cosine ANN index on the `embedding` column, shaped by CONFIG"""
+    if CONFIG.embedding_index_type == "none":
+        return ()
+    if CONFIG.embedding_dim > MAX_ANN_INDEX_DIM:
+        LOG.warning(
+            f"embedding_dim {CONFIG.embedding_dim} > {MAX_ANN_INDEX_DIM}, "
+            f"skip the {CONFIG.embedding_index_type} index on {table_name}"
+        )
+        return ()
+    if CONFIG.embedding_index_type == "hnsw":
+        return (
+            Index(
+                f"idx_{table_name}_embedding_hnsw",
+                "embedding",
+                postgresql_using="hnsw",
+                postgresql_with={
+                    "m": CONFIG.embedding_hnsw_m,
+                    "ef_construction": CONFIG.embedding_hnsw_ef_construction,
+                },
+                postgresql_ops={"embedding": "vector_cosine_ops"},
+            ),
+        )
+    return (
+        Index(
+            f"idx_{table_name}_embedding_ivfflat",
+            "embedding",
+            postgresql_using="ivfflat",
+            postgresql_with={"lists": CONFIG.embedding_ivfflat_lists},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
+
+
+def ann_search_settings() -> list[str]:
+    """`SET LOCAL` statements to run before an ANN query in the same transaction"""
+    if CONFIG.embedding_index_type == "hnsw":
+        settings = [
+            f"SET LOCAL hnsw.ef_search = {int(CONFIG.embedding_hnsw_ef_search)}"
+        ]
+        if CONFIG.embedding_index_iterative_scan:
+            settings.append("SET LOCAL hnsw.iterative_scan = strict_order")
+        return settings
+    if CONFIG.embedding_index_type == "ivfflat":
+        settings = [
+            f"SET LOCAL ivfflat.probes = {int(CONFIG.embedding_ivfflat_probes)}"
+        ]
+        if CONFIG.embedding_index_iterative_scan:
+            settings.append("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+        return settings
+    return []
+
+
 @dataclass
 class Base:
     __abstract__ = True
@@ -435,6 +492,17 @@ class UserProfile(Base):
         default=DEFAULT_PROJECT_ID,
     )
 
+    # Tokens of "topic::sub_topic: content", counted when written
+    token_size: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, default=None
+    )
+
+    # Embedding of "topic::sub_topic: content", only with enable_profile_embedding.
+    # Deferred, profile reads don't need it
+    embedding: Mapped[Optional[Vector]] = mapped_column(
+        Vector(dim=CONFIG.embedding_dim), nullable=True, default=None, deferred=True
+    )
+
     user: Mapped[User] = relationship(
         "User",
         back_populates="related_user_profiles",
@@ -442,6 +510,10 @@ class UserProfile(Base):
         foreign_keys=[user_id, project_id],
     )
 
+    # Get created_at/updated_at back with RETURNING, the profile cache is
+    # written from the ORM objects right after commit
+    __mapper_args__ = {"eager_defaults": True}
+
     __table_args__ = (
         PrimaryKeyConstraint("id", "project_id"),
         Index("idx_user_profiles_user_id_project_id", "user_id", "project_id"),
@@ -497,6 +569,7 @@ class UserEvent(Base):
         PrimaryKeyConstraint("id", "project_id"),
         Index("idx_user_events_user_id_project_id", "user_id", "project_id"),
         Index("idx_user_events_user_id_id_project_id", "user_id", "project_id", "id"),
+        *embedding_ann_indexes("user_events"),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
@@ -534,6 +607,11 @@ class UserEventGist(Base):
         default=DEFAULT_PROJECT_ID,
     )
 
+    # Tokens of the gist content, counted when written
+    token_size: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, default=None
+    )
+
     event: Mapped[UserEvent] = relationship(
         "UserEvent",
         back_populates="related_user_event_gists",
@@ -566,6 +644,7 @@ class UserEventGist(Base):
             "project_id",
             "event_id",
         ),
+        *embedding_ann_indexes("user_event_gists"),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
@@ -2,6 +2,7 @@ from datetime import datetime
 from enum import IntEnum
 from typing import Optional, Literal
 from pydantic import BaseModel, UUID4, UUID5, Field
+from pydantic.json_schema import SkipJsonSchema
 from .blob import BlobData, OpenAICompatibleMessage
 from .claim import ClaimData
 from .action import ActionData
@@ -81,6 +82,12 @@ class ProfileData(BaseModel):
         None,
         description="User profile attributes in JSON, containing 'topic', 'sub_topic'",
     )
+    # Internal, for truncation, left out of responses
+    token_size: SkipJsonSchema[Optional[int]] = Field(
+        None,
+        exclude=True,
+        description="Token size of the profile as 'topic::sub_topic: content'",
+    )
 
 
 class ProfileDelta(BaseModel):
@@ -118,6 +125,10 @@ class UserEventGistData(BaseModel):
         None, description="Timestamp when the event gist was last updated"
     )
     similarity: Optional[float] = Field(None, description="Similarity score")
+    # Internal, for truncation, left out of responses
+    token_size: SkipJsonSchema[Optional[int]] = Field(
+        None, exclude=True, description="Token size of the event gist content"
+    )
 
 
 class UserEventData(BaseModel):
@@ -134,6 +145,22 @@ class UserEventData(BaseModel):
 
 class ContextData(BaseModel):
     context: str = Field(..., description="Context string")
+    skipped_stages: list[str] = Field(
+        default_factory=list,
+        description="Stages cut off by `timeout_ms`, `profile_filter` or `event_search`",
+    )
+
+
+class ContextStreamChunk(BaseModel):
+    section: Literal["profile", "event", "context"] = Field(
+        ..., description="Which part of the context this chunk carries"
+    )
+    content: str = Field(..., description="The section string, or the whole context")
+    token_size: int = Field(..., description="Token size of the content sections")
+    skipped_stages: list[str] = Field(
+        default_factory=list,
+        description="Stages cut off by `timeout_ms` so far, `profile_filter` or `event_search`",
+    )
 
 
 class UserData(BaseModel):
@@ -149,6 +176,10 @@ class UserData(BaseModel):
 
 class UserProfilesData(BaseModel):
     profiles: list[ProfileData] = Field(..., description="List of user profiles")
+    skipped_stages: list[str] = Field(
+        default_factory=list,
+        description="Stages cut off by `timeout_ms`, `profile_filter`",
+    )
 
 
 class UserEventsData(BaseModel):
@@ -308,6 +339,12 @@ class UserContextDataResponse(BaseResponse):
     )
 
 
+class UserContextStreamChunkResponse(BaseResponse):
+    data: Optional[ContextStreamChunk] = Field(
+        None, description="One server-sent event of a streamed user context"
+    )
+
+
 class BillingResponse(BaseResponse):
     data: Optional[BillingData] = Field(
         None, description="Response containing token left"
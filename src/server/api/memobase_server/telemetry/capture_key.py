@@ -1,4 +1,6 @@
+import asyncio
 from datetime import datetime, timedelta
+from ..env import CONFIG, LOG
 from ..connectors import get_redis_client, PROJECT_ID
 from ..models.database import DEFAULT_PROJECT_ID
 
@@ -19,6 +21,66 @@ def head_key(project_id: str):
     return f"memobase_telemetry::{PROJECT_ID}::{project_id}"
 
 
+class IntKeyAggregator:
+    """Sums counter increments in memory and writes them in one redis pipeline.
+
+    Increments that are not flushed yet are still visible to `get_int_key` in
+    this process. A failed flush puts the batch back for the next one.
+    """
+
+    def __init__(self):
+        # redis key -> (increment, expire seconds)
+        self.pending: dict[str, tuple[int, int]] = {}
+        # the batch being written, still counted until redis has it
+        self.flushing: dict[str, tuple[int, int]] = {}
+
+    def add(self, key: str, value: int, expire_s: int):
+        current, _ = self.pending.get(key, (0, expire_s))
+        self.pending[key] = (current + value, expire_s)
+
+    def restore(self, batch: dict[str, tuple[int, int]]):
+        for key, (value, expire_s) in batch.items():
+            self.add(key, value, expire_s)
+
+    def pending_value(self, key: str) -> int:
+        return (
+            self.pending.get(key, (0, 0))[0] + self.flushing.get(key, (0, 0))[0]
+        )
+
+    async def flush(self):
+        if not self.pending or self.flushing:
+            return
+        batch, self.pending = self.pending, {}
+        self.flushing = batch
+        try:
+            async with get_redis_client() as r_c:
+                pipe = r_c.pipeline(transaction=False)
+                for key, (value, expire_s) in batch.items():
+                    pipe.incrby(key, value)
+                    pipe.expire(key, expire_s)
+                await pipe.execute()
+        except Exception as e:
+            LOG.warning(f"Failed to flush {len(batch)} telemetry counters: {e}")
+            self.restore(batch)
+        except asyncio.CancelledError:
+            self.restore(batch)
+            raise
+        finally:
+            self.flushing = {}
+
+    async def run(self, interval: float = CONFIG.telemetry_flush_interval):
+        """Long running task, flushes the pending counts once more when cancelled"""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+
+INT_KEY_AGGREGATOR = IntKeyAggregator()
+
+
 async def capture_int_key(
     name: str,
     value: int = 1,
@@ -27,11 +89,8 @@ async def capture_int_key(
 ):
     key = f"{head_key(project_id)}::{name}::{date_key()}"
     key_month = f"{head_key(project_id)}::{name}::{month_key()}"
-    async with get_redis_client() as r_c:
-        await r_c.incrby(key, value)
-        await r_c.incrby(key_month, value)
-        await r_c.expire(key, expire_days * 24 * 60 * 60)
-        await r_c.expire(key_month, 30 * expire_days * 24 * 60 * 60)
+    INT_KEY_AGGREGATOR.add(key, value, expire_days * 24 * 60 * 60)
+    INT_KEY_AGGREGATOR.add(key_month, value, 30 * expire_days * 24 * 60 * 60)
 
 
 async def get_int_key(
@@ -46,10 +105,15 @@ async def get_int_key(
         using_date = use_date or date_key()
         key = f"{head_key(project_id)}::{name}::{using_date}"
     async with get_redis_client() as r_c:
-        return int((await r_c.get(key)) or 0)
+        stored = int((await r_c.get(key)) or 0)
+    return stored + INT_KEY_AGGREGATOR.pending_value(key)
 
 
 if __name__ == "__main__":
-    import asyncio
 
-    print(asyncio.run(capture_int_key("test_key")))
+    async def main():
+        await capture_int_key("test_key")
+        await INT_KEY_AGGREGATOR.flush()
+        return await get_int_key("test_key")
+
+    print(asyncio.run(main()))
@@ -36,6 +36,10 @@ class CounterMetricName(Enum):
     LLM_TOKENS_INPUT = "llm_input_tokens_total"
     LLM_TOKENS_OUTPUT = "llm_output_tokens_total"
     EMBEDDING_TOKENS = "embedding_tokens_total"
+    EMBEDDING_CACHE_HIT = "embedding_cache_hit_total"
+    EMBEDDING_CACHE_MISS = "embedding_cache_miss_total"
+    PROFILE_MERGE_LLM_CALLS = "profile_merge_llm_calls_total"
+    PROFILE_MERGE_FACTS = "profile_merge_facts_total"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
@@ -46,6 +50,10 @@ class CounterMetricName(Enum):
             CounterMetricName.LLM_TOKENS_INPUT: "Total number of input tokens",
             CounterMetricName.LLM_TOKENS_OUTPUT: "Total number of output tokens",
             CounterMetricName.EMBEDDING_TOKENS: "Total number of embedding tokens",
+            CounterMetricName.EMBEDDING_CACHE_HIT: "Total number of texts whose embedding was cached, by tier",
+            CounterMetricName.EMBEDDING_CACHE_MISS: "Total number of texts sent to the embedding provider",
+            CounterMetricName.PROFILE_MERGE_LLM_CALLS: "Total number of profile merge LLM calls, by merge strategy",
+            CounterMetricName.PROFILE_MERGE_FACTS: "Total number of facts sent to profile merge LLM calls, by merge strategy",
         }
         return descriptions[self]
 
@@ -60,6 +68,10 @@ class HistogramMetricName(Enum):
     LLM_LATENCY_MS = "llm_latency"
     EMBEDDING_LATENCY_MS = "embedding_latency"
     REQUEST_LATENCY_MS = "request_latency"
+    LLM_QUEUE_WAIT_MS = "llm_queue_wait"
+    PROFILE_MERGE_LATENCY_MS = "profile_merge_latency"
+    FLUSH_STAGE_LATENCY_MS = "flush_stage_latency"
+    PROFILE_FILTER_LATENCY_MS = "profile_filter_latency"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
@@ -67,6 +79,10 @@ class HistogramMetricName(Enum):
             HistogramMetricName.LLM_LATENCY_MS: "Latency of the LLM in milliseconds",
             HistogramMetricName.EMBEDDING_LATENCY_MS: "Latency of the embedding in milliseconds",
             HistogramMetricName.REQUEST_LATENCY_MS: "Latency of the request in milliseconds",
+            HistogramMetricName.LLM_QUEUE_WAIT_MS: "Time an LLM call waited in the rate limiter in milliseconds",
+            HistogramMetricName.PROFILE_MERGE_LATENCY_MS: "Latency of merging one flush's facts into the profiles in milliseconds, by merge strategy",
+            HistogramMetricName.FLUSH_STAGE_LATENCY_MS: "Latency of each stage of a buffer flush in milliseconds, by stage and prompt_id",
+            HistogramMetricName.PROFILE_FILTER_LATENCY_MS: "Latency of picking the profiles relevant to the chats in milliseconds, by method",
         }
         return descriptions[self]
 
@@ -0,0 +1,76 @@
+import time
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+from opentelemetry import trace
+from ..env import TRACE_LOG
+from .open_telemetry import telemetry_manager, HistogramMetricName
+
+TRACER = trace.get_tracer("memobase_server")
+
+
+class FlushTimings:
+    """Durations of the stages of one buffer flush, in the order they ended.
+
+    Stages that run concurrently overlap, so they can add up to more than the
+    total.
+    """
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.start = time.monotonic()
+        self.stages: list[tuple[str, float]] = []
+
+    def summary(self) -> str:
+        total = (time.monotonic() - self.start) * 1000
+        stages = ", ".join(f"{name} {latency:.0f}ms" for name, latency in self.stages)
+        return f"Flushed {self.pipeline} blobs in {total:.0f}ms ({stages})"
+
+
+CURRENT_FLUSH_TIMINGS: ContextVar[FlushTimings | None] = ContextVar(
+    "current_flush_timings", default=None
+)
+
+
+@contextmanager
+def stage_timer(project_id: str, stage: str, prompt_id: str | None = None):
+    """Record the stage as a span and in the stage latency histogram, and add it
+    to the summary of the flush it runs in, if any."""
+    attributes = {"project_id": project_id, "stage": stage}
+    if prompt_id is not None:
+        attributes["prompt_id"] = prompt_id
+    start = time.monotonic()
+    try:
+        with TRACER.start_as_current_span(f"flush.{stage}", attributes=attributes):
+            yield
+    finally:
+        latency = (time.monotonic() - start) * 1000
+        telemetry_manager.record_histogram_metric(
+            HistogramMetricName.FLUSH_STAGE_LATENCY_MS, latency, attributes
+        )
+        timings = CURRENT_FLUSH_TIMINGS.get()
+        if timings is not None:
+            timings.stages.append((stage, latency))
+
+
+def timed_flush(pipeline: str):
+    """Trace a `process_blobs(user_id, project_id, blobs)` and log its stage
+    timings to TRACE_LOG once it ends."""
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(user_id: str, project_id: str, *args, **kwargs):
+            timings = FlushTimings(pipeline)
+            token = CURRENT_FLUSH_TIMINGS.set(timings)
+            try:
+                with TRACER.start_as_current_span(
+                    f"flush.{pipeline}", attributes={"project_id": project_id}
+                ):
+                    return await func(user_id, project_id, *args, **kwargs)
+            finally:
+                CURRENT_FLUSH_TIMINGS.reset(token)
+                TRACE_LOG.info(project_id, user_id, timings.summary())
+
+        return wrapper
+
+    return decorator
@@ -88,6 +88,15 @@ def get_encoded_tokens(content: str) -> list[int]:
     return ENCODER.encode(content)
 
 
+def get_profile_token_size(content: str, attributes: dict | None) -> int:
+    attributes = attributes or {}
+    return len(
+        get_encoded_tokens(
+            f"{attributes.get('topic')}::{attributes.get('sub_topic')}: {content}"
+        )
+    )
+
+
 def get_decoded_tokens(tokens: list[int]) -> str:
     return ENCODER.decode(tokens)
 
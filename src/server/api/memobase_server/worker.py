@@ -0,0 +1,70 @@
+"""
+Buffer flush worker, run it next to the API with `use_flush_worker: true`:
+
+    python -m memobase_server.worker --concurrency 8
+"""
+
+import os
+import signal
+import socket
+import asyncio
+import argparse
+import memobase_server
+from .env import CONFIG, LOG
+from .connectors import init_redis_pool, close_connection
+from .llms import llm_sanity_check
+from .llms.embeddings import check_embedding_sanity
+from .controllers.flush_queue import FlushWorker
+from .telemetry.capture_key import INT_KEY_AGGREGATOR
+from .controllers.billing import run_billing_reconciler
+
+
+async def main(args: argparse.Namespace):
+    init_redis_pool()
+    await check_embedding_sanity()
+    await llm_sanity_check()
+
+    worker = FlushWorker(
+        consumer_name=args.name,
+        concurrency=args.concurrency,
+        visibility_timeout_s=args.visibility_timeout,
+        max_retries=args.max_retries,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    LOG.info(f"Start Memobase Flush Worker {memobase_server.__version__}")
+    flushers = [
+        asyncio.create_task(INT_KEY_AGGREGATOR.run()),
+        asyncio.create_task(run_billing_reconciler()),
+    ]
+    try:
+        await worker.run()
+    finally:
+        for task in flushers:
+            task.cancel()
+        await asyncio.gather(*flushers, return_exceptions=True)
+        await close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memobase buffer flush worker")
+    parser.add_argument(
+        "--name",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Consumer name in the redis consumer group",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=CONFIG.flush_worker_concurrency
+    )
+    parser.add_argument(
+        "--visibility-timeout",
+        type=int,
+        default=CONFIG.flush_worker_visibility_timeout,
+        help="Seconds before a silent job is reclaimed by another worker",
+    )
+    parser.add_argument(
+        "--max-retries", type=int, default=CONFIG.flush_worker_max_retries
+    )
+    asyncio.run(main(parser.parse_args()))
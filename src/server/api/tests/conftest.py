@@ -1,5 +1,8 @@
+import os
 import pytest
 import pytest_asyncio
+
+os.environ.setdefault("DATABASE_USE_NULL_POOL", "true")
 from api import app
 from memobase_server.env import CONFIG
 from fastapi.testclient import TestClient
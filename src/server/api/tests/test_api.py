@@ -1,10 +1,15 @@
 import os
+import json
+import asyncio
 import pytest
 import numpy as np
 from unittest.mock import patch, Mock, AsyncMock
 from api import app
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import DBAPIError
 from memobase_server import controllers
+from memobase_server.models.utils import Promise
+from memobase_server.controllers.post_process import profile as post_profile
 from memobase_server.models.database import DEFAULT_PROJECT_ID
 from memobase_server.models.blob import BlobType
 import numpy as np
@@ -32,6 +37,14 @@ def test_health_check(client, db_env):
     d = response.json()
     assert response.status_code == 200
     assert d["errno"] == 0
+    assert float(response.headers["X-Process-Time"]) >= 0
+
+
+def test_auth_middleware_rejects_missing_token(db_env):
+    c = TestClient(app)
+    response = c.get(f"{PREFIX}/project/billing")
+    assert response.status_code == 401
+    assert response.json()["errno"] == 401
 
 
 @pytest.fixture
@@ -275,6 +288,20 @@ async def test_api_user_profile(client, db_env):
     d = response.json()
     assert response.status_code == 200
     assert d["errno"] == 0
+    context = d["data"]["context"]
+
+    response = client.get(
+        f"{PREFIX}/users/context/{u_id}?only_topics=interest&stream=true&timeout_ms=5000"
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (e.split("\n")[0].removeprefix("event: "), json.loads(e.split("\n")[1][6:]))
+        for e in response.text.strip().split("\n\n")
+    ]
+    assert [name for name, _ in events] == ["profile", "event", "context"]
+    assert "basketball" in events[0][1]["data"]["content"]
+    assert events[-1][1]["data"]["content"] == context
 
     response = client.delete(f"{PREFIX}/users/profile/{u_id}/{id1}")
     d = response.json()
@@ -301,6 +328,72 @@ async def test_api_user_profile(client, db_env):
     assert response.status_code == 200
     assert d["errno"] == 0
 
+class QueryCanceled(Exception):
+    sqlstate = "57014"
+
+
+@pytest.mark.asyncio
+async def test_api_tiny_timeout_ms(
+    client, db_env, mock_event_get_embedding
+):
+    response = client.post(f"{PREFIX}/users", json={"data": {"test": 1}})
+    d = response.json()
+    assert d["errno"] == 0
+    u_id = d["data"]["id"]
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user likes to play basketball"],
+        [{"topic": "interest", "sub_topic": "sports"}],
+    )
+    assert p.ok()
+
+    async def slow_filter(*args, **kwargs):
+        await asyncio.sleep(1)
+        return Promise.resolve({"reason": None, "profiles": []})
+
+    async def canceled_filter(*args, **kwargs):
+        # What the deadline's statement_timeout raises on a slow query
+        raise DBAPIError("SELECT 1", {}, QueryCanceled())
+
+    chats_str = json.dumps([{"role": "user", "content": "what sports do I like?"}])
+    for cut_off_filter in (slow_filter, canceled_filter):
+        with patch.dict(
+            post_profile.PROFILE_FILTER_METHODS,
+            {"llm": cut_off_filter, "embedding": cut_off_filter},
+        ):
+            for timeout_ms in (1, 5, 20):
+                response = client.get(
+                    f"{PREFIX}/users/profile/{u_id}",
+                    params={
+                        "chats_str": chats_str,
+                        "timeout_ms": timeout_ms,
+                        "profile_filter_method": "llm",
+                    },
+                )
+                d = response.json()
+                assert response.status_code == 200
+                assert d["errno"] == 0
+                assert len(d["data"]["profiles"]) == 1
+                assert "profile_filter" in d["data"]["skipped_stages"]
+
+                response = client.get(
+                    f"{PREFIX}/users/context/{u_id}",
+                    params={
+                        "chats_str": chats_str,
+                        "timeout_ms": timeout_ms,
+                        "full_profile_and_only_search_event": False,
+                    },
+                )
+                d = response.json()
+                assert response.status_code == 200
+                assert d["errno"] == 0
+                assert "basketball" in d["data"]["context"]
+
+    response = client.delete(f"{PREFIX}/users/{u_id}")
+    assert response.json()["errno"] == 0
+
+
 
 @pytest.mark.asyncio
 async def test_api_user_flush_buffer(
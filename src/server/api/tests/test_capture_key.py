@@ -0,0 +1,39 @@
+import pytest
+from unittest.mock import patch
+from memobase_server.telemetry import capture_key
+from memobase_server.telemetry.capture_key import (
+    IntKeyAggregator,
+    capture_int_key,
+    get_int_key,
+)
+
+
+@pytest.mark.asyncio
+async def test_int_key_aggregator_merges_increments():
+    aggregator = IntKeyAggregator()
+    aggregator.add("a", 1, 60)
+    aggregator.add("a", 2, 60)
+    aggregator.add("b", 5, 120)
+    assert aggregator.pending_value("a") == 3
+    assert aggregator.pending == {"a": (3, 60), "b": (5, 120)}
+
+
+@pytest.mark.asyncio
+async def test_int_key_aggregator_keeps_batch_on_failure():
+    aggregator = IntKeyAggregator()
+    aggregator.add("a", 3, 60)
+    with patch.object(capture_key, "get_redis_client", side_effect=ConnectionError):
+        await aggregator.flush()
+    assert aggregator.pending_value("a") == 3
+    assert aggregator.flushing == {}
+
+
+@pytest.mark.asyncio
+async def test_get_int_key_includes_pending(db_env):
+    name = "test_get_int_key_includes_pending"
+    before = await get_int_key(name)
+    await capture_int_key(name, 7)
+    assert await get_int_key(name) == before + 7
+    assert await get_int_key(name, in_month=True) >= 7
+    await capture_key.INT_KEY_AGGREGATOR.flush()
+    assert await get_int_key(name) == before + 7
@@ -369,3 +369,42 @@ async def test_chat_organize_modal(
     assert mock_extract_llm_complete.await_count == 1
     assert mock_merge_llm_complete.await_count == 1
     assert mock_organize_llm_complete.await_count == 1
+
+
+def test_system_prompt_memoized_per_config():
+    from memobase_server.env import ProfileConfig
+    from memobase_server.llms.utils import compute_prompt_hash
+    from memobase_server.controllers.project import LOCAL_PROFILE_CONFIG_CACHE
+    from memobase_server.controllers.modal.chat.types import PROMPTS
+    from memobase_server.controllers.modal.chat.utils import get_system_prompt
+
+    project_id = "test_system_prompt_memoized"
+    config = ProfileConfig(language="en")
+    LOCAL_PROFILE_CONFIG_CACHE.set(project_id, ("1", config, {}))
+    try:
+        prompt = PROMPTS["en"]["merge_yolo"]
+        rendered = get_system_prompt(project_id, config, prompt)
+        assert rendered == (
+            prompt.get_prompt(),
+            compute_prompt_hash(prompt.get_prompt()),
+        )
+        assert get_system_prompt(project_id, config, prompt) is rendered
+
+        # A reloaded config (new version) renders again, to the same stable hash
+        reloaded = ProfileConfig(language="en")
+        LOCAL_PROFILE_CONFIG_CACHE.set(project_id, ("2", reloaded, {}))
+        again = get_system_prompt(project_id, reloaded, prompt)
+        assert again is not rendered and again == rendered
+    finally:
+        LOCAL_PROFILE_CONFIG_CACHE.delete(project_id)
+
+
+def test_merge_batches_bounded_by_size_and_tokens():
+    from memobase_server.controllers.modal.chat.merge_yolo import batch_new_memos
+
+    memos = [({"new_info": "x" * 30}, "x", {}) for _ in range(5)]
+    assert [len(b) for b in batch_new_memos(memos, 2, 10_000)] == [2, 2, 1]
+    # Each memo is ~15 estimated tokens
+    assert [len(b) for b in batch_new_memos(memos, 16, 30)] == [2, 2, 1]
+    # A memo over the budget still gets its own batch
+    assert [len(b) for b in batch_new_memos(memos, 16, 1)] == [1] * 5
@@ -79,6 +79,210 @@ async def test_user_state_clean(db_env):
     assert p.ok() and len(p.data().profiles) == 0
 
 
+@pytest.mark.asyncio
+async def test_user_profile_cache_write_through(db_env):
+    from memobase_server.connectors import get_redis_client
+
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+    cache_key = controllers.profile.user_profiles_cache_key(u_id, DEFAULT_PROJECT_ID)
+
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["a", "b"],
+        [{"topic": "t", "sub_topic": "a"}, {"topic": "t", "sub_topic": "b"}],
+    )
+    assert p.ok()
+    id_a, id_b = p.data().ids
+    # Not loaded yet, writes don't create a partial hash
+    async with get_redis_client() as redis_client:
+        assert await redis_client.hlen(cache_key) == 0
+
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().profiles) == 2
+
+    p = await controllers.profile.add_update_delete_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["c"],
+        [{"topic": "t", "sub_topic": "c"}],
+        [str(id_a)],
+        ["a2"],
+        [None],
+        [str(id_b)],
+    )
+    assert p.ok()
+    async with get_redis_client() as redis_client:
+        cached = await redis_client.hgetall(cache_key)
+    assert set(cached) == {"__loaded__", str(id_a), str(p.data().ids[0])}
+
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    profiles = p.data().profiles
+    assert sorted(pf.content for pf in profiles) == ["a2", "c"]
+    assert all(pf.created_at is not None for pf in profiles)
+    assert profiles[0].updated_at >= profiles[1].updated_at
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    async with get_redis_client() as redis_client:
+        assert await redis_client.hlen(cache_key) == 0
+
+
+@pytest.mark.asyncio
+async def test_user_profile_local_cache(db_env):
+    from memobase_server.connectors import get_redis_client
+
+    profile_ctl = controllers.profile
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+    p = await profile_ctl.add_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, ["a"], [{"topic": "t", "sub_topic": "a"}]
+    )
+    assert p.ok()
+
+    p = await profile_ctl.get_user_profiles(u_id, DEFAULT_PROJECT_ID, local_cache=True)
+    assert p.ok() and len(p.data().profiles) == 1
+    # Callers may reorder/filter their copy without touching the cached one
+    p.data().profiles.clear()
+    version, cached = profile_ctl.LOCAL_PROFILE_CACHE.get((DEFAULT_PROJECT_ID, u_id))
+    assert len(cached.profiles) == 1
+
+    # Another process changed the profiles, only the version tells
+    stale = profile_ctl.UserProfilesData(profiles=[])
+    profile_ctl.LOCAL_PROFILE_CACHE.set((DEFAULT_PROJECT_ID, u_id), (version, stale))
+    p = await profile_ctl.get_user_profiles(u_id, DEFAULT_PROJECT_ID, local_cache=True)
+    assert len(p.data().profiles) == 0
+    async with get_redis_client() as redis_client:
+        await redis_client.incr(
+            profile_ctl.user_profiles_version_key(u_id, DEFAULT_PROJECT_ID)
+        )
+    p = await profile_ctl.get_user_profiles(u_id, DEFAULT_PROJECT_ID, local_cache=True)
+    assert len(p.data().profiles) == 1
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    assert profile_ctl.LOCAL_PROFILE_CACHE.get((DEFAULT_PROJECT_ID, u_id)) is None
+
+
+@pytest.mark.asyncio
+async def test_project_profile_config_cache(db_env):
+    from memobase_server.controllers.modal.chat.utils import (
+        get_profile_config_artifacts,
+    )
+
+    project_ctl = controllers.project
+    p = await project_ctl.update_project_profile_config(
+        DEFAULT_PROJECT_ID, "event_tags:\n  - name: mood\n"
+    )
+    assert p.ok()
+    p = await project_ctl.get_project_profile_config(DEFAULT_PROJECT_ID)
+    config = p.data()
+    artifacts = get_profile_config_artifacts(DEFAULT_PROJECT_ID, config)
+    assert artifacts["available_event_tags"] == {"mood"}
+    assert artifacts["event_tags_prompt"] == "- mood()"
+
+    # Hits share the parsed config and the artifacts built from it
+    p = await project_ctl.get_project_profile_config(DEFAULT_PROJECT_ID)
+    assert p.data() is config
+    assert get_profile_config_artifacts(DEFAULT_PROJECT_ID, p.data()) is artifacts
+    # Stored next to the config in the cache entry, not on the config
+    assert not hasattr(config, "_artifacts")
+
+    # Rebuilt when the global CONFIG they're derived from changes
+    with patch.object(CONFIG, "llm_tab_separator", "|"):
+        rebuilt = get_profile_config_artifacts(DEFAULT_PROJECT_ID, config)
+    assert rebuilt is not artifacts
+
+    p = await project_ctl.update_project_profile_config(DEFAULT_PROJECT_ID, None)
+    assert p.ok()
+    p = await project_ctl.get_project_profile_config(DEFAULT_PROJECT_ID)
+    assert p.data() is not config
+    assert p.data().event_tags is None
+
+
+@pytest.mark.asyncio
+async def test_rank_profiles_with_chats(db_env):
+    import asyncio
+    from sqlalchemy import select, func
+    from memobase_server.connectors import AsyncSession
+    from memobase_server.models.utils import Promise
+    from memobase_server.models.database import UserProfile
+    from memobase_server.controllers.post_process.profile import (
+        BACKFILL_TASKS,
+        filter_profiles_within_deadline,
+    )
+
+    def fake_vector(text):
+        vector = np.zeros(CONFIG.embedding_dim)
+        vector[0 if "basketball" in text else 1] = 1
+        return vector
+
+    async def fake_get_embedding(project_id, texts, phase="document"):
+        return Promise.resolve(np.array([fake_vector(t) for t in texts]))
+
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    u_id = p.data().id
+    # Written before enable_profile_embedding was turned on
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user lives in Berlin"],
+        [{"topic": "basic_info", "sub_topic": "city"}],
+    )
+    assert p.ok()
+    with patch.object(CONFIG, "enable_profile_embedding", True), patch(
+        "memobase_server.controllers.profile.get_embedding", fake_get_embedding
+    ), patch(
+        "memobase_server.controllers.post_process.profile.get_embedding",
+        fake_get_embedding,
+    ):
+        p = await controllers.profile.add_user_profiles(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            ["user is a junior school student", "user likes to play basketball"],
+            [
+                {"topic": "education", "sub_topic": "level"},
+                {"topic": "interest", "sub_topic": "sports"},
+            ],
+        )
+        assert p.ok()
+        p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+        profiles = p.data()
+
+        skipped = await filter_profiles_within_deadline(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            profiles,
+            [res.OpenAICompatibleMessage(role="user", content="any basketball tips?")],
+            method="embedding",
+        )
+        await asyncio.gather(*BACKFILL_TASKS)
+    assert not skipped
+    # The unembedded profile isn't dropped, it comes after the ranked ones
+    assert [p.content for p in profiles.profiles] == [
+        "user likes to play basketball",
+        "user is a junior school student",
+        "user lives in Berlin",
+    ]
+    async with AsyncSession() as session:
+        unembedded = (
+            await session.execute(
+                select(func.count())
+                .select_from(UserProfile)
+                .where(
+                    UserProfile.user_id == u_id,
+                    UserProfile.embedding.is_(None),
+                )
+            )
+        ).scalar_one()
+    assert unembedded == 0
+    await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+
+
 @pytest.mark.asyncio
 async def test_blob_curd(db_env):
     p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
@@ -113,6 +317,51 @@ async def test_blob_curd(db_env):
     assert p.ok()
 
 
+@pytest.mark.asyncio
+async def test_insert_blob_and_detect_buffer(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    chat_blob = res.BlobData(
+        blob_type=BlobType.chat,
+        blob_data={"messages": [{"role": "user", "content": "Hello world"}]},
+    )
+    p = await controllers.buffer.insert_blob_and_detect_buffer(
+        u_id, DEFAULT_PROJECT_ID, chat_blob
+    )
+    assert p.ok()
+    blob_id, process_ids = p.data()
+    assert process_ids.ids == []
+    p = await controllers.blob.get_blob(u_id, DEFAULT_PROJECT_ID, blob_id.id)
+    assert p.ok()
+    p = await controllers.buffer.get_buffer_capacity(
+        u_id, DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    assert p.ok() and p.data() == 1
+
+    large_blob = res.BlobData(
+        blob_type=BlobType.chat,
+        blob_data={
+            "messages": [
+                {
+                    "role": "user",
+                    "content": "Hello world " * CONFIG.max_chat_blob_buffer_token_size,
+                }
+            ]
+        },
+    )
+    p = await controllers.buffer.insert_blob_and_detect_buffer(
+        u_id, DEFAULT_PROJECT_ID, large_blob
+    )
+    assert p.ok()
+    _, process_ids = p.data()
+    assert len(process_ids.ids) == 2
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
 @pytest.mark.asyncio
 async def test_user_blob_curd(db_env):
     p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
@@ -268,7 +517,7 @@ async def test_filter_user_events(db_env, mock_event_get_embedding):
         assert p.ok()
         event_ids.append(p.data())
 
-    assert mock_event_get_embedding.await_count == len(test_events) * 2
+    assert mock_event_get_embedding.await_count == len(test_events)
     # Test 1: Filter by tag existence - events that have 'emotion' tag
     p = await controllers.event.filter_user_events(
         u_id, DEFAULT_PROJECT_ID, has_event_tag=["emotion"]
@@ -449,8 +698,187 @@ async def test_filter_user_events_edge_cases(db_env, mock_event_get_embedding):
     events = p.data().events
     assert len(events) == 0
 
-    assert mock_event_get_embedding.await_count == 2 * 2
+    assert mock_event_get_embedding.await_count == 2
 
     # Cleanup
     p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
     assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_billing_delta_reconcile(db_env):
+    from sqlalchemy import select, update
+    from memobase_server.connectors import AsyncSession
+    from memobase_server.models.database import Billing, ProjectBilling
+
+    billing_id_stmt = select(ProjectBilling.billing_id).where(
+        ProjectBilling.project_id == DEFAULT_PROJECT_ID
+    )
+
+    async def usage_left() -> int:
+        async with AsyncSession() as session:
+            return (
+                await session.execute(
+                    select(Billing.usage_left).where(Billing.id.in_(billing_id_stmt))
+                )
+            ).scalar_one()
+
+    await controllers.billing.reconcile_billing_deltas()
+    original = await usage_left()
+    async with AsyncSession() as session:
+        await session.execute(
+            update(Billing)
+            .where(Billing.id.in_(billing_id_stmt))
+            .values(usage_left=1000)
+        )
+        await session.commit()
+    try:
+        p = await controllers.billing.project_cost_token_billing(
+            DEFAULT_PROJECT_ID, 10, 20
+        )
+        assert p.ok()
+        assert await usage_left() == 1000
+
+        p = await controllers.billing.get_project_billing(DEFAULT_PROJECT_ID)
+        assert p.ok()
+        assert p.data().token_left == 970
+
+        await controllers.billing.reconcile_billing_deltas()
+        assert await usage_left() == 970
+        p = await controllers.billing.get_project_billing(DEFAULT_PROJECT_ID)
+        assert p.data().token_left == 970
+    finally:
+        async with AsyncSession() as session:
+            await session.execute(
+                update(Billing)
+                .where(Billing.id.in_(billing_id_stmt))
+                .values(usage_left=original)
+            )
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_billing_refill_drops_pending_delta(db_env):
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, update
+    from memobase_server.connectors import AsyncSession
+    from memobase_server.env import BILLING_REFILL_AMOUNT_MAP, BillingStatus
+    from memobase_server.models.database import Billing, ProjectBilling
+
+    billing_id_stmt = select(ProjectBilling.billing_id).where(
+        ProjectBilling.project_id == DEFAULT_PROJECT_ID
+    )
+
+    async def set_billing(**values):
+        async with AsyncSession() as session:
+            await session.execute(
+                update(Billing).where(Billing.id.in_(billing_id_stmt)).values(**values)
+            )
+            await session.commit()
+
+    await controllers.billing.reconcile_billing_deltas()
+    async with AsyncSession() as session:
+        original = (
+            await session.execute(
+                select(Billing.usage_left, Billing.next_refill_at).where(
+                    Billing.id.in_(billing_id_stmt)
+                )
+            )
+        ).one()
+    await set_billing(
+        usage_left=100, next_refill_at=datetime.now() - timedelta(days=1)
+    )
+    try:
+        with patch.dict(BILLING_REFILL_AMOUNT_MAP, {BillingStatus.free: 1000}):
+            # Last month's usage, still pending in redis
+            await controllers.billing.project_cost_token_billing(
+                DEFAULT_PROJECT_ID, 10, 20
+            )
+            p = await controllers.billing.get_project_billing(DEFAULT_PROJECT_ID)
+            assert p.data().token_left == 1000
+
+            await controllers.billing.reconcile_billing_deltas()
+            p = await controllers.billing.get_project_billing(DEFAULT_PROJECT_ID)
+            assert p.data().token_left == 1000
+    finally:
+        await set_billing(
+            usage_left=original.usage_left, next_refill_at=original.next_refill_at
+        )
+
+
+@pytest.mark.asyncio
+async def test_truncate_profiles_by_stored_token_size():
+    from uuid import uuid4
+    from datetime import datetime, timedelta
+
+    now = datetime.now()
+    profiles = res.UserProfilesData(
+        profiles=[
+            res.ProfileData(
+                id=uuid4(),
+                content=f"p{i}",
+                attributes={"topic": "t", "sub_topic": f"s{i}"},
+                created_at=now - timedelta(minutes=i),
+                updated_at=now - timedelta(minutes=i),
+                token_size=size,
+            )
+            for i, size in enumerate([10, None, 30])
+        ]
+    )
+    # Only the row written before token_size was stored is counted again
+    with patch(
+        "memobase_server.controllers.profile.get_profile_token_size",
+        return_value=20,
+    ) as mock_size:
+        p = await controllers.profile.truncate_profiles(
+            profiles.model_copy(deep=True), max_token_size=30
+        )
+    assert [pf.content for pf in p.data().profiles] == ["p0", "p1"]
+    mock_size.assert_called_once_with("p1", {"topic": "t", "sub_topic": "s1"})
+
+    # Kept in the cache, left out of responses
+    first = profiles.profiles[0]
+    cached = res.ProfileData.model_validate_json(
+        controllers.profile.profile_to_cache_json(first)
+    )
+    assert cached.token_size == 10
+    assert cached.updated_at == first.updated_at
+    assert "token_size" not in first.model_dump_json()
+
+    # Missing timestamps and token_size come back as the defaults
+    bare = res.ProfileData(id=uuid4(), content="p", attributes={"topic": "t"})
+    cached = res.ProfileData.model_validate_json(
+        controllers.profile.profile_to_cache_json(bare)
+    )
+    assert cached == bare
+
+
+@pytest.mark.asyncio
+async def test_truncate_event_gists_by_stored_token_size():
+    from uuid import uuid4
+
+    gists = res.UserEventGistsData(
+        gists=[
+            res.UserEventGistData(
+                id=uuid4(),
+                gist_data=res.EventGistData(content=f"- gist {i}"),
+                token_size=size,
+            )
+            for i, size in enumerate([None, 20, 30])
+        ]
+    )
+    with patch(
+        "memobase_server.controllers.event_gist.get_encoded_tokens",
+        return_value=[0] * 10,
+    ) as mock_encode:
+        p = await controllers.event_gist.truncate_event_gists(
+            gists.model_copy(deep=True), max_token_size=5
+        )
+        # Unlike profiles, no gist is kept when the first one is over the limit
+        assert p.data().gists == []
+        p = await controllers.event_gist.truncate_event_gists(
+            gists.model_copy(deep=True), max_token_size=30
+        )
+        assert len(p.data().gists) == 2
+    assert mock_encode.call_count == 2
+    assert "token_size" not in p.data().model_dump_json()
@@ -1,9 +1,11 @@
 import pytest
+from sqlalchemy import select, delete
 from sqlalchemy.inspection import inspect
 from memobase_server.models.database import User, GeneralBlob, UserProfile
 from memobase_server.models.blob import BlobType
 from memobase_server.connectors import (
     Session,
+    AsyncSession,
     DB_ENGINE,
 )
 
@@ -49,3 +51,25 @@ def test_general_blob_model(db_env):
         user = session.query(User).filter_by(id=test_user_id).first()
         session.delete(user)
         session.commit()
+
+
+@pytest.mark.asyncio
+async def test_user_model_async(db_env):
+    async with AsyncSession() as session:
+        user = User(additional_fields={"name": "async_user"})
+        session.add(user)
+        await session.commit()
+        test_user_id = user.id
+
+    async with AsyncSession() as session:
+        user = (
+            await session.execute(select(User).filter_by(id=test_user_id))
+        ).scalar_one_or_none()
+        assert user is not None
+        assert user.additional_fields == {"name": "async_user"}
+
+        await session.execute(delete(User).filter_by(id=test_user_id))
+        await session.commit()
+        assert (
+            await session.execute(select(User).filter_by(id=test_user_id))
+        ).scalar_one_or_none() is None
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock
+from memobase_server.deadline import (
+    CURRENT_DEADLINE,
+    deadline_scope,
+    deadline_context,
+    without_deadline,
+    remaining_seconds,
+    within_deadline,
+)
+from memobase_server.models.utils import Promise
+from memobase_server.models.response import UserProfilesData
+from memobase_server.controllers.post_process import profile as post_profile
+
+
+@pytest.mark.asyncio
+async def test_deadline_scopes():
+    assert remaining_seconds() is None
+    with deadline_scope(1000):
+        outer = remaining_seconds()
+        assert 0 < outer <= 1
+        # Nested budgets only shorten
+        with deadline_scope(60_000):
+            assert remaining_seconds() <= outer
+        with deadline_scope(10):
+            assert remaining_seconds() <= 0.01
+            with pytest.raises(asyncio.TimeoutError):
+                await within_deadline(asyncio.sleep(1))
+        with without_deadline():
+            assert remaining_seconds() is None
+    assert remaining_seconds() is None
+
+    task = asyncio.create_task(
+        within_deadline(asyncio.sleep(1)), context=deadline_context(10)
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        await task
+    assert CURRENT_DEADLINE.get() is None
+
+
+@pytest.mark.asyncio
+async def test_profile_filter_skipped_past_deadline():
+    slow_filter_done = False
+
+    async def slow_filter(*args, **kwargs):
+        nonlocal slow_filter_done
+        await asyncio.sleep(0.05)
+        slow_filter_done = True
+        return Promise.resolve({"reason": None, "profiles": []})
+
+    mock_filter = AsyncMock(side_effect=slow_filter)
+    profiles = UserProfilesData(profiles=[])
+    with patch.dict(post_profile.PROFILE_FILTER_METHODS, {"llm": mock_filter}):
+        with deadline_scope(10):
+            skipped = await post_profile.filter_profiles_within_deadline(
+                "u", "p", profiles, [], method="llm"
+            )
+        mock_filter.assert_awaited_once()
+        # Cut off before the filter could finish
+        assert skipped and not slow_filter_done
+        assert profiles.profiles == []
+
+        skipped = await post_profile.filter_profiles_within_deadline(
+            "u", "p", profiles, [], method="llm"
+        )
+        assert not skipped and slow_filter_done
+        assert mock_filter.await_count == 2
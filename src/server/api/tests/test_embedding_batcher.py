@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+import numpy as np
+from memobase_server.llms.embeddings.batcher import EmbeddingBatcher
+
+
+def make_provider(calls: list):
+    async def provider(model, texts, phase):
+        calls.append(list(texts))
+        if any(t == "bad" for t in texts):
+            raise ValueError("bad input")
+        return np.array([[float(len(t))] for t in texts])
+
+    return provider
+
+
+@pytest.mark.asyncio
+async def test_batcher_merges_concurrent_callers():
+    calls = []
+    batcher = EmbeddingBatcher(make_provider(calls), wait_ms=10, max_size=100)
+    results = await asyncio.gather(
+        batcher.embed("m", ["a"], "query"),
+        batcher.embed("m", ["bb", "ccc"], "query"),
+        batcher.embed("m", ["dddd"], "document"),
+    )
+    assert sorted(calls) == [["a", "bb", "ccc"], ["dddd"]]
+    assert results[0].tolist() == [[1.0]]
+    assert results[1].tolist() == [[2.0], [3.0]]
+    assert results[2].tolist() == [[4.0]]
+
+
+@pytest.mark.asyncio
+async def test_batcher_max_size():
+    calls = []
+    batcher = EmbeddingBatcher(make_provider(calls), wait_ms=1000, max_size=3)
+    results = await asyncio.wait_for(
+        asyncio.gather(
+            batcher.embed("m", ["a", "b"], "query"),
+            batcher.embed("m", ["c", "d"], "query"),
+            batcher.embed("m", ["e"], "query"),
+        ),
+        timeout=0.5,
+    )
+    assert calls == [["a", "b"], ["c", "d", "e"]]
+    assert [len(r) for r in results] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_batcher_isolates_failed_caller():
+    calls = []
+    batcher = EmbeddingBatcher(make_provider(calls), wait_ms=10, max_size=100)
+    results = await asyncio.gather(
+        batcher.embed("m", ["a"], "query"),
+        batcher.embed("m", ["bad"], "query"),
+        return_exceptions=True,
+    )
+    assert results[0].tolist() == [[1.0]]
+    assert isinstance(results[1], ValueError)
+    assert calls[0] == ["a", "bad"]
@@ -0,0 +1,53 @@
+import uuid
+import pytest
+import numpy as np
+from unittest.mock import patch
+from memobase_server.env import CONFIG
+from memobase_server.llms.embeddings import get_embedding
+from memobase_server.llms.embeddings.cache import (
+    LOCAL_EMBEDDING_CACHE,
+    pack_embedding,
+    unpack_embedding,
+)
+
+
+def test_pack_embedding_roundtrip():
+    vector = np.random.rand(CONFIG.embedding_dim).astype(np.float32)
+    restored = unpack_embedding(pack_embedding(vector))
+    assert restored.shape == vector.shape
+    assert np.allclose(restored, vector, atol=1e-3)
+
+
+@pytest.mark.asyncio
+async def test_get_embedding_cached(db_env):
+    calls = []
+
+    async def fake_embedding(model, texts, phase):
+        calls.append(list(texts))
+        return np.random.rand(len(texts), CONFIG.embedding_dim)
+
+    texts = [f"embedding cache {uuid.uuid4()}", f"embedding cache {uuid.uuid4()}"]
+    with patch.dict(
+        "memobase_server.llms.embeddings.FACTORIES",
+        {CONFIG.embedding_provider: fake_embedding},
+    ):
+        p = await get_embedding("test", [texts[0], texts[0]])
+        assert p.ok()
+        first = p.data()
+        assert calls == [[texts[0]]]
+        assert np.array_equal(first[0], first[1])
+
+        p = await get_embedding("test", texts)
+        assert p.ok()
+        assert calls[1] == [texts[1]]
+        assert np.allclose(p.data()[0], first[0], atol=1e-3)
+
+        # Served from redis once the local copy is gone
+        LOCAL_EMBEDDING_CACHE.clear()
+        p = await get_embedding("test", texts)
+        assert p.ok()
+        assert len(calls) == 2
+        assert p.data().shape == (2, CONFIG.embedding_dim)
+
+        p = await get_embedding("test", texts, phase="query")
+        assert len(calls) == 3
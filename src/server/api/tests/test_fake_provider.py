@@ -0,0 +1,45 @@
+import pytest
+import numpy as np
+from unittest.mock import patch
+from memobase_server.env import CONFIG
+from memobase_server.llms.fake_llm import fake_complete
+from memobase_server.llms.embeddings.fake_embedding import fake_embedding
+from memobase_server.prompts.utils import (
+    parse_string_into_profiles,
+    parse_string_into_merge_yolo_action,
+    parse_string_into_merge_action,
+)
+
+
+@pytest.mark.asyncio
+async def test_fake_llm_answers_parse():
+    with patch.object(CONFIG, "fake_llm_latency_ms", 0):
+        r = await fake_complete(
+            "m", "user: I moved to Berlin", prompt_id="zh_extract_profile"
+        )
+        again = await fake_complete(
+            "m", "user: I moved to Berlin", prompt_id="zh_extract_profile"
+        )
+        assert r.text == again.text
+        assert len(parse_string_into_profiles(r.text).facts) == 3
+        assert r.input_tokens > 0 and r.output_tokens > 0
+
+        r = await fake_complete(
+            "m",
+            "[{'memo_id': 1, 'new_info': 'a'}, {'memo_id': 2, 'new_info': 'b'}]",
+            prompt_id="merge_profile_yolo",
+        )
+        assert set(parse_string_into_merge_yolo_action(r.text)) == {1, 2}
+
+        r = await fake_complete("m", "anything", prompt_id="merge_profile")
+        assert parse_string_into_merge_action(r.text)["action"] == "APPEND"
+
+
+@pytest.mark.asyncio
+async def test_fake_embedding_is_deterministic():
+    with patch.object(CONFIG, "fake_embedding_latency_ms", 0):
+        a = await fake_embedding("m", ["hello", "world"])
+        b = await fake_embedding("m", ["hello"])
+    assert a.shape == (2, CONFIG.embedding_dim)
+    assert np.allclose(a[0], b[0])
+    assert np.allclose(np.linalg.norm(a, axis=1), 1)
@@ -0,0 +1,48 @@
+from memobase_server.controllers.flush_scheduler import FlushJob, FlushScheduler
+
+
+def job(message_id: str, project_id: str, user_id: str) -> FlushJob:
+    return FlushJob(message_id, {"project_id": project_id, "user_id": user_id})
+
+
+def test_round_robin_across_projects():
+    scheduler = FlushScheduler(concurrency=4, max_queued=10)
+    for i in range(3):
+        scheduler.add(job(f"a{i}", "a", f"u{i}"))
+    scheduler.add(job("b0", "b", "v0"))
+    scheduler.add(job("c0", "c", "w0"))
+
+    started = [scheduler.next_job().message_id for _ in range(4)]
+    assert started == ["a0", "b0", "c0", "a1"]
+    # concurrency is full
+    assert scheduler.next_job() is None
+    assert scheduler.queued() == 1
+
+
+def test_one_job_per_user():
+    scheduler = FlushScheduler(concurrency=4, max_queued=10)
+    scheduler.add(job("1", "a", "u"))
+    scheduler.add(job("2", "a", "u"))
+    scheduler.add(job("3", "a", "v"))
+
+    first = scheduler.next_job()
+    assert first.message_id == "1"
+    # u is running, its next job waits behind v's
+    assert scheduler.next_job().message_id == "3"
+    assert scheduler.next_job() is None
+
+    scheduler.done(first)
+    assert scheduler.next_job().message_id == "2"
+
+
+def test_fetch_room_and_drain():
+    scheduler = FlushScheduler(concurrency=1, max_queued=3)
+    for i in range(3):
+        scheduler.add(job(str(i), "a", f"u{i}"))
+    assert scheduler.fetch_room() == 0
+    scheduler.next_job()
+    assert scheduler.fetch_room() == 1
+    assert scheduler.queued_message_ids() == ["1", "2"]
+
+    assert [j.message_id for j in scheduler.drain()] == ["1", "2"]
+    assert scheduler.queued() == 0
@@ -0,0 +1,176 @@
+import json
+import time
+import uuid
+import pytest
+import pytest_asyncio
+from unittest.mock import patch, AsyncMock
+from memobase_server.models.response import CODE
+from memobase_server.models.blob import BlobType
+from memobase_server.models.utils import Promise
+from memobase_server.models.database import DEFAULT_PROJECT_ID
+from memobase_server.connectors import get_redis_client
+from memobase_server.controllers import flush_queue
+from memobase_server.controllers.buffer_background import get_user_lock_key
+
+
+@pytest_asyncio.fixture
+async def flush_stream(db_env):
+    # A stream of our own, so a running worker can't take the test jobs
+    suffix = uuid.uuid4().hex
+    keys = {
+        "FLUSH_STREAM_KEY": f"test:flush_stream:{suffix}",
+        "FLUSH_DEAD_STREAM_KEY": f"test:flush_stream_dead:{suffix}",
+        "FLUSH_DELAYED_KEY": f"test:flush_delayed:{suffix}",
+    }
+    with patch.multiple(flush_queue, **keys), patch.object(
+        flush_queue, "mark_buffers_failed", AsyncMock()
+    ):
+        await flush_queue.ensure_flush_group()
+        yield keys
+    async with get_redis_client() as redis_client:
+        await redis_client.delete(*keys.values())
+
+
+async def enqueue(user_id: str, attempt: int = 0) -> str:
+    return await flush_queue.enqueue_flush_job(
+        user_id, DEFAULT_PROJECT_ID, BlobType.chat, [str(uuid.uuid4())], attempt
+    )
+
+
+async def read_one(worker: flush_queue.FlushWorker) -> tuple[str, dict]:
+    messages = await worker.read_new(1, block=False)
+    assert len(messages) == 1
+    return messages[0]
+
+
+async def pending_count(keys: dict) -> int:
+    async with get_redis_client() as redis_client:
+        pending = await redis_client.xpending(
+            keys["FLUSH_STREAM_KEY"], flush_queue.FLUSH_GROUP
+        )
+    return pending["pending"]
+
+
+async def stream_fields(key: str) -> list[dict]:
+    async with get_redis_client() as redis_client:
+        return [fields for _, fields in await redis_client.xrange(key)]
+
+
+@pytest.mark.asyncio
+async def test_flush_job_ack(flush_stream):
+    worker = flush_queue.FlushWorker("test-worker", concurrency=1)
+    user_id = str(uuid.uuid4())
+    await enqueue(user_id)
+    message_id, fields = await read_one(worker)
+    assert fields["user_id"] == user_id
+
+    with patch.object(
+        flush_queue,
+        "flush_buffer_by_ids",
+        AsyncMock(return_value=Promise.resolve(None)),
+    ) as mock_flush:
+        await worker.handle(message_id, fields)
+    mock_flush.assert_awaited_once()
+    assert await pending_count(flush_stream) == 0
+    # Deleted with the ack
+    assert await stream_fields(flush_stream["FLUSH_STREAM_KEY"]) == []
+
+    # The user lock is released
+    async with get_redis_client() as redis_client:
+        assert not await redis_client.exists(
+            get_user_lock_key(
+                user_id, DEFAULT_PROJECT_ID, f"flush_buffer_background_{BlobType.chat}"
+            )
+        )
+
+
+@pytest.mark.asyncio
+async def test_flush_job_retry_then_dead_letter(flush_stream):
+    worker = flush_queue.FlushWorker("test-worker", concurrency=1, max_retries=1)
+    await enqueue(str(uuid.uuid4()))
+
+    with patch.object(
+        flush_queue,
+        "flush_buffer_by_ids",
+        AsyncMock(return_value=Promise.reject(CODE.INTERNAL_SERVER_ERROR, "boom")),
+    ):
+        message_id, fields = await read_one(worker)
+        await worker.handle(message_id, fields)
+        message_id, fields = await read_one(worker)
+        assert fields["attempt"] == "1"
+
+        await worker.handle(message_id, fields)
+    assert await worker.read_new(1, block=False) == []
+    assert await pending_count(flush_stream) == 0
+    assert await stream_fields(flush_stream["FLUSH_STREAM_KEY"]) == []
+    dead = await stream_fields(flush_stream["FLUSH_DEAD_STREAM_KEY"])
+    assert len(dead) == 1 and "boom" in dead[0]["reason"]
+    flush_queue.mark_buffers_failed.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_reclaim_stale_job(flush_stream):
+    crashed = flush_queue.FlushWorker("test-crashed", concurrency=1)
+    await enqueue(str(uuid.uuid4()))
+    message_id, _ = await read_one(crashed)
+
+    alive = flush_queue.FlushWorker(
+        "test-alive", concurrency=1, visibility_timeout_s=60, max_retries=1
+    )
+    # Not idle long enough yet
+    assert await alive.reclaim_stale(1) == []
+
+    alive.visibility_timeout_s = 0
+    reclaimed = await alive.reclaim_stale(1)
+    assert [m for m, _ in reclaimed] == [message_id]
+
+    # Delivered once more than the retries allow
+    assert await alive.reclaim_stale(1) == []
+    assert len(await stream_fields(flush_stream["FLUSH_DEAD_STREAM_KEY"])) == 1
+    assert await pending_count(flush_stream) == 0
+
+
+@pytest.mark.asyncio
+async def test_busy_user_requeue(flush_stream):
+    worker = flush_queue.FlushWorker("test-worker", concurrency=1, max_busy_requeues=2)
+    user_id = str(uuid.uuid4())
+    user_key = get_user_lock_key(
+        user_id, DEFAULT_PROJECT_ID, f"flush_buffer_background_{BlobType.chat}"
+    )
+    async with get_redis_client() as redis_client:
+        await redis_client.set(user_key, "someone-else", ex=60)
+    await enqueue(user_id)
+
+    mock_flush = AsyncMock(return_value=Promise.resolve(None))
+    try:
+        with patch.object(flush_queue, "flush_buffer_by_ids", mock_flush):
+            for busy in (1, 2):
+                message_id, fields = await read_one(worker)
+                await worker.handle(message_id, fields)
+                # Acked and parked in the delayed set, not back in the stream
+                assert await pending_count(flush_stream) == 0
+                assert await worker.read_new(1, block=False) == []
+                async with get_redis_client() as redis_client:
+                    delayed = await redis_client.zrange(
+                        flush_stream["FLUSH_DELAYED_KEY"], 0, -1, withscores=True
+                    )
+                assert len(delayed) == 1
+                member, due = delayed[0]
+                assert json.loads(member)["busy"] == str(busy)
+                assert due > time.time()
+
+                # Make it due
+                async with get_redis_client() as redis_client:
+                    await redis_client.zadd(
+                        flush_stream["FLUSH_DELAYED_KEY"], {member: 0}
+                    )
+                await worker.promote_delayed()
+
+            message_id, fields = await read_one(worker)
+            await worker.handle(message_id, fields)
+    finally:
+        async with get_redis_client() as redis_client:
+            await redis_client.delete(user_key)
+    mock_flush.assert_not_awaited()
+    dead = await stream_fields(flush_stream["FLUSH_DEAD_STREAM_KEY"])
+    assert len(dead) == 1 and "busy" in dead[0]["reason"]
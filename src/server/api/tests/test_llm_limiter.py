@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from memobase_server.llms.limiter import (
+    LLMRateLimiter,
+    PrioritySemaphore,
+    PRIORITY_ORDER,
+)
+
+
+@pytest.mark.asyncio
+async def test_priority_semaphore_wakes_read_first():
+    slots = PrioritySemaphore(1)
+    await slots.acquire(PRIORITY_ORDER["background"])
+    order = []
+
+    async def worker(name: str, priority: str):
+        await slots.acquire(PRIORITY_ORDER[priority])
+        order.append(name)
+        slots.release()
+
+    tasks = [
+        asyncio.create_task(worker("background-1", "background")),
+        asyncio.create_task(worker("background-2", "background")),
+        asyncio.create_task(worker("read", "read")),
+    ]
+    await asyncio.sleep(0)
+    slots.release()
+    await asyncio.gather(*tasks)
+    assert order == ["read", "background-1", "background-2"]
+
+
+@pytest.mark.asyncio
+async def test_priority_semaphore_cancelled_waiter():
+    slots = PrioritySemaphore(1)
+    await slots.acquire(PRIORITY_ORDER["read"])
+    waiter = asyncio.create_task(slots.acquire(PRIORITY_ORDER["read"]))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    slots.release()
+    # the cancelled waiter must not swallow the slot
+    await asyncio.wait_for(slots.acquire(PRIORITY_ORDER["background"]), 1)
+
+
+@pytest.mark.asyncio
+async def test_priority_semaphore_waiting():
+    slots = PrioritySemaphore(1)
+    await slots.acquire(PRIORITY_ORDER["background"])
+    assert slots.waiting() == 0
+    waiter = asyncio.create_task(slots.acquire(PRIORITY_ORDER["background"]))
+    await asyncio.sleep(0)
+    assert slots.waiting() == 1
+    slots.release()
+    await waiter
+    assert slots.waiting() == 0
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_budget_holds_no_slot():
+    limiter = LLMRateLimiter(1)
+    budget_free = asyncio.Event()
+
+    async def reserve_budget(reservation, start):
+        if reservation.priority == "background":
+            await budget_free.wait()
+
+    with patch.object(limiter, "_reserve_budget", side_effect=reserve_budget):
+        background = asyncio.create_task(limiter.acquire("m", 10, "background"))
+        await asyncio.sleep(0)
+        # The background call is over its budget, reads still get the slot
+        reservation = await asyncio.wait_for(limiter.acquire("m", 10, "read"), 1)
+        limiter.release(reservation)
+        budget_free.set()
+        limiter.release(await asyncio.wait_for(background, 1))
@@ -0,0 +1,56 @@
+import time
+import pytest
+from unittest.mock import patch
+from memobase_server.local_cache import LocalTTLCache
+from memobase_server.auth import token
+
+
+def test_local_cache_lru_eviction():
+    cache = LocalTTLCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_local_cache_ttl():
+    cache = LocalTTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=-1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    # Read before patching, the patch replaces time.monotonic module-wide
+    now = time.monotonic()
+    with patch("memobase_server.local_cache.time.monotonic", return_value=now + 61):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_check_project_secret_local_hit():
+    project_id = "local-cache-test"
+    token.LOCAL_SECRET_CACHE.set(project_id, token.hash_secret("sk-right"))
+    with patch("memobase_server.auth.token.get_redis_client") as mock_redis:
+        p = await token.check_project_secret(project_id, "sk-right")
+        assert p.ok() and p.data()
+        p = await token.check_project_secret(project_id, "sk-wrong")
+        assert p.ok() and not p.data()
+        mock_redis.assert_not_called()
+    token.evict_local_project_auth(project_id)
+    assert token.LOCAL_SECRET_CACHE.get(project_id) is None
+
+
+def test_local_cache_max_bytes():
+    cache = LocalTTLCache(maxsize=100, ttl=None, max_bytes=10, sizeof=len)
+    cache.set("a", "xxxx")
+    cache.set("b", "xxxx")
+    cache.set("a", "xxxxx")
+    assert cache.total_bytes == 9
+    cache.set("c", "xxxx")
+    assert cache.get("b") is None
+    assert cache.get("a") == "xxxxx"
+    assert cache.get("c") == "xxxx"
+    assert cache.total_bytes == 9
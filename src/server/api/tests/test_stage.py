@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from memobase_server.telemetry import stage
+from memobase_server.telemetry.stage import (
+    CURRENT_FLUSH_TIMINGS,
+    stage_timer,
+    timed_flush,
+)
+
+
+@pytest.mark.asyncio
+async def test_timed_flush_collects_concurrent_stages():
+    @timed_flush("chat")
+    async def process_blobs(user_id, project_id, blobs):
+        async def run(name):
+            with stage_timer(project_id, name, prompt_id=f"{name}_prompt"):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(run("extract"), run("tag_event"))
+        with stage_timer(project_id, "profile_db_write"):
+            pass
+        return CURRENT_FLUSH_TIMINGS.get()
+
+    with patch.object(stage.TRACE_LOG, "info") as mock_log, patch.object(
+        stage.telemetry_manager, "record_histogram_metric"
+    ) as mock_histogram:
+        timings = await process_blobs("u", "p", [])
+
+    assert CURRENT_FLUSH_TIMINGS.get() is None
+    assert sorted(name for name, _ in timings.stages) == [
+        "extract",
+        "profile_db_write",
+        "tag_event",
+    ]
+    assert mock_histogram.call_count == 3
+    assert {
+        "project_id": "p",
+        "stage": "extract",
+        "prompt_id": "extract_prompt",
+    } in [c.args[2] for c in mock_histogram.call_args_list]
+    project_id, user_id, message = mock_log.call_args.args
+    assert (project_id, user_id) == ("p", "u")
+    assert message.startswith("Flushed chat blobs in ")
+    assert "profile_db_write" in message
+
+
+@pytest.mark.asyncio
+async def test_stage_timer_records_failed_stage():
+    with patch.object(
+        stage.telemetry_manager, "record_histogram_metric"
+    ) as mock_histogram:
+        with pytest.raises(ValueError):
+            with stage_timer("p", "merge"):
+                raise ValueError()
+    assert mock_histogram.call_args.args[2] == {"project_id": "p", "stage": "merge"}
@@ -214,4 +214,4 @@ async def test_summary_buffer_modal(
     mock_extract_llm_complete.assert_awaited_once()
     assert mock_merge_llm_complete.await_count == 1
     mock_event_tag_llm_complete.assert_awaited_once()
-    assert mock_event_get_embedding.await_count == 2
+    assert mock_event_get_embedding.await_count == 1